@@ -0,0 +1,2 @@
+# Connects the connection_created hooks before any database is opened.
+from mysite import commit_hooks, sqlite_pragmas
@@ -0,0 +1,46 @@
+"""
+Callbacks run once a transaction has committed.
+
+Django runs nothing on commit, so after_commit() queues callbacks on the
+connection and they're run by its commit(), which this module wraps as
+each connection is created. Rolling the transaction back drops them, but
+rolling back to a savepoint doesn't, so they should be harmless to run
+for nothing. Outside a transaction there's nothing to wait for, so they
+run straight away.
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def after_commit(func, using=DEFAULT_DB_ALIAS):
+    """
+    Call ``func`` once the transaction open on ``using`` commits, or now if
+    there isn't one.
+    """
+    connection = connections[using]
+    if not connection.in_atomic_block or not hasattr(connection, '_after_commit'):
+        func()
+        return
+    connection._after_commit.append(func)
+
+
+@receiver(connection_created)
+def install_commit_hooks(sender, connection, **kwargs):
+    if hasattr(connection, '_after_commit'):
+        return
+    connection._after_commit = []
+    commit, rollback = connection.commit, connection.rollback
+
+    def commit_then_call_back():
+        commit()
+        callbacks, connection._after_commit[:] = connection._after_commit[:], []
+        for func in callbacks:
+            func()
+
+    def rollback_and_forget():
+        del connection._after_commit[:]
+        rollback()
+
+    connection.commit = commit_then_call_back
+    connection.rollback = rollback_and_forget
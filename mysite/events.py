@@ -0,0 +1,146 @@
+"""
+Server-Sent Events entry point for mysite, to run next to the WSGI app.
+
+Serves live vote counts at /poll/<id>/events/ from a single-threaded
+asyncore loop, so thousands of idle subscribers cost a socket each rather
+than a thread each. Start it with::
+
+    python -m mysite.events [host:port] [max updates per second]
+"""
+import asynchat
+import asyncore
+import logging
+import os
+import re
+import socket
+import sys
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+
+from django.db import connection
+
+from polls.models import Poll
+from polls.streaming import ResultsFeed
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = re.compile(r'^/poll/(\d+)/events/$')
+
+# Comment lines keep idle connections open through proxies and flush out
+# clients that have gone away.
+HEARTBEAT_INTERVAL = 15
+
+
+class EventStream(asynchat.async_chat):
+
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.server = server
+        self.poll_id = None
+        self._request = []
+        self.set_terminator('\r\n\r\n')
+
+    # Streams are kept in sets; stop asyncore forwarding this to the socket.
+    def __hash__(self):
+        return id(self)
+
+    def collect_incoming_data(self, data):
+        # Clients have nothing to say once subscribed; don't buffer it.
+        if self.poll_id is None:
+            self._request.append(data)
+
+    def found_terminator(self):
+        if self.poll_id is not None:
+            return
+        request_line = ''.join(self._request).split('\r\n', 1)[0].split()
+        match = len(request_line) == 3 and request_line[0] == 'GET' and EVENTS_PATH.match(request_line[1])
+        if not match:
+            return self.refuse('404 Not Found')
+        try:
+            snapshot = self.server.feed.subscribe(int(match.group(1)), self)
+        except Poll.DoesNotExist:
+            return self.refuse('404 Not Found')
+        self.poll_id = int(match.group(1))
+        self.set_terminator(None)
+        self.push(
+            'HTTP/1.1 200 OK\r\n'
+            'Content-Type: text/event-stream\r\n'
+            'Cache-Control: no-cache\r\n'
+            'Connection: keep-alive\r\n'
+            '\r\n' + snapshot
+        )
+
+    def refuse(self, status):
+        self.push('HTTP/1.1 %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n' % status)
+        self.close_when_done()
+
+    def handle_close(self):
+        if self.poll_id is not None:
+            self.server.feed.unsubscribe(self.poll_id, self)
+        self.close()
+
+
+class EventServer(asyncore.dispatcher):
+
+    def __init__(self, host, port, max_rate=2):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.feed = ResultsFeed()
+        self.max_rate = max_rate
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(1024)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            EventStream(pair[0], self)
+
+    def publish(self):
+        for poll_id, event in self.feed.changes():
+            for subscriber in list(self.feed.subscribers.get(poll_id, ())):
+                subscriber.push(event)
+
+    def heartbeat(self):
+        for subscribers in self.feed.subscribers.values():
+            for subscriber in list(subscribers):
+                subscriber.push(':\n\n')
+
+    def serve_forever(self):
+        """
+        Run the loop, publishing changes at most max_rate times a second.
+        """
+        interval = 1.0 / self.max_rate
+        next_publish = next_heartbeat = time.time()
+        while True:
+            # poll() rather than select() to get past 1024 sockets
+            asyncore.loop(timeout=max(0, next_publish - time.time()), use_poll=True,
+                          map=self.map, count=1)
+            now = time.time()
+            if now >= next_publish:
+                try:
+                    self.publish()
+                except Exception:
+                    # Most likely the database; try again next tick with a
+                    # fresh connection.
+                    logger.exception("Failed to publish poll results")
+                    connection.close()
+                next_publish = now + interval
+            if now >= next_heartbeat:
+                self.heartbeat()
+                next_heartbeat = now + HEARTBEAT_INTERVAL
+
+
+def main(argv):
+    address = argv[1] if len(argv) > 1 else '127.0.0.1:8001'
+    host, port = address.rsplit(':', 1)
+    max_rate = float(argv[2]) if len(argv) > 2 else 2
+    server = EventServer(host, int(port), max_rate)
+    sys.stdout.write("Streaming poll results on http://%s/poll/<id>/events/\n" % address)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,222 @@
+"""
+Per-view request instrumentation.
+
+Add 'mysite.instrumentation.InstrumentationMiddleware' to the top of
+MIDDLEWARE_CLASSES to record, for every request, the number of SQL
+queries, the time spent in the database and in template rendering, and
+the total latency. They're aggregated per view into histograms that
+staff can read as JSON from /_stats/. Requests over the REQUEST_BUDGETS
+are logged as warnings to the 'mysite.instrumentation' logger.
+
+Measuring costs a couple of clock reads per query and per template; the
+hooks do nothing outside an instrumented request.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.backends import util
+from django.http import HttpResponse
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, plus an overflow bucket.
+MS_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+QUERY_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500]
+
+METRICS = (
+    ('queries', QUERY_BUCKETS),
+    ('db_ms', MS_BUCKETS),
+    ('template_ms', MS_BUCKETS),
+    ('total_ms', MS_BUCKETS),
+)
+
+_local = threading.local()
+
+
+class RequestTimings(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.view = '<unresolved>'
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def as_metrics(self):
+        return {
+            'queries': self.queries,
+            'db_ms': self.db_time * 1000,
+            'template_ms': self.template_time * 1000,
+            'total_ms': (time.time() - self.start) * 1000,
+        }
+
+
+class Histogram(object):
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def as_dict(self):
+        labels = ['<=%s' % bound for bound in self.bounds] + ['>%s' % self.bounds[-1]]
+        requests = sum(self.counts)
+        return {
+            'mean': self.total / float(requests) if requests else 0,
+            'max': self.max,
+            'buckets': dict((label, count) for label, count in zip(labels, self.counts) if count),
+        }
+
+
+class ViewStats(object):
+    """
+    Histograms of every metric for all the requests one view has served.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.histograms = dict((name, Histogram(bounds)) for name, bounds in METRICS)
+
+    def add(self, metrics):
+        self.requests += 1
+        for name, value in metrics.items():
+            self.histograms[name].add(value)
+
+    def as_dict(self):
+        stats = dict((name, histogram.as_dict()) for name, histogram in self.histograms.items())
+        stats['requests'] = self.requests
+        return stats
+
+
+class StatsRegistry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def add(self, view, metrics):
+        with self._lock:
+            if view not in self._views:
+                self._views[view] = ViewStats()
+            self._views[view].add(metrics)
+
+    def as_dict(self):
+        with self._lock:
+            return dict((view, stats.as_dict()) for view, stats in self._views.items())
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+
+stats = StatsRegistry()
+
+
+def _timed_execute(method):
+    def execute(self, *args, **kwargs):
+        timings = getattr(_local, 'timings', None)
+        if timings is None:
+            return method(self, *args, **kwargs)
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            timings.queries += 1
+            timings.db_time += time.time() - start
+    return execute
+
+
+def _timed_render(method):
+    def render(self, context):
+        timings = getattr(_local, 'timings', None)
+        # Only time the outermost template; includes are part of it.
+        if timings is None or timings.template_depth:
+            return method(self, context)
+        timings.template_depth += 1
+        start = time.time()
+        try:
+            return method(self, context)
+        finally:
+            timings.template_depth -= 1
+            timings.template_time += time.time() - start
+    return render
+
+
+_hooks_lock = threading.Lock()
+_hooks_installed = False
+
+
+def install_hooks():
+    """
+    Wrap query execution and template rendering so they report to the
+    current request's timings. Safe to call more than once.
+    """
+    global _hooks_installed
+    with _hooks_lock:
+        if _hooks_installed:
+            return
+        # CursorDebugWrapper calls these too, so DEBUG doesn't double count.
+        util.CursorWrapper.execute = _timed_execute(util.CursorWrapper.execute)
+        util.CursorWrapper.executemany = _timed_execute(util.CursorWrapper.executemany)
+        Template.render = _timed_render(Template.render)
+        _hooks_installed = True
+
+
+def over_budget(view, metrics):
+    """
+    Return the names of the metrics where ``view`` went over its budget.
+    REQUEST_BUDGETS maps view names, or '*' for any view, to per-metric
+    limits.
+    """
+    budgets = getattr(settings, 'REQUEST_BUDGETS', {})
+    budget = dict(budgets.get('*', {}), **budgets.get(view, {}))
+    return sorted(name for name, limit in budget.items() if metrics.get(name, 0) > limit)
+
+
+class InstrumentationMiddleware(object):
+
+    def __init__(self):
+        install_hooks()
+
+    def process_request(self, request):
+        _local.timings = RequestTimings()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.view = '%s.%s' % (view_func.__module__, getattr(view_func, '__name__', 'view'))
+
+    def process_response(self, request, response):
+        timings = getattr(_local, 'timings', None)
+        if timings is None:
+            return response
+        _local.timings = None
+        metrics = timings.as_metrics()
+        stats.add(timings.view, metrics)
+        exceeded = over_budget(timings.view, metrics)
+        if exceeded:
+            logger.warning(
+                "%s %s (%s) over budget on %s: %d queries, %.1fms db, %.1fms templates, %.1fms total",
+                request.method, request.path, timings.view, ", ".join(exceeded),
+                metrics['queries'], metrics['db_ms'], metrics['template_ms'], metrics['total_ms'],
+            )
+        return response
+
+
+@staff_member_required
+def stats_view(request):
+    return HttpResponse(json.dumps(stats.as_dict(), indent=2, sort_keys=True),
+                        content_type='application/json')
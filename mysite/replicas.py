@@ -0,0 +1,111 @@
+"""
+Sends reads to read-only replicas of the database.
+
+List the aliases of the replicas in DATABASE_REPLICAS and ReplicaRouter
+spreads reads across them at random. Writes, and reads inside a
+transaction on the primary, always go to 'default'. A local replica can
+be a copy of an SQLite file::
+
+    DATABASES['replica'] = dict(DATABASES['default'], NAME='replica.sqlite', TEST_MIRROR='default')
+    DATABASE_REPLICAS = ('replica',)
+
+Replicas lag behind the primary, so a voter redirected back to the poll
+could miss their own vote. PrimaryPinMiddleware sends every read of a
+POST (or other unsafe) request to the primary, then sets a cookie that
+does the same for that client's requests for the next
+REPLICA_PIN_SECONDS. The cookie isn't signed: all forging it gets you is
+fresher reads.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+COOKIE = 'use_primary'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_local = threading.local()
+
+
+def replicas():
+    return tuple(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def pinned_to_primary():
+    """
+    Whether reads on this thread have to go to the primary right now,
+    rather than to a replica. Always False if there are no replicas.
+    """
+    if not replicas():
+        return False
+    return (getattr(_local, 'depth', 0) > 0 or getattr(_local, 'request', False)
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block)
+
+
+@contextmanager
+def use_primary():
+    """
+    Send reads on this thread to the primary until the block exits.
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+
+
+def pin_client(response):
+    """
+    Send the reads of the client ``response`` goes to to the primary for
+    the next REPLICA_PIN_SECONDS, long enough for the replicas to catch
+    up with what it just wrote.
+    """
+    if replicas():
+        response.set_cookie(COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+
+
+class ReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or pinned_to_primary():
+            return DEFAULT_DB_ALIAS
+        # Keep following an object's relations on the database it came from.
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in aliases:
+            return instance._state.db
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias is the same data, so objects from any of them go together.
+        databases = (DEFAULT_DB_ALIAS,) + replicas()
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        # Replicas get their tables from the primary.
+        return db not in replicas()
+
+
+class PrimaryPinMiddleware(object):
+    """
+    Sends the reads of requests that write, and of the client's requests
+    for REPLICA_PIN_SECONDS afterwards, to the primary. Goes near the top
+    of MIDDLEWARE_CLASSES, ahead of anything that reads the database.
+    """
+
+    def process_request(self, request):
+        _local.request = request.method not in SAFE_METHODS or COOKIE in request.COOKIES
+
+    def process_response(self, request, response):
+        _local.request = False
+        if request.method not in SAFE_METHODS:
+            pin_client(response)
+        return response
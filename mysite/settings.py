@@ -17,9 +17,21 @@ DATABASES = {
         'PASSWORD': '',                  # Not used with sqlite3.
         'HOST': '',                      # Set to empty string for localhost. Not used with sqlite3.
         'PORT': '',                      # Set to empty string for default. Not used with sqlite3.
+        # Use a file rather than :memory: so threaded tests get real
+        # concurrent connections, like production does.
+        'TEST_NAME': 'test_database.sqlite',
     }
 }
 
+# Aliases in DATABASES of read-only replicas of 'default' to spread reads
+# over (see mysite.replicas).
+DATABASE_REPLICAS = ()
+DATABASE_ROUTERS = ['mysite.replicas.ReplicaRouter']
+
+# Seconds after a client writes something during which its reads still go
+# to the primary, covering how far behind the replicas can be.
+REPLICA_PIN_SECONDS = 5
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -88,6 +100,9 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # Uncomment the next line to record per-view query counts and timings:
+    # 'mysite.instrumentation.InstrumentationMiddleware',
+    'mysite.replicas.PrimaryPinMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -123,6 +138,86 @@ INSTALLED_APPS = (
     'polls',
 )
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds to keep the rendered poll list and poll results in the cache.
+# Votes and admin edits invalidate them as they happen.
+POLLS_CACHE_TIMEOUT = 300
+
+# Seconds to buffer votes in memory before writing them out in one batch.
+# None writes every vote to the database as it arrives.
+POLLS_VOTE_BUFFER_INTERVAL = None
+
+# Seconds to collect the vote log (VoteEvents, for the rollups) in memory
+# before writing it out in one batch. None inserts an event with every
+# vote counted one at a time.
+POLLS_VOTE_EVENT_INTERVAL = None
+
+# Spread each choice's votes over this many counter rows, so voters on a
+# hot choice don't all wait on one row. Run "manage.py compact_vote_shards"
+# regularly to fold them back into the choices. None counts every vote on
+# the choice itself.
+POLLS_VOTE_SHARDS = None
+
+# Seconds to cache the sum of each poll's shards for. Sharded votes and
+# compacting clear it, but only in the cache they're made against, so with
+# a per-process cache this is also how long other processes can lag.
+POLLS_SHARD_SUMS_TIMEOUT = 5
+
+# File to count votes in, shared by every worker process on the host, for
+# "manage.py flush_shared_votes" to write to the database (see
+# polls.sharedcounts). Put it on local disk, or a tmpfs if losing the
+# unflushed votes on a reboot is acceptable. None writes votes to the
+# database from the worker.
+POLLS_SHARED_VOTES_FILE = None
+
+# Choice and poll ids the file has room for; votes for later ones go
+# straight to the database. 2 ** 20 makes a 24MB file, which stays sparse
+# until it's used.
+POLLS_SHARED_VOTES_SLOTS = 2 ** 20
+
+# Directory to keep a Bloom filter of each poll's voters in, so a session
+# or client can only vote once per poll (see polls.dedup). None lets
+# anyone vote as often as they like.
+POLLS_VOTER_FILTER_DIR = None
+
+# Voters each poll's filter is sized for, and the fraction of new voters
+# it lets through to a database check once it has that many. Ten million
+# at 1% makes a 12MB file per poll; past that the fraction climbs, but
+# duplicates are still caught.
+POLLS_VOTER_FILTER_EXPECTED_VOTERS = 10 ** 7
+POLLS_VOTER_FILTER_FALSE_POSITIVES = 0.01
+
+# Seconds to collect the Voters of votes counted in shared memory before
+# writing them out in one batch. None writes each one as its vote is
+# counted. Buffered votes' Voters are written with the votes.
+POLLS_VOTER_WRITE_INTERVAL = None
+
+# How many polls the hot polls leaderboard keeps, and the half-life in
+# seconds of each vote's contribution to a poll's score (see
+# polls.trending). None turns the leaderboard off.
+POLLS_TRENDING_SIZE = 100
+POLLS_TRENDING_HALF_LIFE = 6 * 60 * 60
+
+# Seconds between saves of each process's leaderboard to the database,
+# which is also how often processes pick up each other's votes. None
+# keeps each process's leaderboard in memory only.
+POLLS_TRENDING_SAVE_INTERVAL = None
+
+# Limits per view (or '*' for every view) past which the instrumentation
+# middleware logs a request: 'queries', 'db_ms', 'template_ms', 'total_ms'.
+REQUEST_BUDGETS = {
+    '*': {'queries': 20, 'total_ms': 500},
+}
+
+# Shared secret for POSTing batches of votes to /votes/import/, sent as
+# "Authorization: Token <secret>". None turns the endpoint off.
+POLLS_IMPORT_TOKEN = None
+
 # A sample logging configuration. The only tangible logging
 # performed by this configuration is to send an email to
 # the site admins on every HTTP 500 error when DEBUG=False.
@@ -0,0 +1,32 @@
+# Production overrides for mysite.settings. Point DJANGO_SETTINGS_MODULE at
+# this module to use them.
+from mysite.settings import *
+from mysite.sqlite_pragmas import PRODUCTION_PRAGMAS
+
+# No query log, template origin tracking or debug error pages.
+DEBUG = TEMPLATE_DEBUG = False
+
+# Required once DEBUG is off: add the site's domain here.
+ALLOWED_HOSTS = ['localhost', '127.0.0.1']
+
+# Compile each template once per process rather than on every render, and
+# the polls templates as soon as mysite.wsgi is loaded.
+TEMPLATE_LOADERS = (
+    ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+)
+TEMPLATE_PREWARM_APPS = ('polls',)
+
+# Share the hot polls between worker processes, and keep them over restarts.
+POLLS_TRENDING_SAVE_INTERVAL = 60
+
+# Write the vote log once a second rather than a row with every vote.
+POLLS_VOTE_EVENT_INTERVAL = 1
+
+# Likewise the Voters of votes counted in shared memory, if that's on.
+POLLS_VOTER_WRITE_INTERVAL = 1
+
+DATABASES['default'].update({
+    'PRAGMAS': PRODUCTION_PRAGMAS,
+    # Keep connections (and their page cache) open between requests.
+    'CONN_MAX_AGE': 600,
+})
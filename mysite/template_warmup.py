@@ -0,0 +1,39 @@
+"""
+Compiling templates before the first request.
+
+Under the cached template loader each template is read and compiled the
+first time it's asked for, then reused. prewarm_templates() asks for all
+of an app's templates up front, so the first visitors don't pay for that,
+and a template that doesn't compile stops the site starting instead of
+failing requests.
+"""
+import os
+
+from django.conf import settings
+from django.template.loader import get_template
+from django.utils.importlib import import_module
+
+
+def template_names(app_labels):
+    """
+    The name of every template in the templates directories of the
+    installed apps labelled ``app_labels``.
+    """
+    for app in settings.INSTALLED_APPS:
+        if app.rsplit('.', 1)[-1] not in app_labels:
+            continue
+        directory = os.path.join(os.path.dirname(import_module(app).__file__), 'templates')
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                yield os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+
+
+def prewarm_templates(app_labels):
+    """
+    Load every template of the apps labelled ``app_labels``, returning
+    their names.
+    """
+    names = sorted(set(template_names(app_labels)))
+    for name in names:
+        get_template(name)
+    return names
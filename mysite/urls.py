@@ -5,6 +5,12 @@ admin.autodiscover()
 urlpatterns = patterns('',
     url(r'^$', 'polls.views.home'),
     url(r'^poll/(\d+)/$', 'polls.views.poll'),
+    url(r'^poll/(\d+)/vote/$', 'polls.views.vote'),
+    url(r'^poll/(\d+)/results/$', 'polls.views.poll_results'),
+    url(r'^votes/import/$', 'polls.views.import_votes'),
+    url(r'^polls/import/$', 'polls.views.import_polls'),
+    url(r'^results\.(csv|jsonl)$', 'polls.views.export_results'),
+    url(r'^_stats/$', 'mysite.instrumentation.stats_view'),
     url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
     url(r'^admin/', include(admin.site.urls)),
 )
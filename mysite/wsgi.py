@@ -21,7 +21,15 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 # file. This includes Django's development server, if the WSGI_APPLICATION
 # setting points here.
 from django.core.wsgi import get_wsgi_application
-application = get_wsgi_application()
+from polls.fastvote import FastVoteApplication
+# Votes to /poll/<id>/vote/ skip Django's middleware; see polls.fastvote.
+application = FastVoteApplication(get_wsgi_application())
+
+# Compile templates now rather than on the first requests for them.
+from django.conf import settings
+if getattr(settings, 'TEMPLATE_PREWARM_APPS', None):
+    from mysite.template_warmup import prewarm_templates
+    prewarm_templates(settings.TEMPLATE_PREWARM_APPS)
 
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
@@ -1,11 +1,140 @@
+from django.conf import settings
 from django.contrib import admin
-from polls.models import Poll, Choice
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.forms.models import BaseInlineFormSet
+
+from polls import search
+from polls.models import Poll, Choice, VoteShard
+from polls.sharedcounts import get_shared_counters
+
+# Tables with more rows than this get an estimated count on the changelist
+# instead of a COUNT(*) that has to read every one of them.
+ESTIMATE_COUNTS_OVER = 100000
+
+# Most choices to load into a poll's change form.
+MAX_INLINE_CHOICES = 50
+
+
+def estimated_count(model, using):
+    """
+    A cheap estimate of the number of rows in ``model``'s table, or None if
+    the database can't give one.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [table])
+    elif connection.vendor == 'mysql':
+        cursor.execute(
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+    elif connection.vendor == 'sqlite':
+        # Ids are handed out in order, so the highest is the row count
+        # give or take deletions, and it's read straight off the index.
+        cursor.execute("SELECT MAX(rowid) FROM %s" % connection.ops.quote_name(table))
+    else:
+        return None
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class EstimatedCountQuerySet(QuerySet):
+    """
+    A QuerySet whose count() estimates the size of a big table rather than
+    counting it, when nothing narrows it down. Filtered querysets are still
+    counted exactly.
+    """
+
+    def count(self):
+        query = self.query
+        if self._result_cache is None and not query.where and not query.low_mark and query.high_mark is None:
+            estimate = estimated_count(self.model, self.db)
+            if estimate is not None and estimate > ESTIMATE_COUNTS_OVER:
+                return estimate
+        return super(EstimatedCountQuerySet, self).count()
+
+
+class BoundedChoiceFormSet(BaseInlineFormSet):
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            self._queryset = super(BoundedChoiceFormSet, self).get_queryset()[:MAX_INLINE_CHOICES]
+        return self._queryset
+
 
 class ChoiceInline(admin.StackedInline):
     model = Choice
     extra = 3
+    # Saving a choice applies the change made to its votes rather than
+    # writing them back (see Choice.save()), so they're only shown.
+    readonly_fields = ('votes',)
+    # Only the first MAX_INLINE_CHOICES choices are shown (and saved); the
+    # rest are left as they are.
+    formset = BoundedChoiceFormSet
+
 
 class PollAdmin(admin.ModelAdmin):
     inlines = [ChoiceInline]
+    list_display = ('question', 'pub_date', 'total_votes')
+    # Today, past 7 days, this month and this year are all ranges on the
+    # index on pub_date. date_hierarchy would have to truncate every row's
+    # pub_date to find the years and months to offer.
+    list_filter = ('pub_date',)
+    ordering = ('-pub_date', '-id')
+    list_per_page = 50
+    # Searched through the full-text index where there is one; see
+    # get_search_results().
+    search_fields = ('question',)
+
+    def get_queryset(self, request):
+        queryset = super(PollAdmin, self).get_queryset(request)._clone(klass=EstimatedCountQuerySet)
+        if getattr(settings, 'POLLS_VOTE_SHARDS', None):
+            queryset = queryset.extra(select={'sharded_votes': VoteShard.sum_sql('poll_id', Poll)})
+        if get_shared_counters() is not None:
+            # Votes in shared memory are kept per choice.
+            queryset = queryset.prefetch_related('choice_set')
+        return queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        With the full-text index (see polls.search), polls whose question
+        has every word of the search term, in any case, as a word or the
+        start of one. That's a lookup in the index, where Django's own
+        icontains search reads every row, so it's only the fallback.
+        """
+        if not search.available():
+            return super(PollAdmin, self).get_search_results(request, queryset, search_term)
+        if not search_term.strip():
+            return queryset, False
+        query = search.match_query(search_term)
+        if query is None:
+            return queryset.none(), False
+        return queryset.extra(
+            where=['%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' % (
+                connections[queryset.db].ops.quote_name('id'), search.TABLE, search.TABLE)],
+            params=[u'question : (%s)' % query],
+        ), False
+
+    def changelist_view(self, request, extra_context=None):
+        # Shown under the search box, as it doesn't match the way Django's
+        # usually does.
+        extra_context = dict(extra_context or {}, search_help=(
+            "Finds polls whose question has every word you type, in any case, "
+            "as a whole word or the start of one." if search.available() else
+            "Finds polls whose question contains what you type."))
+        return super(PollAdmin, self).changelist_view(request, extra_context)
+
+    def total_votes(self, poll):
+        # vote_count comes with the row, and pending sharded votes with the
+        # same query, so the column costs no extra queries. Votes in shared
+        # memory cost one query for the page's choices.
+        total = poll.vote_count + (getattr(poll, 'sharded_votes', None) or 0)
+        counters = get_shared_counters()
+        if counters is not None:
+            total += sum(counters.pending(choice.id) for choice in poll.choice_set.all())
+        return total
+    total_votes.admin_order_field = 'vote_count'
 
 admin.site.register(Poll, PollAdmin)
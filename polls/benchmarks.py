@@ -0,0 +1,557 @@
+"""
+Benchmarks for the polls app.
+
+Run them with ``manage.py benchmark [name ...]``. Each benchmark is handed
+an empty throwaway database and a stream to write its results to.
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Sum
+from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.test.client import Client, RequestFactory
+from django.test.utils import (
+    override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.utils import timezone
+
+from mysite.sqlite_pragmas import PRODUCTION_PRAGMAS
+from polls.forms import PollVoteForm
+from polls.loading import create_polls
+from polls.models import Poll, Choice
+from polls.pagination import encode_cursor, keyset_page
+from polls.perf import seed_catalog
+from polls.replay import InProcess, read_requests
+from polls.search import rebuild_index, search, search_ids
+from polls.sharedcounts import SharedCounters
+from polls.trending import Leaderboard
+from polls.views import POLLS_PER_PAGE
+from polls.votes import (
+    VoteBuffer, compact_shards, flush_shared_votes, record_shared_vote, record_sharded_vote,
+    record_vote, recover_shared_votes,
+)
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Run the block against a freshly created copy of the test database,
+    with DEBUG off, destroying it afterwards.
+    """
+    # Measure what production would see, not the debug query log.
+    settings.DEBUG = False
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def time_calls(func, repeat):
+    """
+    Call ``func`` ``repeat`` times, returning how long each call took in
+    seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return timings
+
+
+def median(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2]
+
+
+def seed_polls(count, batch_size=5000):
+    """
+    Bulk insert ``count`` polls, published one second apart.
+    """
+    start = timezone.now() - timedelta(seconds=count)
+    for offset in range(0, count, batch_size):
+        Poll.objects.bulk_create([
+            Poll(question="Poll %d" % i, pub_date=start + timedelta(seconds=i))
+            for i in range(offset, min(offset + batch_size, count))
+        ])
+
+
+def run_in_threads(func, threads):
+    """
+    Run ``func`` in ``threads`` threads at once and return the wall-clock
+    time until they've all finished.
+    """
+    return run_threads([threading.Thread(target=func) for _ in range(threads)])
+
+
+def run_threads(workers):
+    """
+    Start the ``workers`` threads together, closing each one's database
+    connection when it's done, and return the wall-clock time until they've
+    all finished.
+    """
+    for worker in workers:
+        worker.run = _closing_connection(worker.run)
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - start
+
+
+def _closing_connection(func):
+    def wrapper():
+        try:
+            func()
+        finally:
+            connection.close()
+    return wrapper
+
+
+def seed_poll(num_choices):
+    """
+    Create a poll with ``num_choices`` choices and return it.
+    """
+    poll = Poll.objects.create(question="Benchmark poll", pub_date=timezone.now())
+    for i in range(num_choices):
+        Choice.objects.create(poll=poll, choice="Choice %d" % i)
+    return poll
+
+
+@benchmark
+def home_pagination(out, pages=(1, 10, 100, 1000, 10000), repeat=20):
+    """
+    Home page latency at increasing depths, following keyset cursors, and
+    the page query on its own next to the same page fetched with OFFSET.
+    """
+    seed_polls(max(pages) * POLLS_PER_PAGE)
+    client = Client()
+    ordered = Poll.objects.order_by('pub_date', 'id')
+
+    out.write("%8s %10s %10s %10s\n" % ("page", "view ms", "keyset ms", "offset ms"))
+    for page in pages:
+        offset = (page - 1) * POLLS_PER_PAGE
+        cursor = encode_cursor(ordered[offset - 1]) if offset else None
+        view = time_calls(lambda: client.get('/', {'after': cursor} if cursor else {}), repeat)
+        keyset = time_calls(lambda: keyset_page(Poll.objects.all(), cursor, POLLS_PER_PAGE), repeat)
+        by_offset = time_calls(lambda: list(ordered[offset:offset + POLLS_PER_PAGE]), repeat)
+        out.write("%8d %10.2f %10.2f %10.2f\n" % (
+            page, median(view) * 1000, median(keyset) * 1000, median(by_offset) * 1000))
+
+
+@benchmark
+def vote_buffering(out, threads=8, votes_each=500, num_choices=10):
+    """
+    Vote throughput writing every vote as it arrives, against buffering
+    them with VoteBuffer and writing them out in one batch.
+    """
+    poll = seed_poll(num_choices)
+    choice_ids = list(poll.choice_set.values_list('id', flat=True))
+    total = threads * votes_each
+
+    def vote_directly():
+        for _ in range(votes_each):
+            record_vote(poll.id, random.choice(choice_ids))
+    direct = run_in_threads(vote_directly, threads)
+
+    vote_buffer = VoteBuffer(interval=1)
+    def vote_buffered():
+        for _ in range(votes_each):
+            vote_buffer.add(poll.id, random.choice(choice_ids))
+    buffered = run_in_threads(vote_buffered, threads)
+    start = time.time()
+    vote_buffer.stop()
+    buffered += time.time() - start
+
+    assert Poll.objects.get(pk=poll.id).total_votes() == total * 2
+    out.write("%d votes from %d threads\n" % (total, threads))
+    out.write("%10s %12s\n" % ("mode", "votes/sec"))
+    out.write("%10s %12.0f\n" % ("direct", total / direct))
+    out.write("%10s %12.0f\n" % ("buffered", total / buffered))
+
+
+@benchmark
+def sqlite_tuning(out, readers=8, writers=4, duration=3, num_choices=10):
+    """
+    Mixed read/write throughput on the stock SQLite configuration against
+    the PRODUCTION_PRAGMAS from mysite.settings_production.
+    """
+    poll = seed_poll(num_choices)
+    choice_ids = list(poll.choice_set.values_list('id', flat=True))
+    profiles = [
+        ("default", {'journal_mode': 'DELETE'}),
+        ("tuned", PRODUCTION_PRAGMAS),
+    ]
+
+    out.write("%d readers, %d writers for %ds each\n" % (readers, writers, duration))
+    out.write("%10s %12s %12s %8s\n" % ("profile", "reads/sec", "votes/sec", "errors"))
+    for name, pragmas in profiles:
+        connections.databases[connection.alias]['PRAGMAS'] = pragmas
+        connection.close()
+        connection.ensure_connection()
+
+        counts = {'reads': 0, 'votes': 0, 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.time() + duration
+
+        def work(action, counter):
+            while time.time() < deadline:
+                outcome = counter
+                try:
+                    action()
+                except Exception:
+                    outcome = 'errors'
+                with lock:
+                    counts[outcome] += 1
+
+        def read():
+            work(lambda: Poll.objects.get_with_choices(poll.id), 'reads')
+
+        def write():
+            work(lambda: record_vote(poll.id, random.choice(choice_ids)), 'votes')
+
+        workers = [threading.Thread(target=read) for _ in range(readers)]
+        workers += [threading.Thread(target=write) for _ in range(writers)]
+        elapsed = run_threads(workers)
+        out.write("%10s %12.0f %12.0f %8d\n" % (
+            name, counts['reads'] / elapsed, counts['votes'] / elapsed, counts['errors']))
+
+    connections.databases[connection.alias].pop('PRAGMAS')
+
+
+@benchmark
+def instrumentation_overhead(out, repeat=500, num_choices=10):
+    """
+    Latency of the home and poll pages with and without the
+    instrumentation middleware, bypassing the cache.
+    """
+    poll = seed_poll(num_choices)
+    seed_polls(100)
+    urls = [('home', '/'), ('poll', '/poll/%d/' % poll.id)]
+    instrumented = ('mysite.instrumentation.InstrumentationMiddleware',) + settings.MIDDLEWARE_CLASSES
+
+    def get(url):
+        cache.clear()
+        client.get(url)
+
+    out.write("%6s %10s %16s\n" % ("view", "plain ms", "instrumented ms"))
+    for name, url in urls:
+        client = Client()
+        plain = time_calls(lambda: get(url), repeat)
+        with override_settings(MIDDLEWARE_CLASSES=instrumented):
+            client = Client()
+            measured = time_calls(lambda: get(url), repeat)
+        out.write("%6s %10.2f %16.2f\n" % (name, median(plain) * 1000, median(measured) * 1000))
+
+
+@benchmark
+def vote_contention(out, threads=8, votes_each=300, shards=(4, 16)):
+    """
+    Vote throughput with every thread voting for the same choice, counted
+    on its own row against spread over sharded counters.
+    """
+    poll = seed_poll(2)
+    choice_id = poll.choice_set.values_list('id', flat=True)[0]
+    total = threads * votes_each
+    modes = [("single row", lambda: record_vote(poll.id, choice_id))]
+    modes += [
+        ("%d shards" % count, lambda count=count: record_sharded_vote(poll.id, choice_id, count))
+        for count in shards
+    ]
+
+    out.write("%d votes on one choice from %d threads\n" % (total, threads))
+    out.write("%12s %12s\n" % ("mode", "votes/sec"))
+    for name, vote in modes:
+        def work():
+            for _ in range(votes_each):
+                vote()
+        elapsed = run_in_threads(work, threads)
+        out.write("%12s %12.0f\n" % (name, total / elapsed))
+
+    compact_shards()
+    assert Choice.objects.get(pk=choice_id).votes == total * len(modes)
+
+
+@benchmark
+def template_loading(out, repeat=500, num_choices=10):
+    """
+    Render time of the home and poll templates, and latency of their
+    views, loading templates from disk with TEMPLATE_DEBUG on against the
+    cached loader with it off, as in mysite.settings_production.
+    """
+    poll = seed_poll(num_choices)
+    seed_polls(100)
+    poll = Poll.objects.get_with_choices(poll.id)
+    pages = [
+        ('home', '/', 'home.html', {'polls': list(Poll.objects.all()[:POLLS_PER_PAGE]), 'next_page': None}),
+        ('poll', '/poll/%d/' % poll.id, 'poll.html',
+            {'poll': poll, 'form': PollVoteForm(poll=poll), 'cache_timeout': 0}),
+    ]
+    profiles = [
+        ("debug", {'TEMPLATE_DEBUG': True}),
+        ("cached", {'TEMPLATE_DEBUG': False, 'TEMPLATE_LOADERS': (
+            ('django.template.loaders.cached.Loader', settings.TEMPLATE_LOADERS),
+        )}),
+    ]
+
+    def render(url, template, context):
+        cache.clear()
+        render_to_string(template, context, RequestContext(RequestFactory().get(url)))
+
+    def get(url):
+        cache.clear()
+        client.get(url)
+
+    client = Client()
+    out.write("%6s %8s %10s %10s\n" % ("view", "profile", "render ms", "view ms"))
+    for name, url, template, context in pages:
+        for profile, overrides in profiles:
+            with override_settings(**overrides):
+                rendering = time_calls(lambda: render(url, template, context), repeat)
+                viewing = time_calls(lambda: get(url), repeat)
+            out.write("%6s %8s %10.3f %10.3f\n" % (
+                name, profile, median(rendering) * 1000, median(viewing) * 1000))
+
+
+@benchmark
+def vote_endpoints(out, votes=1000, num_choices=10):
+    """
+    Votes per second through the WSGI application in mysite.wsgi, posting
+    the poll page's form (following its redirect, and not) against the
+    lean /poll/<id>/vote/ endpoint, with and without AJAX.
+    """
+    poll = seed_poll(num_choices)
+    choice_ids = list(poll.choice_set.values_list('id', flat=True))
+    page = '/poll/%d/' % poll.id
+    flows = [
+        ("form + redirect", page, {}, True),
+        ("form alone", page, {}, False),
+        ("lean + redirect", page + 'vote/', {}, True),
+        ("lean ajax", page + 'vote/', {'X-Requested-With': 'XMLHttpRequest'}, False),
+    ]
+    send = InProcess()
+
+    out.write("%16s %12s\n" % ("flow", "votes/sec"))
+    for name, url, headers, follow in flows:
+        posts = read_requests(json.dumps({
+            'method': 'POST', 'path': url, 'headers': headers,
+            'data': {'vote': random.choice(choice_ids)},
+        }) for _ in range(votes))
+        follow_up = read_requests([json.dumps({'path': page})])[0]
+
+        start = time.time()
+        for post in posts:
+            status = send(post)
+            assert status in (204, 302), status
+            if follow:
+                send(follow_up)
+        out.write("%16s %12.0f\n" % (name, votes / (time.time() - start)))
+
+
+@benchmark
+def search_lookup(out, polls=1000000, vocabulary=50000, repeat=200, batch_size=5000):
+    """
+    Search latency over ``polls`` polls with six-word questions drawn from
+    ``vocabulary`` made-up words: finding the matching ids, and loading
+    the polls as well, against a question__icontains scan.
+    """
+    rng = random.Random(0)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = list(set(''.join(rng.choice(letters) for _ in range(rng.randint(5, 9)))
+                     for _ in range(vocabulary)))
+    now = timezone.now()
+    for offset in range(0, polls, batch_size):
+        Poll.objects.bulk_create([
+            Poll(question=' '.join(rng.choice(words) for _ in range(6)), pub_date=now)
+            for _ in range(min(batch_size, polls - offset))
+        ])
+    start = time.time()
+    rebuild_index()
+    out.write("%d polls indexed in %.1fs\n" % (polls, time.time() - start))
+
+    word, other = rng.choice(words), rng.choice(words)
+    queries = [
+        ("word", word),
+        ("prefix", word[:4]),
+        ("two words", "%s %s" % (word, other)),
+    ]
+    out.write("%10s %8s %10s %10s %12s %12s\n" % (
+        "query", "matches", "ids p50 ms", "ids p95 ms", "polls p50 ms", "icontains ms"))
+    for name, terms in queries:
+        matches = len(search_ids(terms, limit=polls))
+        lookups = sorted(time_calls(lambda: search_ids(terms), repeat))
+        timings = time_calls(lambda: search(terms), repeat)
+        scan = time_calls(lambda: list(Poll.objects.filter(question__icontains=terms)[:20]), 3)
+        out.write("%10s %8d %10.3f %10.3f %12.3f %12.1f\n" % (
+            name, matches, median(lookups) * 1000, lookups[int(len(lookups) * 0.95)] * 1000,
+            median(timings) * 1000, median(scan) * 1000))
+
+
+@benchmark
+def hot_polls(out, polls=100000, votes=100000, size=100, top=5, repeat=200):
+    """
+    Reading the top polls from the leaderboard against sorting every poll
+    by its choices' summed votes, and what counting a vote on the
+    leaderboard costs.
+    """
+    seed_catalog(polls, max_choices=10)
+    rng = random.Random(0)
+    poll_ids = list(Poll.objects.values_list('id', flat=True))
+    # A few polls get most of the votes.
+    voted = [poll_ids[min(int(rng.paretovariate(1.2)) - 1, len(poll_ids) - 1)] for _ in range(votes)]
+
+    leaderboard = Leaderboard(size, settings.POLLS_TRENDING_HALF_LIFE)
+    adds = time_calls(lambda: leaderboard.add(voted.pop()), votes)
+    leaderboard.hot_polls(top)
+    board = time_calls(lambda: leaderboard.hot_polls(top), repeat)
+    scan = time_calls(lambda: list(
+        Poll.objects.annotate(total=Sum('choice__votes')).order_by('-total')[:top]), 3)
+
+    out.write("leaderboard add: %.1f us per vote\n" % (median(adds) * 1e6))
+    out.write("top %d from the leaderboard: %.3f ms\n" % (top, median(board) * 1000))
+    out.write("top %d by summing choices: %.1f ms\n" % (top, median(scan) * 1000))
+
+
+def run_in_processes(func, processes):
+    """
+    Run ``func`` in ``processes`` forked processes at once and return the
+    wall-clock time until they've all finished.
+    """
+    # Each child opens its own connection rather than sharing the parent's.
+    connection.close()
+    start = time.time()
+    pids = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                func()
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                status = 1
+            finally:
+                connection.close()
+                os._exit(status)
+        pids.append(pid)
+    failed = [pid for pid in pids if os.waitpid(pid, 0)[1]]
+    if failed:
+        raise RuntimeError("%d of %d processes failed" % (len(failed), processes))
+    return time.time() - start
+
+
+@benchmark
+def shared_votes(out, processes=(1, 4, 8), votes_each=500, num_choices=10):
+    """
+    Vote throughput from several worker processes each writing every vote
+    to SQLite, against counting them in shared memory and flushing them
+    from one process.
+    """
+    poll = seed_poll(num_choices)
+    choice_ids = list(poll.choice_set.values_list('id', flat=True))
+    connections.databases[connection.alias]['PRAGMAS'] = PRODUCTION_PRAGMAS
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'votes')
+    expected = 0
+
+    flusher = SharedCounters(path, settings.POLLS_SHARED_VOTES_SLOTS)
+    flusher.become_flusher()
+    start = time.time()
+    recover_shared_votes(flusher)
+    flush_shared_votes(flusher)
+    out.write("flusher recovery: %.1f ms\n" % ((time.time() - start) * 1000))
+
+    out.write("%d votes per process\n" % votes_each)
+    out.write("%10s %14s %14s %10s\n" % ("processes", "direct v/s", "shared v/s", "flush ms"))
+    try:
+        for count in processes:
+            def vote_directly():
+                for _ in range(votes_each):
+                    record_vote(poll.id, random.choice(choice_ids))
+            direct = run_in_processes(vote_directly, count)
+
+            def vote_shared():
+                counters = SharedCounters(path, settings.POLLS_SHARED_VOTES_SLOTS)
+                for _ in range(votes_each):
+                    record_shared_vote(counters, poll.id, random.choice(choice_ids))
+            shared = run_in_processes(vote_shared, count)
+
+            start = time.time()
+            flushed = flush_shared_votes(flusher)
+            flush = time.time() - start
+
+            total = count * votes_each
+            assert flushed == total
+            expected += 2 * total
+            out.write("%10d %14.0f %14.0f %10.1f\n" % (count, total / direct, total / shared, flush * 1000))
+    finally:
+        flusher.close()
+        connections.databases[connection.alias].pop('PRAGMAS')
+        shutil.rmtree(directory)
+
+    assert Poll.objects.get(pk=poll.id).vote_count == expected
+
+
+@benchmark
+def bulk_load(out, polls=200000, saved=2000, num_choices=4):
+    """
+    Creating polls one save() at a time against create_polls(), with the
+    indexes kept up to date and deferred to the end.
+    """
+    rng = random.Random(0)
+    now = timezone.now()
+
+    def catalog(count):
+        for _ in range(count):
+            yield {
+                'question': "Poll %d" % rng.randint(0, 10 ** 9),
+                'pub_date': now - timedelta(seconds=rng.randint(0, 10 ** 7)),
+                'choices': [("Choice %d" % i, rng.randint(0, 100)) for i in range(num_choices)],
+            }
+
+    def save_each(count):
+        start = time.time()
+        for row in catalog(count):
+            poll = Poll.objects.create(question=row['question'], pub_date=row['pub_date'])
+            for text, votes in row['choices']:
+                Choice.objects.create(poll=poll, choice=text, votes=votes)
+        return time.time() - start
+
+    out.write("%d choices per poll\n" % num_choices)
+    out.write("%16s %10s %10s %12s\n" % ("method", "polls", "seconds", "rows/sec"))
+    rows_each = 1 + num_choices
+    runs = [
+        ("save()", saved, save_each),
+        ("bulk", polls, lambda count: create_polls(catalog(count))[3]),
+        ("bulk, deferred", polls, lambda count: create_polls(catalog(count), defer_indexes=True)[3]),
+    ]
+    for name, count, load in runs:
+        seconds = load(count)
+        out.write("%16s %10d %10.1f %12.0f\n" % (name, count, seconds, count * rows_each / seconds))
+
+    assert Poll.objects.count() == saved + 2 * polls
+    assert Choice.objects.count() == (saved + 2 * polls) * num_choices
@@ -0,0 +1,73 @@
+"""
+Cache keys for the polls pages, and the invalidation that keeps them fresh.
+
+Anything that changes a poll's results calls invalidate_poll(); anything
+that changes which polls exist, or their questions, calls
+invalidate_poll_list(). Both clear the cache at once and again after the
+transaction commits, as a reader in between would cache what was there
+before the commit.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from mysite.commit_hooks import after_commit
+
+CACHE_TIMEOUT = getattr(settings, 'POLLS_CACHE_TIMEOUT', 300)
+SHARD_SUMS_TIMEOUT = getattr(settings, 'POLLS_SHARD_SUMS_TIMEOUT', 5)
+
+# Must match the {% cache %} fragment name in poll.html
+RESULTS_FRAGMENT = 'poll_results'
+POLL_LIST_GENERATION_KEY = 'polls:list:generation'
+
+
+def poll_key(poll_id):
+    return 'polls:poll:%s' % poll_id
+
+
+def shard_sums_key(poll_id):
+    return 'polls:shards:%s' % poll_id
+
+
+def poll_list_key(after):
+    """
+    Key for one page of the home page's poll list. Pages are namespaced by
+    a generation number so that invalidate_poll_list() can retire all of
+    them at once.
+    """
+    generation = cache.get(POLL_LIST_GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so an evicted generation can't come back as
+        # a number that older pages were stored under.
+        cache.add(POLL_LIST_GENERATION_KEY, int(time.time() * 1000), None)
+        generation = cache.get(POLL_LIST_GENERATION_KEY)
+    return 'polls:list:%s:%s' % (generation, after or '')
+
+
+def invalidate_poll(poll_id):
+    def invalidate():
+        cache.delete_many([
+            poll_key(poll_id),
+            make_template_fragment_key(RESULTS_FRAGMENT, [poll_id]),
+            shard_sums_key(poll_id),
+        ])
+    _now_and_after_commit(invalidate)
+
+
+def invalidate_poll_list():
+    def invalidate():
+        try:
+            cache.incr(POLL_LIST_GENERATION_KEY)
+        except ValueError:
+            # Nothing cached under any generation yet
+            pass
+    _now_and_after_commit(invalidate)
+
+
+def _now_and_after_commit(invalidate):
+    invalidate()
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        after_commit(invalidate)
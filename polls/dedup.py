@@ -0,0 +1,174 @@
+"""
+One vote per voter per poll.
+
+Each voter is recorded as a Voter row, whose unique index settles whether
+they've voted before. The row is written along with the vote itself (see
+polls.votes.cast_vote()): in the same transaction, or in the same batch
+when votes are buffered or counted in shared memory, so deduplicating
+doesn't add a write of its own.
+
+Looking the voter up on every vote would still cost a query, so each
+poll also has a Bloom filter of its voters: a fixed size bitmap in a
+memory-mapped file in POLLS_VOTER_FILTER_DIR, shared by every process on
+the host. It's sized by filter_size() to let through
+POLLS_VOTER_FILTER_FALSE_POSITIVES of new voters to a database check
+once a poll has POLLS_VOTER_FILTER_EXPECTED_VOTERS voters. A voter the
+filter hasn't seen is new, and their vote goes straight through; only
+the ones it might have seen (repeat voters, and the occasional false
+positive) cost a lookup.
+
+The filter never has to be right, only fast: a lost or stale file just
+means more duplicates are caught by the unique index instead.
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+from polls.models import Voter
+from polls.votes import AlreadyVoted, cast_vote
+
+# Filters kept open at once. The least recently used is dropped first, and
+# unmapped once nothing is still using it.
+MAX_OPEN = 64
+
+ALREADY_VOTED = "You've already voted on this poll."
+
+
+def enabled():
+    return bool(getattr(settings, 'POLLS_VOTER_FILTER_DIR', None))
+
+
+def filter_size(voters, false_positives):
+    """
+    The bits and hashes per voter of a Bloom filter that lets through
+    ``false_positives`` (a fraction) of new voters once it holds ``voters``.
+    """
+    bits = int(math.ceil(-voters * math.log(false_positives) / math.log(2) ** 2))
+    hashes = max(1, int(round(float(bits) / voters * math.log(2))))
+    return bits, hashes
+
+
+def voter_key(request):
+    """
+    Who's voting: their session if they send a session cookie, otherwise
+    their address and user agent. The session isn't looked up, so it may
+    not exist.
+    """
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return 'session:' + session.session_key
+    return client_key(request)
+
+
+def client_key(request):
+    return 'client:%s:%s' % (
+        request.META.get('REMOTE_ADDR', ''), request.META.get('HTTP_USER_AGENT', ''))
+
+
+def _hash(key):
+    # Keyed, so the table doesn't hold anything that identifies a client.
+    digest = salted_hmac('polls.dedup', key).digest()
+    voter, = struct.unpack('<q', digest[:8])
+    h1, h2 = struct.unpack('<QI', digest[8:20])
+    return voter, h1, h2 | 1
+
+
+class SeenSet(object):
+    """
+    A Bloom filter of ``bits`` bits, setting ``hashes`` of them per voter,
+    memory-mapped from ``path``.
+    """
+
+    def __init__(self, path, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        size = (bits + 7) // 8
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _positions(self, h1, h2):
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def might_contain(self, h1, h2):
+        return all(
+            ord(self._map[bit >> 3]) & (1 << (bit & 7))
+            for bit in self._positions(h1, h2)
+        )
+
+    def add(self, h1, h2):
+        for bit in self._positions(h1, h2):
+            self._map[bit >> 3] = chr(ord(self._map[bit >> 3]) | (1 << (bit & 7)))
+
+
+_seen_sets = OrderedDict()
+_seen_sets_lock = threading.Lock()
+
+
+def seen_set(poll_id):
+    """
+    The SeenSet for a poll, mapping its file in if it isn't already.
+    """
+    with _seen_sets_lock:
+        seen = _seen_sets.pop(poll_id, None)
+        if seen is None:
+            bits, hashes = filter_size(
+                settings.POLLS_VOTER_FILTER_EXPECTED_VOTERS, settings.POLLS_VOTER_FILTER_FALSE_POSITIVES)
+            # Resizing starts new files rather than misreading the old ones.
+            path = os.path.join(settings.POLLS_VOTER_FILTER_DIR, '%d-%d-%d.bloom' % (poll_id, bits, hashes))
+            seen = SeenSet(path, bits, hashes)
+            while len(_seen_sets) >= MAX_OPEN:
+                _seen_sets.popitem(last=False)
+        _seen_sets[poll_id] = seen
+        return seen
+
+
+def forget_all():
+    with _seen_sets_lock:
+        _seen_sets.clear()
+
+
+def _seen(poll_id, voter, h1, h2):
+    return (seen_set(poll_id).might_contain(h1, h2)
+            and Voter.objects.filter(poll_id=poll_id, voter=voter).exists())
+
+
+def cast_vote_once(poll_id, choice_id, request):
+    """
+    Cast a vote with cast_vote(), unless the voter making ``request`` has
+    already voted on the poll, in which case return False. Votes aren't
+    checked at all if dedup isn't enabled().
+    """
+    if not enabled():
+        cast_vote(poll_id, choice_id)
+        return True
+    key = voter_key(request)
+    voter, h1, h2 = _hash(key)
+    if _seen(poll_id, voter, h1, h2):
+        return False
+    # Only a session that exists counts, or a made-up cookie would let a
+    # client vote as often as it liked. Checking costs a query, so it's
+    # left until the vote is about to go through.
+    if key != client_key(request) and not request.session.exists(request.session.session_key):
+        voter, h1, h2 = _hash(client_key(request))
+        if _seen(poll_id, voter, h1, h2):
+            return False
+    try:
+        cast_vote(poll_id, choice_id, voter)
+    except AlreadyVoted:
+        # Seen by another host, or before the filter file was lost.
+        seen_set(poll_id).add(h1, h2)
+        return False
+    seen_set(poll_id).add(h1, h2)
+    return True
@@ -0,0 +1,83 @@
+"""
+Streaming export of every poll with its choices and vote counts.
+
+Polls are read a chunk at a time by id, with one more query per chunk for
+their choices, and written out as they're read. Memory stays bounded by
+the chunk size, and the first rows go out before the last are fetched.
+"""
+import csv
+import json
+from StringIO import StringIO
+
+from polls.models import Poll, Choice
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+CHUNK_SIZE = 500
+CSV_HEADER = ['poll_id', 'question', 'pub_date', 'total_votes', 'choice_id', 'choice', 'votes']
+
+
+def iter_polls(chunk_size=CHUNK_SIZE):
+    """
+    Yield (poll, choices) for every poll in id order, as dicts of their
+    values.
+    """
+    last_id = 0
+    while True:
+        polls = list(Poll.objects.filter(id__gt=last_id).order_by('id').values(
+            'id', 'question', 'pub_date', 'vote_count')[:chunk_size])
+        if not polls:
+            return
+        choices = dict((poll['id'], []) for poll in polls)
+        for choice in Choice.objects.filter(poll__in=list(choices)).order_by('poll', 'id').values(
+                'poll', 'id', 'choice', 'votes'):
+            choices[choice['poll']].append(choice)
+        for poll in polls:
+            yield poll, choices[poll['id']]
+        last_id = polls[-1]['id']
+
+
+def export_results(format, chunk_size=CHUNK_SIZE):
+    """
+    Yield the export a line at a time as UTF-8 encoded strings.
+
+    CSV has a row per choice (or a row with blank choice columns for a poll
+    that has none). JSONL has a line per poll with its choices nested.
+    """
+    if format == 'csv':
+        return _export_csv(chunk_size)
+    elif format == 'jsonl':
+        return _export_jsonl(chunk_size)
+    raise ValueError("Unknown export format %r; expected one of %s" % (format, ", ".join(FORMATS)))
+
+
+def _export_csv(chunk_size):
+    yield _csv_line(CSV_HEADER)
+    for poll, choices in iter_polls(chunk_size):
+        poll_columns = [poll['id'], poll['question'], poll['pub_date'].isoformat(), poll['vote_count']]
+        if not choices:
+            yield _csv_line(poll_columns + ['', '', ''])
+        for choice in choices:
+            yield _csv_line(poll_columns + [choice['id'], choice['choice'], choice['votes']])
+
+
+def _csv_line(values):
+    line = StringIO()
+    csv.writer(line).writerow([
+        value.encode('utf-8') if isinstance(value, unicode) else value for value in values
+    ])
+    return line.getvalue()
+
+
+def _export_jsonl(chunk_size):
+    for poll, choices in iter_polls(chunk_size):
+        yield json.dumps({
+            'id': poll['id'],
+            'question': poll['question'],
+            'pub_date': poll['pub_date'].isoformat(),
+            'total_votes': poll['vote_count'],
+            'choices': [
+                {'id': choice['id'], 'choice': choice['choice'], 'votes': choice['votes']}
+                for choice in choices
+            ],
+        }) + '\n'
@@ -0,0 +1,112 @@
+"""
+Bulk loading of votes collected elsewhere (kiosks, partner integrations).
+
+Votes are streamed from a file-like object in JSONL or CSV and applied a
+chunk at a time, so memory use depends on the chunk size and not on how
+big the file is.
+"""
+import csv
+import json
+import time
+from itertools import islice
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from polls.models import Choice
+from polls.rollups import MINUTE, truncate
+from polls.votes import add_votes
+
+FORMATS = ('jsonl', 'csv')
+CHUNK_SIZE = 10000
+# Keeps each validation query under SQLite's 999 parameter limit.
+LOOKUP_BATCH_SIZE = 900
+
+
+def read_votes(lines, format):
+    """
+    Yield a (poll_id, choice_id, cast) triple for each vote in ``lines``,
+    or None for rows that can't be read. ``cast`` is when the vote was
+    cast, if the row says, otherwise None.
+
+    JSONL rows look like {"poll": 1, "choice": 2, "time": "2014-01-01T12:00:00Z"}.
+    CSV needs a header row with poll and choice columns, and optionally
+    time. Times without a UTC offset are in TIME_ZONE.
+    """
+    if format == 'jsonl':
+        rows = (_parse_json(line) for line in lines if line.strip())
+    elif format == 'csv':
+        rows = csv.DictReader(lines)
+    else:
+        raise ValueError("Unknown vote format %r; expected one of %s" % (format, ", ".join(FORMATS)))
+    for row in rows:
+        try:
+            yield int(row['poll']), int(row['choice']), _parse_time(row.get('time'))
+        except (TypeError, KeyError, ValueError, AttributeError):
+            yield None
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    when = parse_datetime(value)
+    if when is None:
+        raise ValueError("Unreadable time %r" % value)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when, timezone.get_default_timezone())
+    return when
+
+
+def _parse_json(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def import_votes(votes, chunk_size=CHUNK_SIZE):
+    """
+    Apply an iterable of votes from read_votes() in chunks of
+    ``chunk_size``, each checked against the database in bulk and written
+    in its own transaction by add_votes().
+
+    Returns (accepted, rejected, seconds taken). Votes are rejected if the
+    row was unreadable or the choice doesn't belong to the poll.
+    """
+    start = time.time()
+    accepted = rejected = 0
+    votes = iter(votes)
+    while True:
+        chunk = list(islice(votes, chunk_size))
+        if not chunk:
+            break
+        valid = [vote for vote in chunk if vote is not None]
+        polls_by_choice = _polls_by_choice(set(choice_id for _, choice_id, _ in valid))
+
+        counts = {}
+        # Logged as cast when the row says, to the minute, which is as
+        # fine as the rollups go.
+        events = {}
+        now = timezone.now()
+        for poll_id, choice_id, cast in valid:
+            if polls_by_choice.get(choice_id) == poll_id:
+                counts[poll_id, choice_id] = counts.get((poll_id, choice_id), 0) + 1
+                key = (poll_id, choice_id, truncate(cast, MINUTE) if cast else now)
+                events[key] = events.get(key, 0) + 1
+        if counts:
+            add_votes(counts, events)
+
+        chunk_accepted = sum(counts.values())
+        accepted += chunk_accepted
+        rejected += len(chunk) - chunk_accepted
+    return accepted, rejected, time.time() - start
+
+
+def _polls_by_choice(choice_ids):
+    choice_ids = sorted(choice_ids)
+    polls_by_choice = {}
+    for start in range(0, len(choice_ids), LOOKUP_BATCH_SIZE):
+        polls_by_choice.update(Choice.objects.filter(
+            id__in=choice_ids[start:start + LOOKUP_BATCH_SIZE]
+        ).values_list('id', 'poll'))
+    return polls_by_choice
@@ -0,0 +1,190 @@
+"""
+Bulk creation of polls, for seeding big catalogues.
+
+Polls are streamed from JSONL, one poll per line with its choices nested,
+the same shape as the JSONL export (ids and totals are ignored)::
+
+    {"question": "6 times 7?", "pub_date": "2014-01-01T12:00:00+00:00",
+     "choices": [{"choice": "42", "votes": 3}, "41"]}
+
+``pub_date`` defaults to now, and a choice can be just its text. Polls go
+in with bulk_create(), a batch per transaction: a statement or two per
+batch rather than a save() per poll and choice, and no signals. Except
+on SQLite, polls are saved one at a time, as that's the only way to be
+sure of their ids, and only their choices are bulk inserted.
+create_polls() indexes them for search itself. With ``defer_indexes``,
+the polls and choices tables' secondary indexes are dropped for the load
+and built once at the end, which is quicker than keeping them up to date
+row by row. If a deferred load is killed, ``manage.py sqlindexes polls``
+prints the statements to put them back.
+"""
+import json
+import re
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from polls import search
+from polls.caching import invalidate_poll_list
+from polls.models import Poll, Choice
+
+BATCH_SIZE = 1000
+
+# Databases whose bulk inserts of polls can be matched back to their ids.
+BULK_INSERT_VENDORS = ('sqlite',)
+
+QUESTION_LENGTH = Poll._meta.get_field('question').max_length
+CHOICE_LENGTH = Choice._meta.get_field('choice').max_length
+
+_INDEX_NAME = re.compile(r'^CREATE INDEX (\S+) ON')
+
+
+def read_polls(lines):
+    """
+    Yield a poll for each line of JSONL in ``lines``, as a dict of
+    ``question``, ``pub_date`` and ``choices`` (a list of (choice, votes)
+    pairs), or None for lines that aren't a valid poll.
+    """
+    now = timezone.now()
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield _parse_poll(json.loads(line), now)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            yield None
+
+
+def _parse_poll(row, now):
+    question = row['question'].strip()
+    if not question or len(question) > QUESTION_LENGTH:
+        raise ValueError
+    pub_date = now
+    if row.get('pub_date'):
+        pub_date = parse_datetime(row['pub_date'])
+        if pub_date is None:
+            raise ValueError
+        if timezone.is_naive(pub_date):
+            pub_date = timezone.make_aware(pub_date, timezone.get_default_timezone())
+    choices = []
+    for choice in row.get('choices') or []:
+        if not isinstance(choice, dict):
+            choice = {'choice': choice}
+        text, votes = choice['choice'].strip(), int(choice.get('votes') or 0)
+        if not text or len(text) > CHOICE_LENGTH or votes < 0:
+            raise ValueError
+        choices.append((text, votes))
+    return {'question': question, 'pub_date': pub_date, 'choices': choices}
+
+
+def create_polls(polls, batch_size=BATCH_SIZE, defer_indexes=False):
+    """
+    Create polls, given as an iterable of dicts like read_polls()'
+    (Nones are skipped), ``batch_size`` per transaction.
+
+    Returns (polls created, choices created, polls rejected, seconds taken).
+    """
+    start = time.time()
+    created = choices_created = rejected = 0
+    polls = iter(polls)
+    with _maybe(deferred_indexes(Poll, Choice), defer_indexes):
+        while True:
+            batch = list(islice(polls, batch_size))
+            if not batch:
+                break
+            valid = [poll for poll in batch if poll is not None]
+            rejected += len(batch) - len(valid)
+            if valid:
+                choices_created += _create_batch(valid, index=not defer_indexes)
+                created += len(valid)
+    if created:
+        if defer_indexes and search.available():
+            search.rebuild_index()
+        invalidate_poll_list()
+    return created, choices_created, rejected, time.time() - start
+
+
+def _create_batch(polls, index):
+    bulk = connection.vendor in BULK_INSERT_VENDORS
+    with transaction.atomic():
+        ids = _insert_polls([
+            Poll(question=poll['question'], pub_date=poll['pub_date'],
+                 vote_count=sum(votes for _, votes in poll['choices']))
+            for poll in polls
+        ], bulk)
+        choices = [
+            Choice(poll_id=poll_id, choice=text, votes=votes)
+            for poll_id, poll in zip(ids, polls)
+            for text, votes in poll['choices']
+        ]
+        Choice.objects.bulk_create(choices)
+        if index and search.available():
+            if bulk:
+                search.index_polls(ids[0], ids[-1])
+            else:
+                # Saving indexed them, but before they had choices.
+                for poll_id in ids:
+                    search.index_poll(poll_id)
+    return len(choices)
+
+
+def _insert_polls(polls, bulk):
+    """
+    Insert ``polls`` and return their ids, in order. Called in a
+    transaction.
+    """
+    if bulk:
+        Poll.objects.bulk_create(polls)
+        # bulk_create() doesn't hand back ids. SQLite lets one writer in at
+        # a time, and the transaction holds the lock from the insert on, so
+        # the batch's polls are the newest ones, with consecutive ids.
+        ids = list(Poll.objects.order_by('-id').values_list('id', flat=True)[:len(polls)])[::-1]
+        if ids[-1] - ids[0] != len(polls) - 1:
+            raise DatabaseError("Another writer's polls were mixed into the batch.")
+        return ids
+    # Elsewhere other writers' inserts can land among the batch's, so the
+    # polls go in one at a time to learn their ids. Choices are still
+    # bulk inserted.
+    for poll in polls:
+        poll.save(force_insert=True)
+    return [poll.id for poll in polls]
+
+
+@contextmanager
+def _maybe(context, enabled):
+    if enabled:
+        with context:
+            yield
+    else:
+        yield
+
+
+@contextmanager
+def deferred_indexes(*models):
+    """
+    Drop the secondary indexes of ``models``' tables for the duration of
+    the block, and build them again after it, whether or not it succeeds.
+    Unique indexes stay, as they're constraints.
+    """
+    statements = []
+    for model in models:
+        statements.extend(connection.creation.sql_indexes_for_model(model, no_style()))
+    cursor = connection.cursor()
+    for statement in statements:
+        name = _INDEX_NAME.match(statement).group(1)
+        if connection.vendor == 'mysql':
+            table = re.search(r' ON (\S+)', statement).group(1)
+            cursor.execute("DROP INDEX %s ON %s" % (name, table))
+        else:
+            cursor.execute("DROP INDEX IF EXISTS %s" % name)
+    try:
+        yield
+    finally:
+        cursor = connection.cursor()
+        for statement in statements:
+            cursor.execute(statement.rstrip(';'))
@@ -0,0 +1,23 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.benchmarks import BENCHMARKS, throwaway_database
+
+
+class Command(BaseCommand):
+    args = '[benchmark ...]'
+    help = ("Runs the named polls benchmarks (default: all of them) against "
+            "a throwaway copy of the test database.")
+
+    def handle(self, *names, **options):
+        names = names or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError("Unknown benchmark(s): %s. Choose from: %s" % (
+                ", ".join(unknown), ", ".join(sorted(BENCHMARKS))))
+
+        with throwaway_database():
+            for name in names:
+                self.stdout.write("== %s" % name)
+                BENCHMARKS[name](self.stdout)
+                call_command('flush', interactive=False, verbosity=0)
@@ -0,0 +1,23 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from polls.votes import compact_shards
+
+
+class Command(BaseCommand):
+    help = "Folds votes waiting in sharded counters back into their choices and polls."
+    option_list = BaseCommand.option_list + (
+        make_option('--every', type='float',
+            help="Keep running, compacting every this many seconds"),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            compacted = compact_shards()
+            if int(options['verbosity']) > 0:
+                self.stdout.write("Compacted %d sharded vote(s)." % compacted)
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,19 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from polls.export import CHUNK_SIZE, FORMATS, export_results
+
+
+class Command(BaseCommand):
+    help = "Writes every poll with its choices and vote counts to stdout."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=FORMATS, default='csv',
+            help="Output format (default: csv)"),
+        make_option('--chunk-size', type='int', default=CHUNK_SIZE,
+            help="Polls to read per query (default: %d)" % CHUNK_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        for line in export_results(options['format'], options['chunk_size']):
+            self.stdout.write(line, ending='')
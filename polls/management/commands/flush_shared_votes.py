@@ -0,0 +1,33 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.sharedcounts import FlusherRunning, get_shared_counters
+from polls.votes import flush_shared_votes, recover_shared_votes
+
+
+class Command(BaseCommand):
+    help = "Writes the votes counted in shared memory to the database."
+    option_list = BaseCommand.option_list + (
+        make_option('--every', type='float',
+            help="Keep running, flushing every this many seconds"),
+    )
+
+    def handle(self, *args, **options):
+        counters = get_shared_counters()
+        if counters is None:
+            raise CommandError("POLLS_SHARED_VOTES_FILE isn't set.")
+        try:
+            counters.become_flusher()
+        except FlusherRunning as e:
+            raise CommandError(str(e))
+        recover_shared_votes(counters)
+
+        while True:
+            flushed = flush_shared_votes(counters)
+            if int(options['verbosity']) > 0:
+                self.stdout.write("Flushed %d shared vote(s)." % flushed)
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,33 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.ingest import CHUNK_SIZE, FORMATS, import_votes, read_votes
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = "Imports votes from a JSONL or CSV file, one vote per row."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=FORMATS,
+            help="File format (default: guessed from the extension)"),
+        make_option('--chunk-size', type='int', default=CHUNK_SIZE,
+            help="Votes to apply per transaction (default: %d)" % CHUNK_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the file of votes to import.")
+        path = args[0]
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in FORMATS:
+            raise CommandError("Can't tell the format of %s; use --format." % path)
+
+        with open(path, 'rb') as lines:
+            accepted, rejected, seconds = import_votes(
+                read_votes(lines, format), options['chunk_size'])
+
+        rows = accepted + rejected
+        self.stdout.write("Imported %d votes, rejected %d, in %.1fs (%.0f rows/sec)." % (
+            accepted, rejected, seconds, rows / seconds if seconds else rows))
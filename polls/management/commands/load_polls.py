@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.loading import BATCH_SIZE, create_polls, read_polls
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = "Creates polls from a JSONL file, one poll per line with its choices."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=BATCH_SIZE,
+            help="Polls to create per transaction (default: %d)" % BATCH_SIZE),
+        make_option('--defer-indexes', action='store_true', default=False,
+            help="Drop the polls' and choices' indexes during the load and build them after it"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the file of polls to load.")
+
+        with open(args[0], 'rb') as lines:
+            polls, choices, rejected, seconds = create_polls(
+                read_polls(lines), options['batch_size'], options['defer_indexes'])
+
+        rows = polls + choices
+        self.stdout.write("Loaded %d polls and %d choices, rejected %d, in %.1fs (%.0f rows/sec)." % (
+            polls, choices, rejected, seconds, rows / seconds if seconds else rows))
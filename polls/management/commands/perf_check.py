@@ -0,0 +1,61 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.benchmarks import throwaway_database
+from polls.perf import (
+    SCENARIOS, check_budgets, compare, load_baseline, run_suite, save_baseline,
+    seed_catalog,
+)
+
+
+class Command(BaseCommand):
+    help = ("Measures the home page, poll page and voting against a synthetic "
+            "catalogue of polls, failing if any exceed their query budgets or "
+            "have regressed against this machine's baseline, if it has one.")
+    option_list = BaseCommand.option_list + (
+        make_option('--polls', type='int', default=10000,
+            help="Polls to seed, each with 2-50 choices (default: 10000)"),
+        make_option('--requests', type='int', default=200,
+            help="Requests to make per scenario (default: 200)"),
+        make_option('--baseline', default='perf_baseline.json',
+            help="Baseline results recorded on this machine to compare against "
+                 "(default: perf_baseline.json, which isn't committed)"),
+        make_option('--save-baseline', action='store_true', default=False,
+            help="Write these results to the baseline file instead of comparing"),
+        make_option('--tolerance', type='float', default=0.25,
+            help="Fraction p95 latency may grow past the baseline (default: 0.25)"),
+    )
+
+    def handle(self, *args, **options):
+        path = options['baseline']
+        baseline = None
+        if not options['save_baseline'] and os.path.exists(path):
+            baseline = load_baseline(path)
+            if baseline['polls'] != options['polls']:
+                raise CommandError("%s was recorded with --polls=%d." % (path, baseline['polls']))
+
+        with throwaway_database():
+            seed_catalog(options['polls'])
+            results = run_suite(options['requests'])
+
+        self.stdout.write("%6s %10s %10s %10s %8s" % ("view", "req/sec", "p50 ms", "p95 ms", "queries"))
+        for name in SCENARIOS:
+            result = results[name]
+            self.stdout.write("%6s %10.0f %10.2f %10.2f %8d" % (
+                name, result['rps'], result['p50_ms'], result['p95_ms'], result['queries']))
+
+        failures = check_budgets(results)
+        if options['save_baseline']:
+            save_baseline(path, options['polls'], results)
+            self.stdout.write("Saved baseline to %s." % path)
+        elif baseline is not None:
+            failures += compare(results, baseline['results'], options['tolerance'])
+        else:
+            # Timings only compare on the machine that recorded them.
+            self.stdout.write("No baseline at %s; only checked query budgets. "
+                              "Record one on this machine with --save-baseline." % path)
+
+        if failures:
+            raise CommandError("Performance regressed:\n  %s" % "\n  ".join(failures))
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of poll questions and choices."
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError("The database doesn't support FTS5, so there's no index to build.")
+        start = time.time()
+        indexed = search.rebuild_index()
+        self.stdout.write("Indexed %d polls in %.1fs." % (indexed, time.time() - start))
@@ -0,0 +1,24 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from polls.models import Poll, Choice
+
+
+class Command(NoArgsCommand):
+    help = "Recomputes each poll's stored vote total from its choices."
+
+    def handle_noargs(self, **options):
+        qn = connection.ops.quote_name
+        actual = "(SELECT COALESCE(SUM(%s), 0) FROM %s WHERE %s = %s.%s)" % (
+            qn('votes'), qn(Choice._meta.db_table), qn('poll_id'),
+            qn(Poll._meta.db_table), qn('id'),
+        )
+        # One statement, so votes landing mid-run can't be lost.
+        sql = "UPDATE %s SET %s = %s WHERE %s <> %s" % (
+            qn(Poll._meta.db_table), qn('vote_count'), actual, qn('vote_count'), actual,
+        )
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute(sql)
+            fixed = cursor.rowcount
+        self.stdout.write("Reconciled vote totals for %d poll(s)." % fixed)
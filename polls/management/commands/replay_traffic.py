@@ -0,0 +1,70 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.replay import POOLS, read_requests, replay, serve, summarise
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = ("Replays a JSON lines traffic log against the site, reporting "
+            "throughput, latency and errors per URL pattern.")
+    option_list = BaseCommand.option_list + (
+        make_option('--url',
+            help="Send requests to the server at this URL (default: in-process)"),
+        make_option('--serve', action='store_true', default=False,
+            help="Start a local server and send requests to it over HTTP"),
+        make_option('--concurrency', type='int', default=1,
+            help="Workers replaying requests at once (default: 1)"),
+        make_option('--pool', choices=POOLS, default='thread',
+            help="Run workers as threads or processes (default: thread)"),
+        make_option('--rate', type='float',
+            help="Send this many requests per second in all"),
+        make_option('--speed', type='float',
+            help="Replay at this multiple of the recorded pace"),
+        make_option('--warmup', type='int', default=0,
+            help="Replay this many requests first, leaving them out of the report"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the traffic log to replay.")
+        if options['url'] and options['serve']:
+            raise CommandError("Use --url or --serve, not both.")
+        if options['rate'] and options['speed']:
+            raise CommandError("Use --rate or --speed, not both.")
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+
+        with open(args[0], 'rb') as lines:
+            try:
+                requests = read_requests(lines)
+            except ValueError as e:
+                raise CommandError(str(e))
+        if options['speed'] and all(r['t'] is None for r in requests):
+            raise CommandError("--speed needs requests with recorded times ('t').")
+        warmup, requests = requests[:options['warmup']], requests[options['warmup']:]
+        if not requests:
+            raise CommandError("Nothing to replay after the warmup.")
+
+        server = serve() if options['serve'] else None
+        url = 'http://127.0.0.1:%d' % server.server_port if server else options['url']
+        kwargs = dict(url=url, concurrency=options['concurrency'], pool=options['pool'])
+        try:
+            if warmup:
+                replay(warmup, **kwargs)
+            samples, elapsed = replay(requests, rate=options['rate'], speed=options['speed'], **kwargs)
+        finally:
+            if server:
+                server.shutdown()
+
+        summary = summarise(samples, elapsed)
+        self.stdout.write("%d requests in %.1fs from %d %s worker(s)" % (
+            len(samples), elapsed, options['concurrency'], options['pool']))
+        self.stdout.write("%-28s %8s %9s %9s %9s %9s %8s" % (
+            "pattern", "requests", "req/sec", "p50 ms", "p95 ms", "p99 ms", "errors"))
+        for pattern in sorted(summary, key=lambda p: (p == '*', p)):
+            row = summary[pattern]
+            self.stdout.write("%-28s %8d %9.1f %9.2f %9.2f %9.2f %7.1f%%" % (
+                pattern, row['requests'], row['rps'], row['p50_ms'], row['p95_ms'],
+                row['p99_ms'], row['error_rate'] * 100))
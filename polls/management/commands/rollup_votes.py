@@ -0,0 +1,25 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from polls.rollups import CHUNK_SIZE, rollup_events
+
+
+class Command(BaseCommand):
+    help = "Folds the vote event log into minute, hour and day rollups."
+    option_list = BaseCommand.option_list + (
+        make_option('--every', type='float',
+            help="Keep running, rolling up every this many seconds"),
+        make_option('--chunk-size', type='int', default=CHUNK_SIZE,
+            help="Events to roll up per transaction (default: %d)" % CHUNK_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            rolled_up = rollup_events(options['chunk_size'])
+            if int(options['verbosity']) > 0:
+                self.stdout.write("Rolled up %d vote event(s)." % rolled_up)
+            if not options['every']:
+                break
+            time.sleep(options['every'])
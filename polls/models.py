@@ -1,22 +1,302 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from mysite.replicas import use_primary
+from polls.caching import SHARD_SUMS_TIMEOUT, invalidate_poll, invalidate_poll_list, shard_sums_key
+from polls.sharedcounts import get_shared_counters
+
+def _from_db(model, values, using):
+    obj = model(**values)
+    obj._state.adding = False
+    obj._state.db = using
+    return obj
+
+class PollManager(models.Manager):
+
+    def get_with_choices(self, pk, shared_votes=True):
+        """
+        Fetch a poll and all of its choices in a single query.
+
+        The choices are cached on the poll as though they'd been prefetched,
+        so poll.choice_set.all(), total_votes() and each choice's
+        percentage() are all answered without going back to the database.
+
+        With POLLS_VOTE_SHARDS or POLLS_SHARED_VOTES_FILE on, the counts
+        include votes still waiting in VoteShards or shared memory, so the
+        poll and choices are only for reading: saving them would count
+        those votes twice. Pass ``shared_votes=False`` to leave out the
+        ones in shared memory, e.g. to cache the poll, and add them with
+        add_shared_votes() when it's read back.
+        """
+        poll_fields = Poll._meta.concrete_fields
+        choice_fields = Choice._meta.concrete_fields
+        queryset = self.get_queryset().filter(pk=pk).order_by('choice__id')
+        names = [f.name for f in poll_fields] + ['choice__' + f.name for f in choice_fields]
+        rows = list(queryset.values(*names))
+        if not rows:
+            raise Poll.DoesNotExist
+
+        poll = _from_db(Poll, dict((f.attname, rows[0][f.name]) for f in poll_fields), queryset.db)
+        sharded = {}
+        if getattr(settings, 'POLLS_VOTE_SHARDS', None):
+            sharded = VoteShard.pending_votes([poll.id])[poll.id]
+        choices = []
+        for row in rows:
+            # A poll without choices still comes back as one row of NULLs
+            if row['choice__id'] is None:
+                continue
+            choice = _from_db(Choice, dict(
+                (f.attname, row['choice__' + f.name]) for f in choice_fields
+            ), queryset.db)
+            pending = sharded.get(choice.id, 0)
+            choice.votes += pending
+            poll.vote_count += pending
+            choice.poll = poll
+            choices.append(choice)
+
+        prefetched = poll.choice_set.all()
+        prefetched._result_cache = choices
+        prefetched._prefetch_done = True
+        poll._prefetched_objects_cache = {Choice._meta.get_field('poll').related_query_name(): prefetched}
+        if shared_votes:
+            add_shared_votes(poll)
+        return poll
+
+def add_shared_votes(poll):
+    """
+    Add the votes waiting in shared memory to a poll fetched with
+    get_with_choices(shared_votes=False). They're read from the mapped
+    file, so every process sees the same counts, but they must never go
+    into a cache that only one process would invalidate.
+    """
+    counters = get_shared_counters()
+    if counters is None:
+        return poll
+    for choice in poll.choice_set.all():
+        pending = counters.pending(choice.id)
+        choice.votes += pending
+        poll.vote_count += pending
+    return poll
 
 class Poll(models.Model):
-    question = models.CharField(max_length=200)
-    pub_date = models.DateTimeField(verbose_name='Date published')
+    question = models.CharField(max_length=200, db_index=True)
+    pub_date = models.DateTimeField(verbose_name='Date published', db_index=True)
+    # Running total of its choices' votes, kept in step by Choice.save(),
+    # Choice.delete() and polls.votes. The reconcile_vote_counts command
+    # repairs any drift.
+    vote_count = models.IntegerField(default=0, editable=False)
+    # Bumped, and modified stamped, whenever the poll or its results
+    # change. version backs the ETag of the JSON results.
+    version = models.IntegerField(default=0, editable=False)
+    modified = models.DateTimeField(auto_now=True)
+
+    objects = PollManager()
+
+    # Only ever changed in the database, so a stale copy mustn't be saved
+    # back over them.
+    COUNTERS = ('vote_count', 'version')
 
     def __unicode__(self):
         return self.question
 
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('force_insert') or 'update_fields' in kwargs:
+            return super(Poll, self).save(*args, **kwargs)
+        kwargs['update_fields'] = [
+            f.name for f in self._meta.concrete_fields
+            if not f.primary_key and f.name not in self.COUNTERS
+        ]
+        with transaction.atomic():
+            super(Poll, self).save(*args, **kwargs)
+            Poll.objects.filter(pk=self.pk).update(version=F('version') + 1)
+        self.version += 1
+
     def total_votes(self):
-        return sum(c.votes for c in self.choice_set.all())
+        return self.vote_count
 
 class Choice(models.Model):
     poll = models.ForeignKey(Poll)
     choice = models.CharField(max_length=200)
     votes = models.IntegerField(default=0)
 
+    def __init__(self, *args, **kwargs):
+        super(Choice, self).__init__(*args, **kwargs)
+        # What the poll's vote_count has of it, once it's in the database.
+        self._counted_votes = self.votes
+
+    def save(self, *args, **kwargs):
+        delta = self.votes - (0 if self._state.adding else self._counted_votes)
+        if self._state.adding or kwargs.get('force_insert') or 'update_fields' in kwargs:
+            with transaction.atomic():
+                super(Choice, self).save(*args, **kwargs)
+                self._update_poll(delta)
+            self._counted_votes = self.votes
+            return
+        # Votes cast since this choice was loaded are in the database only,
+        # so votes is applied as the change made to it here rather than
+        # written back over them. The admin shows it read-only for that
+        # reason: a count typed in would be added, not set.
+        kwargs['update_fields'] = [
+            f.name for f in self._meta.concrete_fields
+            if not f.primary_key and f.name != 'votes'
+        ]
+        with transaction.atomic():
+            super(Choice, self).save(*args, **kwargs)
+            if delta:
+                Choice.objects.filter(pk=self.pk).update(votes=F('votes') + delta)
+            self._update_poll(delta)
+        self._counted_votes = self.votes
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # Take away the votes it has now, not when it was loaded.
+            votes = Choice.objects.select_for_update().filter(pk=self.pk).values_list('votes', flat=True)
+            self._update_poll(-(votes[0] if votes else self._counted_votes))
+            super(Choice, self).delete(*args, **kwargs)
+        self._counted_votes = 0
+
+    def _update_poll(self, delta):
+        Poll.objects.filter(pk=self.poll_id).update(
+            vote_count=F('vote_count') + delta,
+            version=F('version') + 1,
+            modified=timezone.now(),
+        )
+        # Keep an already-loaded poll in step so it doesn't need re-reading.
+        if Choice.poll.is_cached(self):
+            self.poll.vote_count += delta
+            self.poll.version += 1
+
     def percentage(self):
         try:
             return (100.0 * self.votes / self.poll.total_votes())
         except ZeroDivisionError:
             return 0
+
+class VoteShard(models.Model):
+    """
+    One of the POLLS_VOTE_SHARDS counters a choice's newest votes are
+    spread across, so that voters on a hot choice don't all queue for its
+    row. polls.votes.compact_shards() folds them into Choice.votes and
+    Poll.vote_count.
+    """
+    poll = models.ForeignKey(Poll)
+    choice = models.ForeignKey(Choice, db_index=False)
+    shard = models.SmallIntegerField()
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('choice', 'shard')]
+
+    @classmethod
+    def pending_votes(cls, poll_ids):
+        """
+        The votes waiting in shards for each of ``poll_ids``' choices, as
+        {poll_id: {choice_id: votes}}. Each poll's are cached, and
+        polls.caching.invalidate_poll() clears them whenever a sharded vote
+        is cast or the shards are compacted, so reads don't all sum the
+        shards.
+        """
+        keys = dict((shard_sums_key(poll_id), poll_id) for poll_id in poll_ids)
+        sums = dict((keys[key], votes) for key, votes in cache.get_many(keys.keys()).items())
+        missing = [poll_id for poll_id in poll_ids if poll_id not in sums]
+        if missing:
+            for poll_id in missing:
+                sums[poll_id] = {}
+            # Served to every client, so read from the primary.
+            with use_primary():
+                rows = list(cls.objects.filter(poll__in=missing).values_list('poll', 'choice').annotate(Sum('votes')))
+            for poll_id, choice_id, votes in rows:
+                if votes:
+                    sums[poll_id][choice_id] = votes
+            cache.set_many(dict((shard_sums_key(poll_id), sums[poll_id]) for poll_id in missing), SHARD_SUMS_TIMEOUT)
+        return sums
+
+    @classmethod
+    def sum_sql(cls, column, model):
+        """
+        A subquery for the votes in the shards whose ``column`` (choice_id
+        or poll_id) matches the id of the ``model`` row it's selected with.
+        """
+        qn = connection.ops.quote_name
+        return "SELECT SUM(%s) FROM %s WHERE %s = %s.%s" % (
+            qn('votes'), qn(cls._meta.db_table), qn(column), qn(model._meta.db_table), qn('id'))
+
+class VoteEvent(models.Model):
+    """
+    Append-only record of votes as they're cast; a batch of votes for one
+    choice is a single row. polls.rollups folds these into VoteRollups and
+    deletes them, so the table only ever holds the not-yet-rolled-up tail.
+    """
+    # No indexes beyond the primary key, to keep inserts cheap.
+    poll = models.ForeignKey(Poll, db_index=False)
+    choice = models.ForeignKey(Choice, db_index=False)
+    votes = models.IntegerField(default=1)
+    created = models.DateTimeField()
+
+class VoteRollup(models.Model):
+    """
+    Votes for a choice within one minute, hour or day, starting at bucket.
+    """
+    MINUTE, HOUR, DAY = 'minute', 'hour', 'day'
+    GRANULARITIES = ((MINUTE, 'Minute'), (HOUR, 'Hour'), (DAY, 'Day'))
+
+    poll = models.ForeignKey(Poll, db_index=False)
+    choice = models.ForeignKey(Choice, db_index=False)
+    granularity = models.CharField(max_length=6, choices=GRANULARITIES)
+    bucket = models.DateTimeField()
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('choice', 'granularity', 'bucket')]
+        index_together = [('poll', 'granularity', 'bucket')]
+
+class Voter(models.Model):
+    """
+    Someone who has voted on a poll, identified by a keyed hash of their
+    session or client (see polls.dedup). The unique index is the final
+    word on whether they've voted before.
+    """
+    poll = models.ForeignKey(Poll, db_index=False)
+    voter = models.BigIntegerField()
+
+    class Meta:
+        unique_together = [('poll', 'voter')]
+
+class SharedVoteCheckpoint(models.Model):
+    """
+    How many of a choice's votes counted in the shared memory file
+    file_id have been flushed to the database (see polls.sharedcounts).
+    Written in the same transaction as the votes.
+    """
+    choice = models.OneToOneField(Choice, primary_key=True)
+    file_id = models.BigIntegerField()
+    counted = models.BigIntegerField()
+
+class TrendingPoll(models.Model):
+    """
+    A poll's saved score on the hot polls leaderboard, in the units of
+    era (see polls.trending). Only the top POLLS_TRENDING_SIZE are kept.
+    """
+    poll = models.OneToOneField(Poll, primary_key=True)
+    score = models.FloatField(db_index=True)
+    era = models.IntegerField()
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+def poll_changed(sender, instance, **kwargs):
+    invalidate_poll(instance.id)
+    invalidate_poll_list()
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    invalidate_poll(instance.poll_id)
+
+# Connects the search index's and leaderboard's receivers.
+import polls.search
+import polls.trending
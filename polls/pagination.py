@@ -0,0 +1,55 @@
+import calendar
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(poll):
+    """
+    Return an opaque cursor pointing just past ``poll`` in (pub_date, id)
+    order, suitable for a query string.
+    """
+    pub_date = poll.pub_date
+    micros = calendar.timegm(pub_date.utctimetuple()) * 10 ** 6 + pub_date.microsecond
+    return '%d.%d' % (micros, poll.id)
+
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor from encode_cursor() back into its (pub_date, id) pair.
+    Raises ValueError for anything that isn't a cursor.
+    """
+    micros, pk = cursor.split('.')
+    try:
+        pub_date = EPOCH + timedelta(microseconds=int(micros))
+    except (OverflowError, OSError):
+        raise ValueError("Cursor date out of range: %r" % cursor)
+    pk = int(pk)
+    # Past this the database can't compare it with an id.
+    if not 0 <= pk < 2 ** 63:
+        raise ValueError("Cursor id out of range: %r" % cursor)
+    if not settings.USE_TZ:
+        pub_date = timezone.make_naive(pub_date, timezone.utc)
+    return pub_date, pk
+
+
+def keyset_page(queryset, after=None, per_page=20):
+    """
+    Return a page of polls from ``queryset`` in (pub_date, id) order,
+    starting just after the ``after`` cursor, along with the cursor for
+    the following page (None if this is the last one).
+
+    Unlike OFFSET, the filter lets the database seek straight to the start
+    of the page on the pub_date index, so deep pages cost the same as the
+    first.
+    """
+    queryset = queryset.order_by('pub_date', 'id')
+    if after:
+        pub_date, pk = decode_cursor(after)
+        queryset = queryset.filter(pub_date__gte=pub_date).exclude(pub_date=pub_date, id__lte=pk)
+    page = list(queryset[:per_page + 1])
+    next_cursor = encode_cursor(page[per_page - 1]) if len(page) > per_page else None
+    return page[:per_page], next_cursor
@@ -0,0 +1,169 @@
+"""
+Performance regression checks for the polls app.
+
+``run_suite`` drives the home page, the poll page and voting through the
+Django test client against a synthetic catalogue of polls, recording
+latency and queries per request. ``check_budgets`` and ``compare`` turn
+those results into a list of regressions; ``manage.py perf_check`` runs
+the lot and fails if there are any. Query budgets hold everywhere, but
+latency is only compared with a baseline recorded on the same machine,
+so perf_baseline.json is kept out of the repository.
+"""
+import json
+import math
+import random
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from polls.models import Poll, Choice
+from polls.pagination import encode_cursor
+
+# The most queries a single request to each scenario may make, cache cold.
+QUERY_BUDGETS = {
+    'home': 1,
+    'poll': 1,
+    'vote': 4,
+}
+
+SCENARIOS = ('home', 'poll', 'vote')
+
+
+def seed_catalog(num_polls, min_choices=2, max_choices=50, seed=0, batch_size=1000):
+    """
+    Bulk insert ``num_polls`` polls, published one second apart, each with
+    between ``min_choices`` and ``max_choices`` choices holding random vote
+    counts. The same ``seed`` always produces the same catalogue.
+    """
+    rng = random.Random(seed)
+    start = timezone.now() - timedelta(seconds=num_polls)
+    for offset in range(0, num_polls, batch_size):
+        votes = [
+            [rng.randint(0, 1000) for _ in range(rng.randint(min_choices, max_choices))]
+            for _ in range(offset, min(offset + batch_size, num_polls))
+        ]
+        last_id = Poll.objects.aggregate(last=Max('id'))['last'] or 0
+        Poll.objects.bulk_create([
+            Poll(question="Poll %d" % (offset + i),
+                 pub_date=start + timedelta(seconds=offset + i),
+                 vote_count=sum(counts))
+            for i, counts in enumerate(votes)
+        ])
+        poll_ids = Poll.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)
+        Choice.objects.bulk_create([
+            Choice(poll_id=poll_id, choice="Choice %d" % i, votes=count)
+            for poll_id, counts in zip(poll_ids, votes)
+            for i, count in enumerate(counts)
+        ])
+
+
+def percentile(samples, pct):
+    """
+    The nearest-rank ``pct`` percentile of ``samples``.
+    """
+    samples = sorted(samples)
+    rank = int(math.ceil(pct / 100.0 * len(samples))) - 1
+    return samples[max(0, min(rank, len(samples) - 1))]
+
+
+def measure(requests):
+    """
+    Make each of ``requests``, a sequence of zero-argument callables, with
+    the cache cleared first, and summarise how long they took and how many
+    queries they made.
+    """
+    timings, queries = [], []
+    for request in requests:
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.time()
+            response = request()
+            timings.append(time.time() - start)
+        assert response.status_code in (200, 302), response.status_code
+        queries.append(len(captured))
+    elapsed = sum(timings)
+    return {
+        'requests': len(timings),
+        'rps': round(len(timings) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'queries': max(queries),
+    }
+
+
+def run_suite(requests=200, seed=0):
+    """
+    Measure ``requests`` requests to each scenario against whatever polls
+    are in the database, returning a dict of results keyed by scenario.
+    """
+    rng = random.Random(seed)
+    polls = list(Poll.objects.values_list('id', 'pub_date'))
+    choices = dict(Choice.objects.filter(
+        poll__in=[poll_id for poll_id, _ in rng.sample(polls, min(len(polls), requests))],
+    ).values_list('poll', 'id'))
+    client = Client()
+
+    def home():
+        poll_id, pub_date = rng.choice(polls)
+        cursor = encode_cursor(Poll(id=poll_id, pub_date=pub_date))
+        return client.get('/', {'after': cursor})
+
+    def poll():
+        return client.get('/poll/%d/' % rng.choice(polls)[0])
+
+    def vote():
+        poll_id, choice_id = rng.choice(list(choices.items()))
+        return client.post('/poll/%d/' % poll_id, {'vote': choice_id})
+
+    scenarios = {'home': home, 'poll': poll, 'vote': vote}
+    return dict(
+        (name, measure([scenarios[name]] * requests)) for name in SCENARIOS
+    )
+
+
+def check_budgets(results, budgets=QUERY_BUDGETS):
+    """
+    A message for every scenario in ``results`` that made more queries in
+    a request than its budget allows.
+    """
+    return [
+        "%s: %d queries per request, budget is %d" % (name, results[name]['queries'], budgets[name])
+        for name in SCENARIOS
+        if name in results and name in budgets and results[name]['queries'] > budgets[name]
+    ]
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    A message for every scenario in ``results`` whose p95 latency is more
+    than ``tolerance`` (a fraction) over ``baseline``'s, or which makes
+    more queries per request than it did.
+    """
+    regressions = []
+    for name in SCENARIOS:
+        if name not in results or name not in baseline:
+            continue
+        now, then = results[name], baseline[name]
+        if now['p95_ms'] > then['p95_ms'] * (1 + tolerance):
+            regressions.append("%s: p95 %.2fms, baseline %.2fms" % (name, now['p95_ms'], then['p95_ms']))
+        if now['queries'] > then['queries']:
+            regressions.append("%s: %d queries per request, baseline %d" % (
+                name, now['queries'], then['queries']))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, polls, results):
+    with open(path, 'w') as f:
+        json.dump({'polls': polls, 'results': results}, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
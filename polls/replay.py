@@ -0,0 +1,281 @@
+"""
+Replaying recorded traffic against the site.
+
+A traffic log is JSON lines, one request per line::
+
+    {"method": "GET", "path": "/poll/3/", "t": 0.25}
+    {"method": "POST", "path": "/poll/3/", "data": {"vote": "7"}, "t": 0.31}
+
+``method`` defaults to GET, ``data`` is sent form-encoded and ``headers``
+is an optional mapping of extra request headers. ``t``, seconds since the
+log started, is only needed to replay at the recorded pace.
+``manage.py replay_traffic`` is the command line front end.
+"""
+import httplib
+import json
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+import urllib
+import urlparse
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from wsgiref.util import setup_testing_defaults
+
+from django.core.urlresolvers import Resolver404, resolve
+from django.db import connection
+
+from polls.perf import percentile
+
+FORM = 'application/x-www-form-urlencoded'
+
+# Over plain HTTP, Django's CSRF check only compares the cookie with the
+# form field, so replayed POSTs carry a matching made-up pair.
+CSRF_TOKEN = 'replay' * 5 + 'ed'
+
+POOLS = ('thread', 'process')
+
+
+def read_requests(lines):
+    """
+    Parse a traffic log into a list of requests, each a dict of
+    ``method``, ``path``, ``body``, ``headers`` and ``t`` (None if not
+    recorded).
+    """
+    requests = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            method = str(entry.get('method', 'GET')).upper()
+            path = str(entry['path'])
+            data = entry.get('data') or {}
+            if not isinstance(data, dict):
+                raise TypeError("data isn't an object")
+            if method not in ('GET', 'HEAD'):
+                data = dict(data, csrfmiddlewaretoken=CSRF_TOKEN)
+            body = urllib.urlencode(data) if data else ''
+            headers = dict((str(k), str(v)) for k, v in (entry.get('headers') or {}).items())
+            t = entry.get('t')
+            t = float(t) if t is not None else None
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ValueError("Line %d isn't a request: %r" % (number, line))
+        requests.append({
+            'method': method,
+            'path': path,
+            'body': body,
+            'headers': headers,
+            't': t,
+        })
+    return requests
+
+
+class InProcess(object):
+    """
+    Hands requests straight to the WSGI application in ``mysite.wsgi``.
+    """
+
+    def __init__(self):
+        from mysite.wsgi import application
+        self.application = application
+
+    def environ(self, request):
+        """
+        The WSGI environ for ``request``, one of read_requests()'s.
+        """
+        path, _, query = request['path'].partition('?')
+        environ = {
+            'REQUEST_METHOD': request['method'],
+            'PATH_INFO': urllib.unquote(path),
+            'QUERY_STRING': query,
+            'HTTP_COOKIE': 'csrftoken=' + CSRF_TOKEN,
+            'CONTENT_TYPE': FORM,
+            'CONTENT_LENGTH': str(len(request['body'])),
+            'wsgi.input': StringIO(request['body']),
+            'wsgi.errors': sys.stderr,
+        }
+        for name, value in request.get('headers', {}).items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+        setup_testing_defaults(environ)
+        return environ
+
+    def __call__(self, request):
+        status = []
+
+        def start_response(line, headers, exc_info=None):
+            status.append(int(line.split(' ', 1)[0]))
+
+        response = self.application(self.environ(request), start_response)
+        try:
+            for _ in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return status[0]
+
+
+class OverHTTP(object):
+    """
+    Sends requests to a server at ``url``, over a connection per thread.
+    """
+
+    def __init__(self, url):
+        parts = urlparse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+
+    def __call__(self, request):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = httplib.HTTPConnection(self.host, self.port, timeout=30)
+        headers = dict(request.get('headers', {}), Cookie='csrftoken=' + CSRF_TOKEN)
+        if request['body']:
+            headers['Content-Type'] = FORM
+        try:
+            self.local.connection.request(request['method'], request['path'], request['body'], headers)
+            response = self.local.connection.getresponse()
+            response.read()
+        except (httplib.HTTPException, socket.error):
+            self.local.connection.close()
+            self.local.connection = None
+            raise
+        return response.status
+
+
+class _ThreadedWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=0):
+    """
+    Serve ``mysite.wsgi`` on localhost from a background thread, returning
+    the server; its URL is ``'http://127.0.0.1:%d' % server.server_port``.
+    Call ``shutdown()`` on it when done.
+    """
+    from mysite.wsgi import application
+    server = make_server('127.0.0.1', port, application, _ThreadedWSGIServer, _QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def schedule(requests, rate=None, speed=None):
+    """
+    When, in seconds after the replay starts, to send each request: every
+    ``1 / rate`` seconds, at ``speed`` times their recorded pace, or (the
+    default) each as soon as the one before it finishes (None).
+    """
+    if rate:
+        return [i / float(rate) for i in range(len(requests))]
+    if speed:
+        first = min(r['t'] for r in requests if r['t'] is not None)
+        return [(r['t'] - first) / speed if r['t'] is not None else None for r in requests]
+    return [None] * len(requests)
+
+
+def replay(requests, url=None, concurrency=1, pool='thread', rate=None, speed=None):
+    """
+    Replay ``requests`` in-process, or against the server at ``url``,
+    shared round robin between ``concurrency`` threads or processes.
+    Returns the samples, each ``(method, path, status, seconds)`` with a
+    status of None if the request failed outright, and the wall-clock time
+    the replay took.
+    """
+    offsets = schedule(requests, rate, speed)
+    shares = [
+        [(offsets[i], requests[i]) for i in range(worker, len(requests), concurrency)]
+        for worker in range(concurrency)
+    ]
+    if pool == 'process':
+        # Don't hand the parent's connection down to the children.
+        connection.close()
+        workers = multiprocessing.Pool(concurrency)
+        try:
+            start = time.time()
+            results = workers.map(_replay_share, [(share, url, start) for share in shares])
+        finally:
+            workers.close()
+            workers.join()
+    else:
+        results = [None] * concurrency
+        start = time.time()
+
+        def run(worker):
+            results[worker] = _replay_share((shares[worker], url, start))
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.time() - start
+    return [sample for samples in results for sample in samples], elapsed
+
+
+def _replay_share(args):
+    share, url, start = args
+    send = OverHTTP(url) if url else InProcess()
+    samples = []
+    try:
+        for offset, request in share:
+            if offset is not None:
+                time.sleep(max(0, start + offset - time.time()))
+            sent = time.time()
+            try:
+                status = send(request)
+            except Exception:
+                status = None
+            samples.append((request['method'], request['path'], status, time.time() - sent))
+    finally:
+        connection.close()
+    return samples
+
+
+def url_pattern(path):
+    """
+    The view ``path`` resolves to, which is what samples are grouped by.
+    """
+    try:
+        match = resolve(urllib.unquote(path.partition('?')[0]))
+    except Resolver404:
+        return '<unresolved>'
+    return match.url_name or '%s.%s' % (match.func.__module__, getattr(match.func, '__name__', 'view'))
+
+
+def summarise(samples, elapsed):
+    """
+    Requests, throughput, latency percentiles and error rate for each URL
+    pattern in ``samples``, and for all of them under ``'*'``. Server
+    errors and failed requests count as errors.
+    """
+    groups = {'*': []}
+    for method, path, status, seconds in samples:
+        groups.setdefault(url_pattern(path), []).append((status, seconds))
+        groups['*'].append((status, seconds))
+
+    summary = {}
+    for pattern, group in groups.items():
+        if not group:
+            continue
+        timings = [seconds for _, seconds in group]
+        errors = sum(1 for status, _ in group if status is None or status >= 500)
+        summary[pattern] = {
+            'requests': len(group),
+            'rps': len(group) / elapsed if elapsed else None,
+            'p50_ms': percentile(timings, 50) * 1000,
+            'p95_ms': percentile(timings, 95) * 1000,
+            'p99_ms': percentile(timings, 99) * 1000,
+            'errors': errors,
+            'error_rate': errors / float(len(group)),
+        }
+    return summary
@@ -0,0 +1,133 @@
+"""
+Time-bucketed vote counts.
+
+rollup_events() folds the raw VoteEvent log into per-choice VoteRollup
+buckets for every minute, hour and day, then deletes the events it used.
+vote_totals() and vote_series() answer questions like "votes per hour"
+from the buckets alone, so they cost the same however many votes were
+cast. Votes show up in them once the next rollup has run (and, with
+POLLS_VOTE_EVENT_INTERVAL set, once they've been written to the log).
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max, Q, Sum
+from django.utils import timezone
+
+from polls.models import VoteEvent, VoteRollup
+
+CHUNK_SIZE = 10000
+
+MINUTE, HOUR, DAY = VoteRollup.MINUTE, VoteRollup.HOUR, VoteRollup.DAY
+
+
+def truncate(when, granularity):
+    """
+    The start of the minute, hour or day (in UTC) that ``when`` falls in.
+    """
+    when = timezone.localtime(when, timezone.utc) if timezone.is_aware(when) else when
+    when = when.replace(second=0, microsecond=0)
+    if granularity in (HOUR, DAY):
+        when = when.replace(minute=0)
+    if granularity == DAY:
+        when = when.replace(hour=0)
+    return when
+
+
+def _round_up(when, granularity):
+    start = truncate(when, granularity)
+    if start == when:
+        return start
+    return start + {MINUTE: timedelta(minutes=1), HOUR: timedelta(hours=1), DAY: timedelta(days=1)}[granularity]
+
+
+def rollup_events(chunk_size=CHUNK_SIZE):
+    """
+    Fold logged vote events into the rollup buckets, ``chunk_size`` events
+    per transaction, and return how many events were rolled up.
+    """
+    last_id = VoteEvent.objects.aggregate(last_id=Max('id'))['last_id']
+    if last_id is None:
+        return 0
+    rolled_up = 0
+    while True:
+        with transaction.atomic():
+            events = list(VoteEvent.objects.filter(id__lte=last_id).order_by('id').values_list(
+                'id', 'poll', 'choice', 'votes', 'created')[:chunk_size])
+            if not events:
+                return rolled_up
+
+            buckets = {}
+            for _, poll_id, choice_id, votes, created in events:
+                for granularity in (MINUTE, HOUR, DAY):
+                    key = (poll_id, choice_id, granularity, truncate(created, granularity))
+                    buckets[key] = buckets.get(key, 0) + votes
+            for (poll_id, choice_id, granularity, bucket), votes in buckets.items():
+                _add_to_bucket(poll_id, choice_id, granularity, bucket, votes)
+
+            VoteEvent.objects.filter(id__lte=events[-1][0]).delete()
+            rolled_up += len(events)
+
+
+def _add_to_bucket(poll_id, choice_id, granularity, bucket, votes):
+    rollups = VoteRollup.objects.filter(choice=choice_id, granularity=granularity, bucket=bucket)
+    if not rollups.update(votes=F('votes') + votes):
+        VoteRollup.objects.create(
+            poll_id=poll_id, choice_id=choice_id, granularity=granularity, bucket=bucket, votes=votes)
+
+
+def _cover(start, end):
+    """
+    Split [start, end) into (granularity, start, end) pieces using the
+    coarsest buckets that fit: days in the middle, hours and then minutes
+    towards the edges.
+    """
+    pieces = []
+    first_hour, last_hour = _round_up(start, HOUR), truncate(end, HOUR)
+    if first_hour >= last_hour:
+        return [(MINUTE, start, end)]
+    pieces += [(MINUTE, start, first_hour), (MINUTE, last_hour, end)]
+    first_day, last_day = _round_up(first_hour, DAY), truncate(last_hour, DAY)
+    if first_day >= last_day:
+        pieces.append((HOUR, first_hour, last_hour))
+    else:
+        pieces += [(HOUR, first_hour, first_day), (HOUR, last_day, last_hour), (DAY, first_day, last_day)]
+    return [piece for piece in pieces if piece[1] < piece[2]]
+
+
+def vote_totals(start, end, poll=None, choice=None):
+    """
+    Votes cast from ``start`` up to ``end`` (to the minute), for one poll
+    or choice or across all of them, in a single query that reads at most
+    a couple of hundred buckets per choice.
+    """
+    start, end = truncate(start, MINUTE), truncate(end, MINUTE)
+    if start >= end:
+        return 0
+    ranges = Q()
+    for granularity, piece_start, piece_end in _cover(start, end):
+        ranges |= Q(granularity=granularity, bucket__gte=piece_start, bucket__lt=piece_end)
+    rollups = _filter(VoteRollup.objects.filter(ranges), poll, choice)
+    return rollups.aggregate(votes=Sum('votes'))['votes'] or 0
+
+
+def vote_series(start, end, granularity, poll=None, choice=None):
+    """
+    Return [(bucket, votes)] for each ``granularity`` bucket from
+    ``start`` up to ``end`` that had any votes.
+    """
+    rollups = _filter(VoteRollup.objects.filter(
+        granularity=granularity,
+        bucket__gte=truncate(start, granularity),
+        bucket__lt=_round_up(end, granularity),
+    ), poll, choice)
+    return list(rollups.values('bucket').annotate(votes=Sum('votes')).order_by('bucket').values_list(
+        'bucket', 'votes'))
+
+
+def _filter(rollups, poll, choice):
+    if poll is not None:
+        rollups = rollups.filter(poll=poll)
+    if choice is not None:
+        rollups = rollups.filter(choice=choice)
+    return rollups
@@ -0,0 +1,182 @@
+"""
+Full-text search over polls.
+
+On SQLite, each poll's question and choices are indexed in an FTS5 table,
+polls_poll_fts, whose rowid is the poll's id. It's built by syncdb, kept
+up to date as polls and choices are saved and deleted, and can be rebuilt
+from scratch with ``manage.py rebuild_search_index``. bulk_create()
+doesn't send signals, so polls made with it are indexed by index_polls().
+
+Every word of a search must match, as a prefix. Polls matching in the
+question come before those matching only in their choices, and each
+group is ranked by bm25(), with matches in the question counting for
+more than matches in the choices. Databases without FTS5 fall back to a
+question__icontains scan.
+"""
+import re
+
+from django.db import connection
+from django.db.models.signals import post_delete, post_save, post_syncdb
+from django.dispatch import receiver
+
+from polls.models import Poll, Choice
+
+TABLE = 'polls_poll_fts'
+
+# How much more a match in the question is worth than one in the choices.
+QUESTION_WEIGHT = 2.0
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+_fts5 = None
+
+
+def available():
+    """
+    Whether the database has FTS5, which SQLite can be built without.
+    """
+    global _fts5
+    if connection.vendor != 'sqlite':
+        return False
+    if _fts5 is None:
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA compile_options")
+        _fts5 = any('FTS5' in option for option, in cursor.fetchall())
+    return _fts5
+
+
+def create_index():
+    cursor = connection.cursor()
+    cursor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(question, choices, tokenize = 'unicode61')" % TABLE)
+
+
+def _index_sql(where):
+    qn = connection.ops.quote_name
+    return (
+        "INSERT INTO %(fts)s (rowid, question, choices) "
+        "SELECT p.%(id)s, p.%(question)s, "
+        "(SELECT group_concat(c.%(choice)s, ' ') FROM %(choice_table)s c WHERE c.%(poll_id)s = p.%(id)s) "
+        "FROM %(poll_table)s p WHERE %(where)s" % {
+            'fts': TABLE, 'id': qn('id'), 'question': qn('question'), 'choice': qn('choice'),
+            'poll_id': qn('poll_id'), 'poll_table': qn(Poll._meta.db_table),
+            'choice_table': qn(Choice._meta.db_table), 'where': where,
+        }
+    )
+
+
+def index_poll(poll_id):
+    """
+    (Re)index a poll's question and choices.
+    """
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s WHERE rowid = %%s" % TABLE, [poll_id])
+    cursor.execute(_index_sql("p.%s = %%s" % connection.ops.quote_name('id')), [poll_id])
+
+
+def index_polls(first_id, last_id):
+    """
+    Index the polls with ids from ``first_id`` to ``last_id``, which
+    mustn't be indexed already; for polls made with bulk_create().
+    """
+    qn = connection.ops.quote_name
+    connection.cursor().execute(_index_sql("p.%s BETWEEN %%s AND %%s" % qn('id')), [first_id, last_id])
+
+
+def unindex_poll(poll_id):
+    connection.cursor().execute("DELETE FROM %s WHERE rowid = %%s" % TABLE, [poll_id])
+
+
+def rebuild_index(chunk_size=50000):
+    """
+    Index every poll from scratch, ``chunk_size`` polls per statement,
+    returning how many there were.
+    """
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE IF EXISTS %s" % TABLE)
+    create_index()
+    indexed = 0
+    last_id = 0
+    while True:
+        ids = list(Poll.objects.using(connection.alias).filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            break
+        index_polls(ids[0], ids[-1])
+        indexed += len(ids)
+        last_id = ids[-1]
+    cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (TABLE, TABLE))
+    return indexed
+
+
+def match_query(terms):
+    """
+    An FTS5 query matching every word of ``terms`` as a prefix, or None if
+    there are no words in it. Anything that isn't a word is dropped, so
+    user input can't inject FTS5 syntax.
+    """
+    words = WORD.findall(terms)
+    if not words:
+        return None
+    return u' '.join(u'"%s"*' % word for word in words)
+
+
+def search_ids(terms, limit=20):
+    """
+    The ids of up to ``limit`` polls matching ``terms``: question matches
+    first, then choice matches, best match first within each.
+    """
+    query = match_query(terms)
+    if query is None:
+        return []
+    if not available():
+        return list(Poll.objects.filter(question__icontains=terms.strip()).values_list('id', flat=True)[:limit])
+    ids = _match_ids(u'question : (%s)' % query, [], limit)
+    if len(ids) < limit:
+        ids += _match_ids(query, ids, limit - len(ids))
+    return ids
+
+
+def search(terms, limit=20):
+    """
+    Up to ``limit`` polls matching ``terms``, in search_ids() order.
+    """
+    ids = search_ids(terms, limit)
+    found = Poll.objects.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def _match_ids(query, exclude, limit):
+    sql = "SELECT rowid FROM %s WHERE %s MATCH %%s" % (TABLE, TABLE)
+    if exclude:
+        sql += " AND rowid NOT IN (%s)" % ', '.join(['%s'] * len(exclude))
+    cursor = connection.cursor()
+    cursor.execute(sql + " ORDER BY bm25(%s, %s, 1.0) LIMIT %%s" % (TABLE, QUESTION_WEIGHT),
+                   [query] + exclude + [limit])
+    return [row[0] for row in cursor.fetchall()]
+
+
+@receiver(post_syncdb)
+def create_search_index(sender, **kwargs):
+    # Sent by flush as well as syncdb, so start again from whatever polls
+    # there are rather than trusting an existing index.
+    if sender.__name__ == Poll.__module__ and available():
+        rebuild_index()
+
+
+@receiver(post_save, sender=Poll)
+def poll_saved(sender, instance, raw=False, **kwargs):
+    if available() and not raw:
+        index_poll(instance.id)
+
+
+@receiver(post_delete, sender=Poll)
+def poll_deleted(sender, instance, **kwargs):
+    if available():
+        unindex_poll(instance.id)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, raw=False, **kwargs):
+    if available() and not raw:
+        index_poll(instance.poll_id)
@@ -0,0 +1,223 @@
+"""
+Vote counters in shared memory.
+
+With POLLS_SHARED_VOTES_FILE set, votes aren't written to the database
+by the worker that takes them. Every worker process on the host maps the
+same file and adds one to the choice's slot in it, and a single flusher
+(``manage.py flush_shared_votes``) moves what has built up into
+Choice.votes and Poll.vote_count in one transaction at a time.
+
+The file holds, after a header, a slot per choice id of two counters:
+the votes counted there ever, and how many of those are in the database.
+The difference is added on top of the database's counts when a poll is
+read, so votes show up as soon as they're counted. There's also a count
+per poll id, which is only there to move the poll's ETag on, and a dirty
+byte for every 64 choices so the flusher only reads slots that have
+changed.
+
+Python can't do an atomic add on shared memory, so each add holds an
+fcntl lock on just the bytes of its slot. The kernel drops the locks of
+a process that dies, so a crashed worker can't wedge the others, and
+workers adding to different choices don't wait for each other.
+
+Crash recovery: the flusher records each choice's flushed count in a
+SharedVoteCheckpoint in the same transaction as the votes themselves,
+so a vote is flushed exactly once however the flusher dies, and a new
+flusher starts from the checkpoints (see recover()). Votes counted in
+the file but not yet flushed survive any process dying, but not the
+file: if it's lost (e.g. it's on a tmpfs and the host restarts), so are
+they. A new file has a new id, so the checkpoints of the old one are
+ignored rather than taken for its own.
+
+Choice and poll ids past POLLS_SHARED_VOTES_SLOTS don't fit in the file,
+and their votes go straight to the database.
+"""
+import fcntl
+import mmap
+import os
+import re
+import struct
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+MAGIC = b'POLLVOTE'
+HEADER = mmap.PAGESIZE
+# Magic, file id and number of slots.
+HEADER_FORMAT = '<8sqq'
+# Bytes locked while a file is set up, and the byte the flusher holds.
+SETUP_LOCK = (0, struct.calcsize(HEADER_FORMAT))
+FLUSHER_LOCK = (HEADER - 1, 1)
+
+CHOICE_SLOT = struct.Struct('<qq')
+POLL_SLOT = struct.Struct('<q')
+SLOTS_PER_DIRTY_BYTE = 64
+
+_DIRTY = re.compile(b'[^\x00]')
+
+
+class FlusherRunning(Exception):
+    pass
+
+
+class SharedCounters(object):
+    """
+    The vote counters in the file at ``path``, created with room for
+    choice and poll ids below ``slots`` if it doesn't exist.
+    """
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self._polls_offset = HEADER + slots * CHOICE_SLOT.size
+        self._dirty_offset = self._polls_offset + slots * POLL_SLOT.size
+        size = self._dirty_offset + (slots + SLOTS_PER_DIRTY_BYTE - 1) // SLOTS_PER_DIRTY_BYTE
+        # fcntl locks are per process, so threads take turns here first.
+        self._thread_lock = threading.Lock()
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock(*SETUP_LOCK)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                self._map = mmap.mmap(self._fd, size)
+                self.file_id = struct.unpack('<q', os.urandom(8))[0]
+                struct.pack_into(HEADER_FORMAT, self._map, 0, MAGIC, self.file_id, slots)
+            else:
+                self._map = mmap.mmap(self._fd, 0)
+                magic, self.file_id, file_slots = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+                if magic != MAGIC or file_slots != slots:
+                    raise ImproperlyConfigured(
+                        "%s isn't a vote counters file with %d slots; remove it to start a new one." % (path, slots))
+        finally:
+            self._unlock(*SETUP_LOCK)
+
+    def _lock(self, offset, length, blocking=True):
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        fcntl.lockf(self._fd, flags, length, offset)
+
+    def _unlock(self, offset, length):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def fits(self, poll_id, choice_id):
+        return 0 < poll_id < self.slots and 0 < choice_id < self.slots
+
+    def add(self, poll_id, choice_id):
+        """
+        Count a vote. The ids must fit().
+        """
+        choice_offset = HEADER + choice_id * CHOICE_SLOT.size
+        poll_offset = self._polls_offset + poll_id * POLL_SLOT.size
+        with self._thread_lock:
+            for offset in (choice_offset, poll_offset):
+                self._lock(offset, 8)
+                try:
+                    struct.pack_into('<q', self._map, offset, struct.unpack_from('<q', self._map, offset)[0] + 1)
+                finally:
+                    self._unlock(offset, 8)
+        self._map[self._dirty_offset + choice_id // SLOTS_PER_DIRTY_BYTE] = b'\x01'
+
+    def pending(self, choice_id):
+        """
+        Votes for a choice that are counted here but not yet flushed.
+        """
+        if not 0 < choice_id < self.slots:
+            return 0
+        counted, flushed = CHOICE_SLOT.unpack_from(self._map, HEADER + choice_id * CHOICE_SLOT.size)
+        return counted - flushed
+
+    def poll_counted(self, poll_id):
+        """
+        Votes for a poll ever counted here. It only goes up, so it serves
+        as a version number.
+        """
+        if not 0 < poll_id < self.slots:
+            return 0
+        return POLL_SLOT.unpack_from(self._map, self._polls_offset + poll_id * POLL_SLOT.size)[0]
+
+    # The rest is for the flusher.
+
+    def become_flusher(self):
+        """
+        Make this process the file's one flusher, raising FlusherRunning if
+        another process already is. It stays the flusher until it exits.
+        """
+        try:
+            self._lock(*FLUSHER_LOCK, blocking=False)
+        except IOError:
+            raise FlusherRunning("Another process is already flushing %s." % self.path)
+
+    def recover(self, checkpoints):
+        """
+        Set the flushed counts from ``checkpoints``, a mapping of choice id
+        to votes flushed, and mark every slot dirty, so that anything a
+        previous flusher counted but didn't get to the database is
+        flushed again.
+        """
+        for choice_id, flushed in checkpoints.items():
+            if 0 < choice_id < self.slots:
+                struct.pack_into('<q', self._map, HEADER + choice_id * CHOICE_SLOT.size + 8, flushed)
+        self._map[self._dirty_offset:] = b'\x01' * (len(self._map) - self._dirty_offset)
+
+    def collect(self):
+        """
+        Return {choice_id: (counted, flushed)} for the choices with votes
+        waiting to be flushed.
+        """
+        waiting = {}
+        dirty = self._map[self._dirty_offset:]
+        for match in _DIRTY.finditer(dirty):
+            index = match.start()
+            # Cleared before reading, so a vote counted after the read
+            # marks it dirty again for next time.
+            self._map[self._dirty_offset + index] = b'\x00'
+            first = index * SLOTS_PER_DIRTY_BYTE
+            last = min(self.slots, first + SLOTS_PER_DIRTY_BYTE)
+            values = struct.unpack_from('<%dq' % (2 * (last - first)), self._map, HEADER + first * CHOICE_SLOT.size)
+            for i in range(0, len(values), 2):
+                if values[i] != values[i + 1]:
+                    waiting[first + i // 2] = (values[i], values[i + 1])
+        return waiting
+
+    def mark_flushed(self, counts):
+        """
+        Record that ``counts``, a mapping of choice id to counted votes,
+        are now in the database.
+        """
+        for choice_id, counted in counts.items():
+            struct.pack_into('<q', self._map, HEADER + choice_id * CHOICE_SLOT.size + 8, counted)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+_counters = None
+_counters_lock = threading.Lock()
+
+
+def get_shared_counters():
+    """
+    Return this process's SharedCounters, or None if votes aren't counted
+    in shared memory (POLLS_SHARED_VOTES_FILE is None).
+    """
+    global _counters
+    path = getattr(settings, 'POLLS_SHARED_VOTES_FILE', None)
+    if not path:
+        return None
+    with _counters_lock:
+        if _counters is None or _counters.path != path:
+            _counters = SharedCounters(path, settings.POLLS_SHARED_VOTES_SLOTS)
+    return _counters
+
+
+def forget():
+    """
+    Unmap this process's SharedCounters; the next vote maps them again.
+    """
+    global _counters
+    with _counters_lock:
+        if _counters is not None:
+            _counters.close()
+        _counters = None
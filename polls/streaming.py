@@ -0,0 +1,131 @@
+"""
+Live poll results for Server-Sent Events clients.
+
+A ResultsFeed knows which polls have subscribers and what each of them
+was last told. Calling changes() checks every subscribed poll's version
+in one query and works out the vote counts that have moved since, so
+however many clients are watching and however fast votes arrive, the
+database is asked at most once per tick.
+
+Votes waiting in VoteShards or shared memory don't bump Poll.version,
+so with those on, a poll's version also takes in its pending shard sum
+and its count in shared memory, and the counts sent include them, the
+same as get_with_choices() does.
+"""
+import json
+
+from django.conf import settings
+
+from polls.models import Poll, Choice, VoteShard
+from polls.sharedcounts import get_shared_counters
+
+
+def format_event(name, data):
+    return 'event: %s\ndata: %s\n\n' % (name, json.dumps(data))
+
+
+class ResultsFeed(object):
+
+    def __init__(self):
+        self.subscribers = {}
+        self._versions = {}
+        self._votes = {}
+
+    def subscribe(self, poll_id, subscriber):
+        """
+        Register ``subscriber`` for changes to a poll and return a
+        'results' event with the poll's full current results to send it
+        first. Raises Poll.DoesNotExist for unknown polls.
+        """
+        # Read the version first: a vote in between shows up as a change
+        # next tick rather than going unnoticed.
+        version = self._read_versions([poll_id]).get(poll_id)
+        poll = Poll.objects.get_with_choices(poll_id)
+        if poll_id not in self.subscribers:
+            self.subscribers[poll_id] = set()
+            self._versions[poll_id] = version
+            self._votes[poll_id] = dict((c.id, c.votes) for c in poll.choice_set.all())
+        self.subscribers[poll_id].add(subscriber)
+        return format_event('results', {
+            'id': poll.id,
+            'total_votes': poll.total_votes(),
+            'choices': [
+                {'id': c.id, 'choice': c.choice, 'votes': c.votes}
+                for c in poll.choice_set.all()
+            ],
+        })
+
+    def unsubscribe(self, poll_id, subscriber):
+        subscribers = self.subscribers.get(poll_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self.subscribers[poll_id]
+            del self._versions[poll_id]
+            del self._votes[poll_id]
+
+    def changes(self):
+        """
+        Return a list of (poll_id, event) pairs, one for each subscribed
+        poll whose votes have changed since the last call. Each 'votes'
+        event carries the poll's new total and only the choices whose counts
+        moved.
+        """
+        if not self.subscribers:
+            return []
+        versions = self._read_versions(list(self.subscribers))
+        changed = [
+            poll_id for poll_id in self.subscribers
+            if versions.get(poll_id, self._versions[poll_id]) != self._versions[poll_id]
+        ]
+        if not changed:
+            return []
+
+        latest = self._read_votes(changed)
+
+        events = []
+        for poll_id in changed:
+            self._versions[poll_id] = versions[poll_id]
+            previous, self._votes[poll_id] = self._votes[poll_id], latest[poll_id]
+            moved = dict(
+                (str(choice_id), votes) for choice_id, votes in latest[poll_id].items()
+                if previous.get(choice_id) != votes
+            )
+            if moved:
+                events.append((poll_id, format_event('votes', {
+                    'id': poll_id,
+                    'total_votes': sum(latest[poll_id].values()),
+                    'choices': moved,
+                })))
+        return events
+
+    def _read_sharded(self, poll_ids):
+        if not getattr(settings, 'POLLS_VOTE_SHARDS', None):
+            return None
+        return VoteShard.pending_votes(poll_ids)
+
+    def _read_versions(self, poll_ids):
+        sharded = self._read_sharded(poll_ids)
+        counters = get_shared_counters()
+        versions = {}
+        for poll_id, version in Poll.objects.filter(pk__in=poll_ids).values_list('id', 'version'):
+            version = (version,)
+            if sharded is not None:
+                version += (sum(sharded[poll_id].values()),)
+            if counters is not None:
+                version += (counters.poll_counted(poll_id),)
+            versions[poll_id] = version
+        return versions
+
+    def _read_votes(self, poll_ids):
+        sharded = self._read_sharded(poll_ids)
+        counters = get_shared_counters()
+        latest = dict((poll_id, {}) for poll_id in poll_ids)
+        for poll_id, choice_id, votes in Choice.objects.filter(poll__in=poll_ids).values_list('poll', 'id', 'votes'):
+            if sharded is not None:
+                votes += sharded[poll_id].get(choice_id, 0)
+            if counters is not None:
+                votes += counters.pending(choice_id)
+            latest[poll_id][choice_id] = votes
+        return latest
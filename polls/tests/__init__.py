@@ -1,3 +1,22 @@
 from polls.tests.tests import *
 from polls.tests.test_models import *
 from polls.tests.test_views import *
+from polls.tests.test_votes import *
+from polls.tests.test_streaming import *
+from polls.tests.test_ingest import *
+from polls.tests.test_export import *
+from polls.tests.test_rollups import *
+from polls.tests.test_instrumentation import *
+from polls.tests.test_perf import *
+from polls.tests.test_replay import *
+from polls.tests.test_dedup import *
+from polls.tests.test_template_warmup import *
+from polls.tests.test_fastvote import *
+from polls.tests.test_admin import *
+from polls.tests.test_search import *
+from polls.tests.test_replicas import *
+from polls.tests.test_trending import *
+from polls.tests.test_sharedcounts import *
+from polls.tests.test_loading import *
+from polls.tests.test_sqlite_pragmas import *
+from polls.tests.test_commit_hooks import *
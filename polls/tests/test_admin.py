@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from polls import admin
+from polls.models import Poll, Choice
+
+class PollAdminTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        for question in ["How are you?", "how old are you?", "What time is it?"]:
+            poll = Poll.objects.create(question=question, pub_date=timezone.now())
+            Choice.objects.create(poll=poll, choice="Fine", votes=len(question))
+        self.old_threshold = admin.ESTIMATE_COUNTS_OVER
+
+    def tearDown(self):
+        admin.ESTIMATE_COUNTS_OVER = self.old_threshold
+
+    def changelist(self, **params):
+        return self.client.get('/admin/polls/poll/', params)
+
+    def test_lists_total_votes(self):
+        response = self.changelist()
+        self.assertContains(response, '<td>16</td>', html=True)
+        self.assertContains(response, '3 polls')
+
+    def search(self, term):
+        return sorted(p.question for p in self.changelist(q=term).context['cl'].result_list)
+
+    def test_search_matches_words_in_the_question_in_any_case(self):
+        self.assertEqual(self.search('how'), ["How are you?", "how old are you?"])
+        self.assertEqual(self.search('HOW'), ["How are you?", "how old are you?"])
+        self.assertEqual(self.search('What t'), ["What time is it?"])
+        self.assertEqual(self.search('old'), ["how old are you?"])
+        self.assertEqual(self.search('you'), ["How are you?", "how old are you?"])
+        # Only questions are searched, not choices.
+        self.assertEqual(self.search('fine'), [])
+
+    def test_search_says_how_it_matches(self):
+        self.assertContains(self.changelist(), "as a whole word or the start of one")
+
+    def test_filters_by_publication_date(self):
+        Poll.objects.filter(question="How are you?").update(pub_date=timezone.now() - timedelta(days=400))
+        response = self.changelist(**{
+            'pub_date__gte': (timezone.now() - timedelta(days=7)).isoformat(),
+        })
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_big_tables_get_an_estimated_count(self):
+        admin.ESTIMATE_COUNTS_OVER = 1
+        Poll.objects.filter(question="How are you?").delete()
+        self.assertEqual(Poll.objects.count(), 2)
+
+        queryset = admin.PollAdmin(Poll, admin.admin.site).get_queryset(None)
+        self.assertEqual(queryset.count(), Poll.objects.latest('id').id)
+        self.assertEqual(queryset.filter(question__startswith="What").count(), 1)
+
+    def test_choice_votes_are_read_only(self):
+        poll = Poll.objects.get(question="What time is it?")
+        Choice.objects.create(poll=poll, choice="Late", votes=3)
+        response = self.client.get('/admin/polls/poll/%d/' % poll.id)
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertNotIn('votes', formset.forms[0].fields)
+
+    def test_change_form_loads_a_bounded_number_of_choices(self):
+        admin.MAX_INLINE_CHOICES, old_max = 2, admin.MAX_INLINE_CHOICES
+        try:
+            poll = Poll.objects.get(question="What time is it?")
+            Choice.objects.create(poll=poll, choice="Late")
+            Choice.objects.create(poll=poll, choice="Early")
+            response = self.client.get('/admin/polls/poll/%d/' % poll.id)
+        finally:
+            admin.MAX_INLINE_CHOICES = old_max
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(formset.initial_form_count(), 2)
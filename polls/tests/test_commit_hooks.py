@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from mysite.commit_hooks import after_commit
+from polls.caching import invalidate_poll, poll_key
+
+class AfterCommitTest(TransactionTestCase):
+    # A TestCase never commits.
+
+    def setUp(self):
+        self.called = []
+
+    def call_back(self):
+        self.called.append(True)
+
+    def test_runs_once_the_transaction_commits(self):
+        with transaction.atomic():
+            with transaction.atomic():
+                after_commit(self.call_back)
+            self.assertEqual(self.called, [])
+        self.assertEqual(self.called, [True])
+
+    def test_dropped_if_the_transaction_rolls_back(self):
+        try:
+            with transaction.atomic():
+                after_commit(self.call_back)
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            pass
+        self.assertEqual(self.called, [])
+
+    def test_runs_straight_away_outside_a_transaction(self):
+        after_commit(self.call_back)
+        self.assertEqual(self.called, [True])
+
+    def test_what_readers_cache_before_the_commit_is_cleared(self):
+        with transaction.atomic():
+            invalidate_poll(1)
+            cache.set(poll_key(1), 'from before the commit')
+        self.assertIsNone(cache.get(poll_key(1)))
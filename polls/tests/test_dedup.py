@@ -0,0 +1,182 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.importlib import import_module
+from django.utils import timezone
+
+from polls import dedup, sharedcounts, votes
+from polls.models import Poll, Choice, Voter
+from polls.votes import VoteBuffer, VoterLog
+
+class VoteDedupTest(TestCase):
+
+    def setUp(self):
+        self.filter_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(POLLS_VOTER_FILTER_DIR=self.filter_dir)
+        self.settings_override.enable()
+        dedup.forget_all()
+        self.poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        self.choice = Choice.objects.create(poll=self.poll, choice="42")
+        self.url = '/poll/%d/' % self.poll.id
+
+    def tearDown(self):
+        dedup.forget_all()
+        self.settings_override.disable()
+        shutil.rmtree(self.filter_dir)
+
+    def vote(self, agent='browser', choice_id=None):
+        return self.client.post(self.url, {'vote': choice_id or self.choice.id}, HTTP_USER_AGENT=agent)
+
+    def votes(self):
+        return Choice.objects.get(pk=self.choice.id).votes
+
+    def test_rejects_a_second_vote_from_the_same_client(self):
+        self.assertEqual(self.vote().status_code, 302)
+        self.assertEqual(self.vote().status_code, 403)
+        self.assertEqual(self.votes(), 1)
+
+    def test_other_clients_can_still_vote(self):
+        self.vote('browser')
+        self.assertEqual(self.vote('phone').status_code, 302)
+        self.assertEqual(self.votes(), 2)
+
+    def test_voting_on_another_poll_is_allowed(self):
+        other = Poll.objects.create(question="Other", pub_date=timezone.now())
+        choice = Choice.objects.create(poll=other, choice="Yes")
+        self.vote()
+        response = self.client.post('/poll/%d/' % other.id, {'vote': choice.id}, HTTP_USER_AGENT='browser')
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(POLLS_VOTER_FILTER_EXPECTED_VOTERS=1, POLLS_VOTER_FILTER_FALSE_POSITIVES=0.5)
+    def test_false_positives_fall_back_to_the_database(self):
+        # A couple of bits fill up at once, so the filter claims to have
+        # seen everyone.
+        for i in range(10):
+            self.assertEqual(self.vote('client %d' % i).status_code, 302)
+        self.assertEqual(self.votes(), 10)
+
+    def test_duplicates_are_caught_without_the_filter(self):
+        self.vote()
+        dedup.forget_all()
+        shutil.rmtree(self.filter_dir)
+        self.filter_dir = tempfile.mkdtemp()
+        with self.settings(POLLS_VOTER_FILTER_DIR=self.filter_dir):
+            self.assertEqual(self.vote().status_code, 403)
+        self.assertEqual(self.votes(), 1)
+
+    def test_a_vote_for_a_bad_choice_does_not_count_as_voting(self):
+        self.assertEqual(self.vote(choice_id=self.choice.id + 100).status_code, 404)
+        self.assertFalse(Voter.objects.exists())
+        self.assertEqual(self.vote().status_code, 302)
+
+    def test_a_vote_that_fails_does_not_count_as_voting(self):
+        def fail(poll_id, choice_id, voter=None):
+            raise DatabaseError("database is locked")
+        cast_vote = dedup.cast_vote
+        dedup.cast_vote = fail
+        try:
+            self.assertRaises(DatabaseError, self.vote)
+        finally:
+            dedup.cast_vote = cast_vote
+        self.assertFalse(Voter.objects.exists())
+        self.assertEqual(self.vote().status_code, 302)
+
+    def test_made_up_sessions_dont_get_extra_votes(self):
+        for session_key in ('madeup1', 'madeup2'):
+            self.client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+            self.vote()
+        self.assertEqual(self.votes(), 1)
+
+    def test_voter_key_doesnt_look_up_the_session(self):
+        request = RequestFactory().get(self.url)
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore('madeup')
+        with self.assertNumQueries(0):
+            self.assertEqual(dedup.voter_key(request), 'session:madeup')
+
+    def test_only_a_vote_about_to_count_looks_up_the_session(self):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.vote().status_code, 302)
+        self.assertEqual(len([query for query in queries if 'django_session' in query['sql']]), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.vote().status_code, 403)
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+
+    def test_a_new_voter_is_not_looked_up(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.vote()
+        self.assertFalse([
+            query for query in queries
+            if 'polls_voter' in query['sql'] and 'SELECT' in query['sql']])
+        self.assertTrue(Voter.objects.exists())
+
+    @override_settings(POLLS_VOTE_BUFFER_INTERVAL=60)
+    def test_buffered_votes_write_their_voters_with_them(self):
+        buffer = votes._vote_buffer = VoteBuffer(60)
+        try:
+            self.assertEqual(self.vote().status_code, 302)
+            self.assertEqual(self.vote().status_code, 403)
+            self.assertFalse(Voter.objects.exists())
+            # A second vote that got in elsewhere before the Voter was written.
+            Voter.objects.create(poll=self.poll, voter=dedup._hash(dedup.client_key(
+                RequestFactory().post(self.url, HTTP_USER_AGENT='phone')))[0])
+            self.assertEqual(self.vote('phone').status_code, 302)
+
+            self.assertEqual(buffer.flush(), 1)
+        finally:
+            votes._vote_buffer = None
+        self.assertEqual(Voter.objects.count(), 2)
+        self.assertEqual(self.votes(), 1)
+
+    def test_shared_memory_votes_write_their_voters_in_batches(self):
+        path = '%s/votes' % self.filter_dir
+        votes._shared_choices.clear()
+        voter_log = votes._voter_log = VoterLog(60)
+        with self.settings(POLLS_SHARED_VOTES_FILE=path, POLLS_SHARED_VOTES_SLOTS=4096,
+                           POLLS_VOTER_WRITE_INTERVAL=60):
+            try:
+                self.assertEqual(self.vote().status_code, 302)
+                self.assertEqual(self.vote().status_code, 403)
+                self.assertFalse(Voter.objects.exists())
+                Voter.objects.create(poll=self.poll, voter=dedup._hash(dedup.client_key(
+                    RequestFactory().post(self.url, HTTP_USER_AGENT='phone')))[0])
+                self.assertEqual(self.vote('phone').status_code, 302)
+
+                # Writes what's left, as at exit.
+                voter_log.stop()
+                # The repeat vote is taken back off in the database, and
+                # the flusher has yet to add both.
+                self.assertEqual(Poll.objects.get_with_choices(self.poll.id).vote_count, 1)
+            finally:
+                votes._voter_log = None
+                sharedcounts.forget()
+        self.assertEqual(Voter.objects.count(), 2)
+
+    def test_filter_is_sized_for_the_expected_voters(self):
+        bits, hashes = dedup.filter_size(10 ** 7, 0.01)
+        self.assertEqual(hashes, 7)
+        # About 9.6 bits per voter for 1%.
+        self.assertTrue(9.5 * 10 ** 7 < bits < 9.6 * 10 ** 7)
+
+    def test_filter_is_shared_through_its_file(self):
+        path = '%s/shared.bloom' % self.filter_dir
+        writer, reader = dedup.SeenSet(path, 1024, 4), dedup.SeenSet(path, 1024, 4)
+        voter, h1, h2 = dedup._hash('client:1.2.3.4:browser')
+
+        self.assertFalse(reader.might_contain(h1, h2))
+        writer.add(h1, h2)
+        self.assertTrue(reader.might_contain(h1, h2))
+
+    @override_settings(POLLS_VOTER_FILTER_DIR=None)
+    def test_off_by_default(self):
+        self.vote()
+        self.assertEqual(self.vote().status_code, 302)
+        self.assertEqual(self.votes(), 2)
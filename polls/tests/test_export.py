@@ -0,0 +1,68 @@
+import csv
+import json
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from polls.export import export_results
+from polls.models import Poll, Choice
+
+class ExportResultsTest(TestCase):
+
+    def setUp(self):
+        self.poll1 = Poll(question=u"6 times 7 \u2248 ?", pub_date=timezone.now())
+        self.poll1.save()
+        self.choice1 = Choice(poll=self.poll1, choice="42", votes=1)
+        self.choice1.save()
+        self.choice2 = Choice(poll=self.poll1, choice="The Ultimate Answer", votes=2)
+        self.choice2.save()
+        self.poll2 = Poll(question="Nobody asked", pub_date=timezone.now())
+        self.poll2.save()
+
+    def test_csv_has_a_row_per_choice(self):
+        rows = list(csv.reader(export_results('csv', chunk_size=1)))
+
+        self.assertEquals(rows[0], ['poll_id', 'question', 'pub_date', 'total_votes',
+                                    'choice_id', 'choice', 'votes'])
+        self.assertEquals([row[0] for row in rows[1:]], [str(self.poll1.id)] * 2 + [str(self.poll2.id)])
+        self.assertEquals(rows[1][1].decode('utf-8'), self.poll1.question)
+        self.assertEquals(rows[2][3:], ['3', str(self.choice2.id), "The Ultimate Answer", '2'])
+        self.assertEquals(rows[3][4:], ['', '', ''])
+
+    def test_jsonl_has_a_line_per_poll(self):
+        polls = [json.loads(line) for line in export_results('jsonl', chunk_size=1)]
+
+        self.assertEquals([poll['id'] for poll in polls], [self.poll1.id, self.poll2.id])
+        self.assertEquals(polls[0]['total_votes'], 3)
+        self.assertEquals(polls[0]['choices'], [
+            {'id': self.choice1.id, 'choice': "42", 'votes': 1},
+            {'id': self.choice2.id, 'choice': "The Ultimate Answer", 'votes': 2},
+        ])
+        self.assertEquals(polls[1]['choices'], [])
+
+    def test_reads_one_chunk_of_polls_at_a_time(self):
+        # Two queries per chunk of polls, plus one to find there are no more
+        with self.assertNumQueries(5):
+            list(export_results('jsonl', chunk_size=1))
+
+    def test_command_writes_the_export(self):
+        out = StringIO()
+        call_command('export_results', format='jsonl', stdout=out)
+        self.assertEquals(len(out.getvalue().splitlines()), 2)
+
+    def test_endpoint_streams_the_export_to_staff(self):
+        # Anyone else gets the admin login page
+        response = self.client.get('/results.csv')
+        self.assertFalse(response.streaming)
+        self.assertTemplateUsed(response, 'admin/login.html')
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/results.csv')
+
+        self.assertTrue(response.streaming)
+        self.assertEquals(response['Content-Type'], 'text/csv')
+        self.assertEquals(len(list(csv.reader(response.streaming_content))), 4)
@@ -0,0 +1,108 @@
+import logging
+
+from django.core.signals import got_request_exception
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase
+from django.test.client import Client
+from django.utils import timezone
+
+from polls import dedup, replay
+from polls.models import Poll, Choice
+from polls.tests.test_instrumentation import ListHandler
+
+class LeanVoteTest(TestCase):
+
+    def setUp(self):
+        self.poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        self.choice = Choice.objects.create(poll=self.poll, choice="42")
+        self.url = '/poll/%d/vote/' % self.poll.id
+
+    def votes(self):
+        return Choice.objects.get(pk=self.choice.id).votes
+
+    def test_ajax_votes_get_an_empty_response(self):
+        response = self.client.post(self.url, {'vote': self.choice.id}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.votes(), 1)
+
+    def test_other_votes_are_redirected_to_the_poll(self):
+        response = self.client.post(self.url, {'vote': self.choice.id})
+        self.assertRedirects(response, '/poll/%d/' % self.poll.id)
+        self.assertEqual(self.votes(), 1)
+
+    def test_only_accepts_posts(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    def test_404s_for_a_choice_from_another_poll(self):
+        other = Poll.objects.create(question="time", pub_date=timezone.now())
+        response = self.client.post('/poll/%d/vote/' % other.id, {'vote': self.choice.id})
+        self.assertEqual(response.status_code, 404)
+
+    def test_checks_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        self.assertEqual(client.post(self.url, {'vote': self.choice.id}).status_code, 403)
+        self.assertEqual(self.votes(), 0)
+
+    def test_accepts_the_token_from_the_poll_page_instead(self):
+        client = Client(enforce_csrf_checks=True, HTTP_USER_AGENT='phone')
+        # Tokens are timestamped, so it's the same page's that must match.
+        page = client.get('/poll/%d/' % self.poll.id)
+        token = page.context['vote_token']
+        self.assertIn('data-vote-token="%s"' % token, page.content)
+
+        response = client.post(self.url, {'vote': self.choice.id, 'token': token})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.votes(), 1)
+
+    def test_rejects_bad_tokens_and_other_clients_tokens(self):
+        token = Client(HTTP_USER_AGENT='phone').get('/poll/%d/' % self.poll.id).context['vote_token']
+        client = Client(enforce_csrf_checks=True, HTTP_USER_AGENT='laptop')
+
+        self.assertEqual(client.post(self.url, {'vote': self.choice.id, 'token': token}).status_code, 403)
+        self.assertEqual(client.post(self.url, {'vote': self.choice.id, 'token': 'x'}).status_code, 403)
+        self.assertEqual(self.votes(), 0)
+
+class FastVoteApplicationTest(TransactionTestCase):
+    # The wrapper manages database connections as Django's handler does,
+    # which would close the one a TestCase's transaction is on.
+
+    def test_answers_votes_ahead_of_django_and_passes_the_rest_on(self):
+        poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        choice = Choice.objects.create(poll=poll, choice="42")
+        send = replay.InProcess()
+        requests = replay.read_requests([
+            '{"method": "POST", "path": "/poll/%d/vote/", "data": {"vote": %d}, '
+            '"headers": {"X-Requested-With": "XMLHttpRequest"}}' % (poll.id, choice.id),
+            '{"method": "POST", "path": "/poll/%d/vote/", "data": {"vote": %d}}' % (poll.id, choice.id + 1),
+            '{"path": "/poll/%d/vote/"}' % poll.id,
+            '{"path": "/poll/%d/"}' % poll.id,
+        ])
+
+        self.assertEqual([send(request) for request in requests], [204, 404, 405, 200])
+        self.assertEqual(Choice.objects.get(pk=choice.id).votes, 1)
+
+    def test_errors_get_a_500_and_are_reported(self):
+        poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        choice = Choice.objects.create(poll=poll, choice="42")
+        request, = replay.read_requests([
+            '{"method": "POST", "path": "/poll/%d/vote/", "data": {"vote": %d}}' % (poll.id, choice.id),
+        ])
+
+        def fail(poll_id, choice_id, request):
+            raise DatabaseError("database is locked")
+        reported = []
+        def report(sender, request, **kwargs):
+            reported.append(request.path)
+        handler = ListHandler()
+        logger = logging.getLogger('django.request')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        cast_vote_once, dedup.cast_vote_once = dedup.cast_vote_once, fail
+        got_request_exception.connect(report)
+        try:
+            self.assertEqual(replay.InProcess()(request), 500)
+        finally:
+            dedup.cast_vote_once = cast_vote_once
+            got_request_exception.disconnect(report)
+        self.assertEqual(reported, ['/poll/%d/vote/' % poll.id])
+        self.assertEqual(handler.messages, ['Internal Server Error: /poll/%d/vote/' % poll.id])
@@ -0,0 +1,107 @@
+import json
+from datetime import datetime
+import os
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from polls.ingest import import_votes, read_votes
+from polls.models import Poll, Choice, VoteEvent
+
+class ReadVotesTest(TestCase):
+
+    def test_reads_jsonl(self):
+        lines = StringIO('{"poll": 1, "choice": 2}\n\n{"poll": "3", "choice": 4}\nnot json\n{"poll": 1}\n')
+        self.assertEquals(list(read_votes(lines, 'jsonl')), [(1, 2, None), (3, 4, None), None, None])
+
+    def test_reads_csv(self):
+        lines = StringIO('poll,choice\n1,2\n3,four\n')
+        self.assertEquals(list(read_votes(lines, 'csv')), [(1, 2, None), None])
+
+    def test_reads_when_votes_were_cast(self):
+        lines = StringIO('poll,choice,time\n1,2,2013-05-01T23:58:30Z\n1,2,\n1,2,yesterday\n')
+        self.assertEquals(list(read_votes(lines, 'csv')), [
+            (1, 2, datetime(2013, 5, 1, 23, 58, 30, tzinfo=timezone.utc)), (1, 2, None), None])
+
+    def test_rejects_unknown_formats(self):
+        self.assertRaises(ValueError, list, read_votes(StringIO(''), 'xml'))
+
+class ImportVotesTest(TestCase):
+
+    def setUp(self):
+        self.poll1 = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll1.save()
+        self.choice1 = Choice(poll=self.poll1, choice="42")
+        self.choice1.save()
+        self.poll2 = Poll(question="time", pub_date=timezone.now())
+        self.poll2.save()
+        self.choice2 = Choice(poll=self.poll2, choice="PM")
+        self.choice2.save()
+
+    def votes(self):
+        return [
+            (self.poll1.id, self.choice1.id, None),
+            (self.poll2.id, self.choice2.id, None),
+            (self.poll1.id, self.choice1.id, None),
+            # Choice from the other poll, unknown choice, unreadable row
+            (self.poll1.id, self.choice2.id, None),
+            (self.poll1.id, self.choice2.id + 1, None),
+            None,
+        ]
+
+    def test_applies_valid_votes_in_chunks(self):
+        accepted, rejected, seconds = import_votes(self.votes(), chunk_size=2)
+
+        self.assertEquals((accepted, rejected), (3, 3))
+        self.assertEquals(Choice.objects.get(pk=self.choice1.id).votes, 2)
+        self.assertEquals(Choice.objects.get(pk=self.choice2.id).votes, 1)
+        self.assertEquals(Poll.objects.get(pk=self.poll1.id).total_votes(), 2)
+        self.assertEquals(Poll.objects.get(pk=self.poll2.id).total_votes(), 1)
+
+    def test_votes_are_logged_as_cast(self):
+        cast = datetime(2013, 5, 1, 23, 58, 30, tzinfo=timezone.utc)
+        import_votes([(self.poll1.id, self.choice1.id, cast), (self.poll1.id, self.choice1.id, cast)])
+
+        self.assertEquals(list(VoteEvent.objects.values_list('votes', 'created')),
+                          [(2, cast.replace(second=0))])
+
+    def test_command_imports_a_file_and_reports_its_rate(self):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as votes_file:
+            for vote in self.votes():
+                poll_id, choice_id, _ = vote or (None, None, None)
+                votes_file.write(json.dumps({'poll': poll_id, 'choice': choice_id}) + '\n')
+        self.addCleanup(os.remove, path)
+
+        out = StringIO()
+        call_command('import_votes', path, stdout=out)
+
+        self.assertIn("Imported 3 votes, rejected 3", out.getvalue())
+        self.assertIn("rows/sec", out.getvalue())
+        self.assertEquals(Choice.objects.get(pk=self.choice1.id).votes, 2)
+
+    @override_settings(POLLS_IMPORT_TOKEN='sekrit')
+    def test_endpoint_imports_a_posted_batch(self):
+        body = "poll,choice\n%d,%d\n%d,%d\n" % (
+            self.poll1.id, self.choice1.id, self.poll1.id, self.choice2.id)
+
+        response = self.client.post('/votes/import/', body, content_type='text/csv',
+                                    HTTP_AUTHORIZATION='Token sekrit')
+
+        result = json.loads(response.content)
+        self.assertEquals((result['accepted'], result['rejected']), (1, 1))
+        self.assertEquals(Choice.objects.get(pk=self.choice1.id).votes, 1)
+
+    @override_settings(POLLS_IMPORT_TOKEN='sekrit')
+    def test_endpoint_needs_the_token(self):
+        response = self.client.post('/votes/import/', '', content_type='text/csv',
+                                    HTTP_AUTHORIZATION='Token guess')
+        self.assertEquals(response.status_code, 403)
+
+    def test_endpoint_is_off_without_a_token(self):
+        response = self.client.post('/votes/import/', '', content_type='text/csv')
+        self.assertEquals(response.status_code, 404)
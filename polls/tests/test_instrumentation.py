@@ -0,0 +1,76 @@
+import json
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mysite import instrumentation
+from polls import trending
+from polls.models import Poll, Choice
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+@override_settings(
+    MIDDLEWARE_CLASSES=('mysite.instrumentation.InstrumentationMiddleware',) + settings.MIDDLEWARE_CLASSES,
+    REQUEST_BUDGETS={'*': {'total_ms': 60000}},
+)
+class InstrumentationMiddlewareTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.stats.reset()
+        trending.forget_all()
+        self.poll = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll.save()
+        Choice(poll=self.poll, choice="42", votes=1).save()
+
+    def test_records_queries_and_timings_per_view(self):
+        self.client.get('/')
+        self.client.get('/poll/%d/' % self.poll.id)
+        self.client.get('/poll/%d/' % self.poll.id)
+
+        stats = instrumentation.stats.as_dict()
+        home = stats['polls.views.home']
+        self.assertEquals(home['requests'], 1)
+        self.assertEquals(home['queries']['max'], 1)
+        self.assertTrue(home['template_ms']['max'] > 0)
+        self.assertTrue(home['total_ms']['max'] >= home['template_ms']['max'])
+
+        poll = stats['polls.views.poll']
+        self.assertEquals(poll['requests'], 2)
+        # The second visit came from the cache
+        self.assertEquals(poll['queries']['buckets'], {'<=0': 1, '<=1': 1})
+
+    def test_logs_requests_over_budget(self):
+        handler = ListHandler()
+        instrumentation.logger.addHandler(handler)
+        self.addCleanup(instrumentation.logger.removeHandler, handler)
+
+        with self.settings(REQUEST_BUDGETS={'polls.views.poll': {'queries': 0}}):
+            self.client.get('/')
+            self.assertEquals(handler.messages, [])
+
+            self.client.get('/poll/%d/' % self.poll.id)
+        self.assertEquals(len(handler.messages), 1)
+        self.assertIn('polls.views.poll', handler.messages[0])
+        self.assertIn('over budget on queries', handler.messages[0])
+
+    def test_stats_are_only_shown_to_staff(self):
+        self.client.get('/')
+        self.assertTemplateUsed(self.client.get('/_stats/'), 'admin/login.html')
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/_stats/')
+        self.assertIn('polls.views.home', json.loads(response.content))
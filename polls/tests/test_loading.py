@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from polls import loading, search
+from polls.loading import create_polls, read_polls
+from polls.models import Poll, Choice
+
+POLLS = [
+    {'question': "6 times 7", 'pub_date': '2014-01-01T12:00:00+00:00',
+     'choices': [{'choice': "42", 'votes': 3}, {'choice': "41"}]},
+    {'question': "Favourite colour", 'choices': ["Red", "Blue", "Green"]},
+    {'question': "No choices yet"},
+    # No question, too long a question, negative votes
+    {'choices': ["Yes"]},
+    {'question': "x" * 201},
+    {'question': "Broken", 'choices': [{'choice': "Yes", 'votes': -1}]},
+]
+
+def jsonl(polls):
+    return ''.join(json.dumps(poll) + '\n' for poll in polls) + 'not json\n'
+
+class ReadPollsTest(TestCase):
+
+    def test_reads_polls_with_nested_choices(self):
+        polls = list(read_polls(StringIO(jsonl(POLLS) + '\n')))
+
+        self.assertEquals(len(polls), 7)
+        self.assertEquals(polls[0]['question'], "6 times 7")
+        self.assertEquals(polls[0]['pub_date'].year, 2014)
+        self.assertEquals(polls[0]['choices'], [("42", 3), ("41", 0)])
+        self.assertEquals(polls[1]['choices'], [("Red", 0), ("Blue", 0), ("Green", 0)])
+        self.assertIsNotNone(polls[1]['pub_date'])
+        self.assertEquals(polls[2]['choices'], [])
+        self.assertEquals(polls[3:], [None, None, None, None])
+
+class CreatePollsTest(TestCase):
+
+    def test_creates_polls_and_choices_in_batches(self):
+        polls, choices, rejected, seconds = create_polls(read_polls(StringIO(jsonl(POLLS))), batch_size=2)
+
+        self.assertEquals((polls, choices, rejected), (3, 5, 4))
+        poll = Poll.objects.get(question="6 times 7")
+        self.assertEquals([(c.choice, c.votes) for c in poll.choice_set.order_by('id')], [("42", 3), ("41", 0)])
+        self.assertEquals(poll.total_votes(), 3)
+        self.assertEquals(Poll.objects.get(question="Favourite colour").choice_set.count(), 3)
+
+    def test_polls_are_saved_one_at_a_time_where_bulk_ids_cant_be_trusted(self):
+        vendors = loading.BULK_INSERT_VENDORS
+        loading.BULK_INSERT_VENDORS = ()
+        try:
+            polls, choices, _, _ = create_polls(read_polls(StringIO(jsonl(POLLS))), batch_size=2)
+        finally:
+            loading.BULK_INSERT_VENDORS = vendors
+
+        self.assertEquals((polls, choices), (3, 5))
+        self.assertEquals(Poll.objects.get(question="6 times 7").total_votes(), 3)
+        self.assertEquals(Poll.objects.get(question="Favourite colour").choice_set.count(), 3)
+
+    def test_created_polls_can_be_searched(self):
+        if not search.available():
+            self.skipTest("No FTS5")
+        create_polls(read_polls(StringIO(jsonl(POLLS))), batch_size=2)
+
+        self.assertEquals([poll.question for poll in search.search("blue")], ["Favourite colour"])
+
+    def test_deferred_indexes_are_put_back(self):
+        def indexes():
+            cursor = connection.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN (%s, %s)",
+                           [Poll._meta.db_table, Choice._meta.db_table])
+            return sorted(name for name, in cursor.fetchall())
+        before = indexes()
+
+        polls, _, _, _ = create_polls(read_polls(StringIO(jsonl(POLLS))), defer_indexes=True)
+
+        self.assertEquals(polls, 3)
+        self.assertEquals(indexes(), before)
+        if search.available():
+            self.assertEquals(len(search.search("colour")), 1)
+
+    def test_command_loads_a_file_and_reports_its_rate(self):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as polls_file:
+            polls_file.write(jsonl(POLLS))
+        self.addCleanup(os.remove, path)
+
+        out = StringIO()
+        call_command('load_polls', path, defer_indexes=True, stdout=out)
+
+        self.assertIn("Loaded 3 polls and 5 choices, rejected 4", out.getvalue())
+        self.assertIn("rows/sec", out.getvalue())
+        self.assertEquals(Poll.objects.count(), 3)
+
+    @override_settings(POLLS_IMPORT_TOKEN='sekrit')
+    def test_endpoint_creates_posted_polls(self):
+        response = self.client.post('/polls/import/', jsonl(POLLS[:2]), content_type='application/jsonl',
+                                    HTTP_AUTHORIZATION='Token sekrit')
+
+        self.assertEquals(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEquals((result['polls'], result['choices'], result['rejected']), (2, 5, 1))
+        self.assertEquals(Choice.objects.count(), 5)
+
+    @override_settings(POLLS_IMPORT_TOKEN='sekrit')
+    def test_endpoint_requires_the_token(self):
+        response = self.client.post('/polls/import/', jsonl(POLLS[:1]), content_type='application/jsonl')
+
+        self.assertEquals(response.status_code, 403)
+        self.assertEquals(Poll.objects.count(), 0)
@@ -1,7 +1,11 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 from django.utils import timezone
 
 from polls.models import Poll, Choice
+from polls.votes import record_vote
 
 class PollModelTest(TestCase):
     def test_creating_a_new_poll_and_saving_it_to_the_database(self):
@@ -50,6 +54,96 @@ class PollModelTest(TestCase):
         c2.save()
         self.assertEquals(p.total_votes(), 1022)
 
+    def test_total_votes_is_stored_on_the_poll(self):
+        p = Poll(question="where", pub_date=timezone.now())
+        p.save()
+        Choice(poll=p, choice="here", votes=5).save()
+        c2 = Choice(poll=p, choice="there", votes=2)
+        c2.save()
+
+        p = Poll.objects.get(pk=p.pk)
+        with self.assertNumQueries(0):
+            self.assertEquals(p.total_votes(), 7)
+
+        # Deleting a choice takes its votes with it
+        c2.delete()
+        self.assertEquals(Poll.objects.get(pk=p.pk).total_votes(), 5)
+
+    def test_saving_a_stale_poll_keeps_votes_cast_since_it_was_loaded(self):
+        p = Poll(question="where", pub_date=timezone.now())
+        p.save()
+        c = Choice(poll=p, choice="here")
+        c.save()
+
+        stale = Poll.objects.get(pk=p.pk)
+        record_vote(p.id, c.id)
+        stale.question = "where now?"
+        stale.save()
+
+        fresh = Poll.objects.get(pk=p.pk)
+        self.assertEquals(fresh.question, "where now?")
+        self.assertEquals(fresh.total_votes(), 1)
+
+    def test_saving_a_stale_choice_keeps_votes_cast_since_it_was_loaded(self):
+        p = Poll(question="where", pub_date=timezone.now())
+        p.save()
+        c = Choice(poll=p, choice="here", votes=2)
+        c.save()
+
+        stale = Choice.objects.get(pk=c.pk)
+        record_vote(p.id, c.id)
+        stale.choice = "over here"
+        stale.save()
+        self.assertEquals(Choice.objects.get(pk=c.pk).votes, 3)
+
+        # An edit to votes is applied as a change on top of them.
+        stale.votes += 10
+        stale.save()
+        self.assertEquals(Choice.objects.get(pk=c.pk).votes, 13)
+        self.assertEquals(Poll.objects.get(pk=p.pk).total_votes(), 13)
+
+        stale.delete()
+        self.assertEquals(Poll.objects.get(pk=p.pk).total_votes(), 0)
+
+    def test_rows_can_be_created_with_explicit_ids(self):
+        p = Poll(id=500, question="where", pub_date=timezone.now())
+        p.save()
+        Choice(id=700, poll=p, choice="here", votes=2).save()
+
+        self.assertEquals(Choice.objects.get(pk=700).votes, 2)
+        self.assertEquals(Poll.objects.get(pk=500).total_votes(), 2)
+
+    def test_reconcile_command_repairs_drifted_totals(self):
+        p = Poll(question="where", pub_date=timezone.now())
+        p.save()
+        Choice(poll=p, choice="here", votes=5).save()
+        Poll.objects.filter(pk=p.pk).update(vote_count=42)
+
+        out = StringIO()
+        call_command('reconcile_vote_counts', stdout=out)
+
+        self.assertEquals(Poll.objects.get(pk=p.pk).total_votes(), 5)
+        self.assertIn("1 poll", out.getvalue())
+
+    def test_get_with_choices_loads_poll_and_choices_together(self):
+        p = Poll(question="where", pub_date=timezone.now())
+        p.save()
+        c1 = Choice(poll=p, choice="here", votes=1)
+        c1.save()
+        c2 = Choice(poll=p, choice="there", votes=3)
+        c2.save()
+
+        with self.assertNumQueries(1):
+            poll = Poll.objects.get_with_choices(p.id)
+            choices = list(poll.choice_set.all())
+            self.assertEquals(poll, p)
+            self.assertEquals(poll.pub_date, p.pub_date)
+            self.assertEquals(choices, [c1, c2])
+            self.assertEquals([c.percentage() for c in choices], [25, 75])
+
+    def test_get_with_choices_raises_for_unknown_poll(self):
+        self.assertRaises(Poll.DoesNotExist, Poll.objects.get_with_choices, 1)
+
 class ChoiceModelTest(TestCase):
 
     def test_create_some_choices_for_a_poll(self):
@@ -100,3 +194,15 @@ class ChoiceModelTest(TestCase):
         choice2.save()
         self.assertEquals(choice1.percentage(), 0)
         self.assertEquals(choice2.percentage(), 0)
+
+    def test_percentage_does_not_query_other_choices(self):
+        poll = Poll(question="who?", pub_date=timezone.now())
+        poll.save()
+        for votes in [1, 2, 3]:
+            Choice(poll=poll, choice=str(votes), votes=votes).save()
+
+        choices = list(Poll.objects.get(pk=poll.pk).choice_set.all())
+        with self.assertNumQueries(0):
+            self.assertEquals([c.percentage() for c in choices], [
+                100 * 1 / 6.0, 100 * 2 / 6.0, 100 * 3 / 6.0,
+            ])
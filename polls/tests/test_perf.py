@@ -0,0 +1,62 @@
+from django.test import TestCase, TransactionTestCase
+
+from polls import perf
+from polls.models import Poll
+
+class SeedCatalogTest(TestCase):
+
+    def test_seeds_polls_with_consistent_vote_counts(self):
+        perf.seed_catalog(30, min_choices=2, max_choices=5, batch_size=7)
+
+        self.assertEqual(Poll.objects.count(), 30)
+        for poll in Poll.objects.all():
+            choices = poll.choice_set.all()
+            self.assertTrue(2 <= len(choices) <= 5)
+            self.assertEqual(poll.vote_count, sum(c.votes for c in choices))
+
+class RunSuiteTest(TransactionTestCase):
+    # Not wrapped in a transaction, so votes cost what they would in production.
+
+    def test_stays_within_query_budgets(self):
+        perf.seed_catalog(20, max_choices=5)
+
+        results = perf.run_suite(requests=5)
+
+        self.assertEqual(sorted(results), sorted(perf.SCENARIOS))
+        for result in results.values():
+            self.assertEqual(result['requests'], 5)
+        self.assertEqual(perf.check_budgets(results), [])
+
+class CompareTest(TestCase):
+
+    baseline = {
+        'home': {'p95_ms': 10.0, 'queries': 1},
+        'vote': {'p95_ms': 4.0, 'queries': 4},
+    }
+
+    def test_passes_within_tolerance(self):
+        results = {
+            'home': {'p95_ms': 12.0, 'queries': 1},
+            'vote': {'p95_ms': 3.0, 'queries': 4},
+        }
+        self.assertEqual(perf.compare(results, self.baseline, tolerance=0.25), [])
+
+    def test_flags_slower_p95_and_extra_queries(self):
+        results = {
+            'home': {'p95_ms': 13.0, 'queries': 1},
+            'vote': {'p95_ms': 4.0, 'queries': 6},
+        }
+        regressions = perf.compare(results, self.baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('home: p95'))
+        self.assertTrue(regressions[1].startswith('vote: 6 queries'))
+
+    def test_flags_queries_over_budget(self):
+        results = {'home': {'queries': 3}, 'poll': {'queries': 1}}
+        self.assertEqual(perf.check_budgets(results), ["home: 3 queries per request, budget is 1"])
+
+    def test_percentile(self):
+        samples = range(1, 101)
+        self.assertEqual(perf.percentile(samples, 50), 50)
+        self.assertEqual(perf.percentile(samples, 95), 95)
+        self.assertEqual(perf.percentile([7], 95), 7)
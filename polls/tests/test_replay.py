@@ -0,0 +1,88 @@
+import json
+
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from polls import replay
+from polls.models import Poll, Choice
+
+def log(*entries):
+    return [json.dumps(entry) + '\n' for entry in entries]
+
+class ReadRequestsTest(TestCase):
+
+    def test_reads_requests_and_adds_csrf_pair_to_posts(self):
+        requests = replay.read_requests(log(
+            {'path': '/'},
+            {'method': 'post', 'path': '/poll/1/', 'data': {'vote': 2}, 't': 1.5},
+        ) + ['\n'])
+
+        self.assertEqual(requests[0], {'method': 'GET', 'path': '/', 'body': '', 'headers': {}, 't': None})
+        self.assertEqual(requests[1]['method'], 'POST')
+        self.assertIn('vote=2', requests[1]['body'])
+        self.assertIn('csrfmiddlewaretoken=' + replay.CSRF_TOKEN, requests[1]['body'])
+        self.assertEqual(requests[1]['t'], 1.5)
+
+    def test_rejects_lines_without_a_path(self):
+        with self.assertRaises(ValueError):
+            replay.read_requests(log({'method': 'GET'}))
+
+    def test_rejects_data_that_isnt_an_object(self):
+        for data in (['vote', 1], 'vote=1'):
+            with self.assertRaisesRegexp(ValueError, "Line 1 isn't a request"):
+                replay.read_requests(log({'method': 'POST', 'path': '/poll/1/', 'data': data}))
+        with self.assertRaisesRegexp(ValueError, "Line 1 isn't a request"):
+            replay.read_requests(log({'path': '/', 't': 'noon'}))
+
+    def test_schedule(self):
+        requests = [{'t': 10.0}, {'t': 11.0}, {'t': None}]
+        self.assertEqual(replay.schedule(requests), [None, None, None])
+        self.assertEqual(replay.schedule(requests, rate=2), [0, 0.5, 1.0])
+        self.assertEqual(replay.schedule(requests, speed=2), [0, 0.5, None])
+
+    def test_groups_by_url_pattern(self):
+        samples = [
+            ('GET', '/', 200, 0.01),
+            ('GET', '/poll/1/', 200, 0.02),
+            ('GET', '/poll/2/?x=1', 500, 0.03),
+            ('GET', '/nowhere/', 404, 0.01),
+        ]
+        summary = replay.summarise(samples, 2.0)
+
+        self.assertEqual(summary['*']['requests'], 4)
+        self.assertEqual(summary['*']['rps'], 2.0)
+        self.assertEqual(summary['polls.views.poll']['requests'], 2)
+        self.assertEqual(summary['polls.views.poll']['error_rate'], 0.5)
+        self.assertEqual(summary['<unresolved>']['errors'], 0)
+
+class ReplayTest(TransactionTestCase):
+    # Workers use their own database connections, so they must see
+    # committed data.
+
+    def setUp(self):
+        self.poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        self.choice = Choice.objects.create(poll=self.poll, choice="42")
+        self.requests = replay.read_requests(log(
+            {'path': '/'},
+            {'path': '/poll/%d/' % self.poll.id},
+            {'method': 'POST', 'path': '/poll/%d/' % self.poll.id, 'data': {'vote': self.choice.id}},
+            {'path': '/poll/%d/results/' % self.poll.id},
+        ))
+
+    def assert_replayed(self, samples):
+        self.assertEqual(sorted(status for _, _, status, _ in samples), [200, 200, 200, 302])
+        self.assertEqual(Choice.objects.get(pk=self.choice.id).votes, 1)
+
+    def test_replays_in_process(self):
+        samples, elapsed = replay.replay(self.requests, concurrency=2)
+        self.assert_replayed(samples)
+
+    def test_replays_over_http(self):
+        server = replay.serve()
+        try:
+            samples, elapsed = replay.replay(
+                self.requests, url='http://127.0.0.1:%d' % server.server_port, rate=100)
+        finally:
+            server.shutdown()
+        self.assert_replayed(samples)
+        self.assertTrue(elapsed >= 0.03)
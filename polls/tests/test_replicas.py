@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mysite import replicas
+from polls import replay
+from polls.models import Poll, Choice
+from polls.votes import record_vote
+
+@override_settings(DATABASE_REPLICAS=('replica',))
+class ReplicaRouterTest(TransactionTestCase):
+    # A TestCase would keep every test inside a transaction on the primary,
+    # which is where reads have to stay.
+
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+
+    def test_reads_go_to_a_replica_and_writes_to_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Poll), 'replica')
+        self.assertEqual(self.router.db_for_write(Poll), 'default')
+
+    def test_reads_stay_on_the_primary_when_pinned_or_in_a_transaction(self):
+        with replicas.use_primary():
+            self.assertEqual(self.router.db_for_read(Poll), 'default')
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Poll), 'default')
+        self.assertEqual(self.router.db_for_read(Poll), 'replica')
+
+    def test_relations_are_read_from_where_their_object_came_from(self):
+        poll = Poll(question="6 times 7", pub_date=timezone.now())
+        poll._state.db = 'default'
+        self.assertEqual(self.router.db_for_read(Choice, instance=poll), 'replica')
+        poll._state.db = 'replica'
+        self.assertEqual(self.router.db_for_read(Choice, instance=poll), 'replica')
+
+    def test_no_tables_are_created_on_replicas(self):
+        self.assertTrue(self.router.allow_syncdb('default', Poll))
+        self.assertFalse(self.router.allow_syncdb('replica', Poll))
+
+    @override_settings(DATABASE_REPLICAS=())
+    def test_everything_goes_to_the_primary_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Poll), 'default')
+        self.assertFalse(replicas.pinned_to_primary())
+
+class ReadYourWritesTest(TransactionTestCase):
+    """
+    Against a replica that's a copy of the test database taken before the
+    vote, i.e. one that hasn't caught up at all.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        self.choice = Choice.objects.create(poll=self.poll, choice="42")
+
+        self.directory = tempfile.mkdtemp()
+        primary = connections.databases['default']
+        replica = dict(primary, NAME=os.path.join(self.directory, 'replica.sqlite'))
+        shutil.copyfile(primary['NAME'], replica['NAME'])
+        connections.databases['replica'] = replica
+
+        self.settings = override_settings(DATABASE_REPLICAS=('replica',))
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        shutil.rmtree(self.directory)
+
+    def votes_shown(self, response):
+        return response.context['poll'].choice_set.all()[0].votes
+
+    def test_voters_see_their_vote_and_others_read_the_replica(self):
+        response = self.client.post('/poll/%d/' % self.poll.id, {'vote': self.choice.id}, follow=True)
+        self.assertIn(replicas.COOKIE, self.client.cookies)
+        self.assertEqual(self.votes_shown(response), 1)
+
+        response = self.client_class().get('/poll/%d/results/' % self.poll.id)
+        self.assertEqual(json.loads(response.content)['total_votes'], 0)
+
+    def test_the_cache_is_filled_from_the_primary(self):
+        # Otherwise everyone would be shown the lagging replica's counts
+        # for as long as they stay cached.
+        record_vote(self.poll.id, self.choice.id)
+        cache.clear()
+        response = self.client_class().get('/poll/%d/' % self.poll.id)
+        self.assertEqual(self.votes_shown(response), 1)
+
+    def test_the_lean_vote_endpoint_pins_voters_too(self):
+        send = replay.InProcess()
+        vote = replay.read_requests([
+            '{"method": "POST", "path": "/poll/%d/vote/", "data": {"vote": %d}}' % (self.poll.id, self.choice.id),
+        ])[0]
+        environ = {}
+
+        def start_response(status, headers, exc_info=None):
+            environ['cookies'] = [value.strip() for name, value in headers if name == 'Set-Cookie']
+        send.application(send.environ(vote), start_response)
+        self.assertTrue(any(cookie.startswith(replicas.COOKIE + '=') for cookie in environ['cookies']))
+        self.assertEqual(Choice.objects.using('default').get(pk=self.choice.id).votes, 1)
+        self.assertEqual(Choice.objects.using('replica').get(pk=self.choice.id).votes, 0)
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from polls.models import Poll, Choice, VoteEvent, VoteRollup
+from polls.rollups import rollup_events, vote_series, vote_totals
+from polls import votes
+from polls.votes import EventLog, add_votes, record_vote
+
+T0 = datetime(2013, 5, 1, 23, 58, 30, tzinfo=timezone.utc)
+
+class VoteRollupTest(TestCase):
+
+    def setUp(self):
+        self.poll = Poll(question="6 times 7", pub_date=T0)
+        self.poll.save()
+        self.choice1 = Choice(poll=self.poll, choice="42")
+        self.choice1.save()
+        self.choice2 = Choice(poll=self.poll, choice="The Ultimate Answer")
+        self.choice2.save()
+
+    def log(self, choice, when, votes=1):
+        VoteEvent.objects.create(poll=self.poll, choice=choice, votes=votes, created=when)
+
+    def test_votes_are_logged_as_events(self):
+        record_vote(self.poll.id, self.choice1.id)
+        add_votes({(self.poll.id, self.choice1.id): 3, (self.poll.id, self.choice2.id): 2})
+
+        self.assertEquals(
+            sorted(VoteEvent.objects.values_list('choice', 'votes')),
+            sorted([(self.choice1.id, 1), (self.choice1.id, 3), (self.choice2.id, 2)]),
+        )
+
+    @override_settings(POLLS_VOTE_EVENT_INTERVAL=60)
+    def test_votes_counted_one_at_a_time_are_logged_in_batches(self):
+        event_log = EventLog(60)
+        votes._event_log = event_log
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                record_vote(self.poll.id, self.choice1.id)
+            self.assertFalse([query for query in queries if query['sql'].startswith('INSERT')])
+            record_vote(self.poll.id, self.choice1.id)
+            record_vote(self.poll.id, self.choice2.id)
+            self.assertFalse(VoteEvent.objects.exists())
+
+            # Writes what's left, as at exit.
+            event_log.stop()
+        finally:
+            votes._event_log = None
+        self.assertEquals(
+            sorted(VoteEvent.objects.values_list('choice', 'votes')),
+            sorted([(self.choice1.id, 2), (self.choice2.id, 1)]),
+        )
+
+    def test_rollup_folds_events_into_buckets_and_deletes_them(self):
+        self.log(self.choice1, T0)
+        self.log(self.choice1, T0 + timedelta(seconds=10), votes=2)
+        self.log(self.choice2, T0 + timedelta(minutes=2))
+
+        self.assertEquals(rollup_events(chunk_size=2), 3)
+
+        self.assertEquals(VoteEvent.objects.count(), 0)
+        self.assertEquals(VoteRollup.objects.get(
+            choice=self.choice1, granularity='minute', bucket=T0.replace(second=0)).votes, 3)
+        self.assertEquals(VoteRollup.objects.get(
+            choice=self.choice2, granularity='day', bucket=datetime(2013, 5, 2, tzinfo=timezone.utc)).votes, 1)
+
+        # Later events add to the existing buckets
+        self.log(self.choice1, T0)
+        rollup_events()
+        self.assertEquals(VoteRollup.objects.get(
+            choice=self.choice1, granularity='hour', bucket=T0.replace(minute=0, second=0)).votes, 4)
+
+    def test_totals_over_ranges_come_from_the_rollups(self):
+        # One vote a minute for a little over two days
+        for minute in range(3000):
+            self.log(self.choice1 if minute % 3 else self.choice2, T0 + timedelta(minutes=minute))
+        rollup_events()
+
+        start = T0 + timedelta(minutes=5)
+        for length in [timedelta(minutes=7), timedelta(hours=5), timedelta(hours=40)]:
+            minutes = int(length.total_seconds() // 60)
+            with self.assertNumQueries(1):
+                self.assertEquals(vote_totals(start, start + length, poll=self.poll), minutes)
+            self.assertEquals(
+                vote_totals(start, start + length, choice=self.choice2),
+                len([m for m in range(5, 5 + minutes) if m % 3 == 0]),
+            )
+        self.assertEquals(vote_totals(T0, T0 + timedelta(days=3)), 3000)
+
+    def test_series_gives_votes_per_bucket(self):
+        self.log(self.choice1, T0)
+        self.log(self.choice2, T0 + timedelta(minutes=1))
+        self.log(self.choice1, T0 + timedelta(hours=2))
+        rollup_events()
+
+        self.assertEquals(vote_series(T0, T0 + timedelta(hours=3), 'hour', poll=self.poll), [
+            (datetime(2013, 5, 1, 23, tzinfo=timezone.utc), 2),
+            (datetime(2013, 5, 2, 1, tzinfo=timezone.utc), 1),
+        ])
+
+    def test_command_rolls_up_events(self):
+        self.log(self.choice1, T0)
+
+        out = StringIO()
+        call_command('rollup_votes', stdout=out)
+
+        self.assertIn("Rolled up 1 vote event", out.getvalue())
+        self.assertEquals(VoteEvent.objects.count(), 0)
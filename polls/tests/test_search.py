@@ -0,0 +1,64 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from polls import search
+from polls.models import Poll, Choice
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.tdd = Poll.objects.create(question="How awesome is Test-Driven Development?", pub_date=timezone.now())
+        Choice.objects.create(poll=self.tdd, choice="Very awesome")
+        self.lunch = Poll.objects.create(question="What's for lunch?", pub_date=timezone.now())
+        Choice.objects.create(poll=self.lunch, choice="Testing sandwiches")
+
+    def questions(self, terms):
+        return [poll.question for poll in search.search(terms)]
+
+    def test_matches_question_and_choices_by_prefix(self):
+        self.assertEqual(self.questions("lunch"), ["What's for lunch?"])
+        self.assertEqual(self.questions("sandw"), ["What's for lunch?"])
+        self.assertEqual(self.questions("awesome devel"), ["How awesome is Test-Driven Development?"])
+        self.assertEqual(self.questions("awesome lunch"), [])
+
+    def test_ranks_question_matches_above_choice_matches(self):
+        self.assertEqual(self.questions("test"), [
+            "How awesome is Test-Driven Development?", "What's for lunch?",
+        ])
+
+    def test_ranks_better_matches_first(self):
+        Poll.objects.create(
+            question="Is this a long and winding question that only mentions lunch once?", pub_date=timezone.now())
+        self.assertEqual(self.questions("lunch"), [
+            "What's for lunch?", "Is this a long and winding question that only mentions lunch once?",
+        ])
+        self.assertEqual([poll.id for poll in search.search("lunch", limit=1)], [self.lunch.id])
+
+    def test_follows_edits_and_deletes(self):
+        self.tdd.question = "How great is pairing?"
+        self.tdd.save()
+        self.assertEqual(self.questions("pairing"), ["How great is pairing?"])
+        self.assertEqual(self.questions("development"), [])
+
+        Choice.objects.get(poll=self.lunch).delete()
+        self.assertEqual(self.questions("sandwiches"), [])
+
+        self.lunch.delete()
+        self.assertEqual(self.questions("lunch"), [])
+
+    def test_rebuild_picks_up_bulk_created_polls(self):
+        Poll.objects.bulk_create([Poll(question="Bulk loaded", pub_date=timezone.now())])
+        self.assertEqual(self.questions("bulk"), [])
+
+        self.assertEqual(search.rebuild_index(chunk_size=1), 3)
+        self.assertEqual(self.questions("bulk"), ["Bulk loaded"])
+
+    def test_ignores_query_syntax(self):
+        self.assertEqual(search.match_query(u'lunch" OR -(x*'), u'"lunch"* "OR"* "x"*')
+        self.assertEqual(search.match_query(u'***'), None)
+        self.assertEqual(self.questions('(lunch* "'), ["What's for lunch?"])
+
+    def test_home_page_searches(self):
+        response = self.client.get('/', {'q': 'lunch'})
+        self.assertEqual([p.id for p in response.context['polls']], [self.lunch.id])
+        self.assertContains(response, 'value="lunch"')
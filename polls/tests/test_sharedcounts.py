@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.admin import site
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from polls import sharedcounts, votes
+from polls.admin import PollAdmin
+from polls.models import Poll, Choice, SharedVoteCheckpoint
+from polls.sharedcounts import FlusherRunning, SharedCounters
+from polls.streaming import ResultsFeed
+from polls.votes import flush_shared_votes, recover_shared_votes
+
+class SharedCountersTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'votes')
+        self.counters = self.open()
+
+    def open(self, slots=1024):
+        counters = SharedCounters(self.path, slots)
+        self.addCleanup(counters.close)
+        return counters
+
+    def test_counts_votes_per_choice_and_poll(self):
+        self.counters.add(1, 10)
+        self.counters.add(1, 10)
+        self.counters.add(1, 11)
+        self.assertEqual(self.counters.pending(10), 2)
+        self.assertEqual(self.counters.pending(11), 1)
+        self.assertEqual(self.counters.poll_counted(1), 3)
+        self.assertEqual(self.counters.pending(12), 0)
+
+    def test_every_process_mapping_the_file_sees_the_same_counts(self):
+        other = self.open()
+        self.counters.add(1, 10)
+        other.add(1, 10)
+        self.assertEqual(self.counters.pending(10), 2)
+        self.assertEqual(other.file_id, self.counters.file_id)
+
+    def test_collects_only_what_changed_since_the_last_collection(self):
+        self.counters.add(1, 10)
+        self.counters.add(2, 500)
+        self.assertEqual(self.counters.collect(), {10: (1, 0), 500: (1, 0)})
+
+        self.counters.mark_flushed({10: 1, 500: 1})
+        self.assertEqual(self.counters.pending(10), 0)
+        self.assertEqual(self.counters.collect(), {})
+
+        self.counters.add(1, 10)
+        self.assertEqual(self.counters.collect(), {10: (2, 1)})
+
+    def test_ids_past_the_slots_dont_fit(self):
+        self.assertTrue(self.counters.fits(1, 1023))
+        self.assertFalse(self.counters.fits(1, 1024))
+        self.assertFalse(self.counters.fits(1024, 1))
+
+    def test_refuses_a_file_of_a_different_size(self):
+        self.assertRaises(ImproperlyConfigured, SharedCounters, self.path, 2048)
+
+    def test_only_one_process_can_flush(self):
+        self.counters.become_flusher()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.open().become_flusher()
+                os._exit(0)
+            except FlusherRunning:
+                os._exit(1)
+            except BaseException:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 1)
+
+class SharedVotesTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'votes')
+        self.settings_override = override_settings(POLLS_SHARED_VOTES_FILE=self.path, POLLS_SHARED_VOTES_SLOTS=4096)
+        self.settings_override.enable()
+        sharedcounts.forget()
+        votes._shared_choices.clear()
+
+        self.poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        self.choice = Choice.objects.create(poll=self.poll, choice="42")
+        self.url = '/poll/%d/' % self.poll.id
+
+    def tearDown(self):
+        sharedcounts.forget()
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def vote(self, times=1):
+        for _ in range(times):
+            self.client.post(self.url, {'vote': self.choice.id})
+
+    def votes_in_database(self):
+        return Choice.objects.get(pk=self.choice.id).votes, Poll.objects.get(pk=self.poll.id).vote_count
+
+    def flusher(self):
+        counters = SharedCounters(self.path, 4096)
+        self.addCleanup(counters.close)
+        recover_shared_votes(counters)
+        return counters
+
+    def test_votes_are_shown_at_once_and_written_when_flushed(self):
+        self.vote(3)
+        self.assertEqual(self.votes_in_database(), (0, 0))
+        self.assertIn('3 votes', self.client.get(self.url).content)
+
+        self.assertEqual(flush_shared_votes(self.flusher()), 3)
+        self.assertEqual(self.votes_in_database(), (3, 3))
+        self.assertIn('3 votes', self.client.get(self.url).content)
+
+    def test_votes_counted_by_other_processes_show_past_the_cache(self):
+        self.assertIn('No-one has voted', self.client.get(self.url).content)
+        # Another worker's vote clears only that worker's cache.
+        other = SharedCounters(self.path, 4096)
+        self.addCleanup(other.close)
+        other.add(self.poll.id, self.choice.id)
+        self.assertIn('1 vote', self.client.get(self.url).content)
+
+    def test_admin_counts_votes_in_shared_memory(self):
+        self.vote(2)
+        admin = PollAdmin(Poll, site)
+        poll = admin.get_queryset(None).get(pk=self.poll.id)
+        self.assertEqual(admin.total_votes(poll), 2)
+
+    def test_votes_are_streamed_before_and_after_the_flush(self):
+        feed = ResultsFeed()
+        feed.subscribe(self.poll.id, 'subscriber')
+        self.vote(2)
+        self.assertEqual(len(feed.changes()), 1)
+
+        flush_shared_votes(self.flusher())
+        self.assertEqual(feed.changes(), [])
+
+    def test_votes_move_the_results_etag_on(self):
+        results = '/poll/%d/results/' % self.poll.id
+        etag = self.client.get(results)['ETag']
+        self.vote()
+        response = self.client.get(results, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_rejects_choices_from_other_polls(self):
+        other = Poll.objects.create(question="Other", pub_date=timezone.now())
+        response = self.client.post('/poll/%d/' % other.id, {'vote': self.choice.id})
+        self.assertEqual(response.status_code, 404)
+
+    def test_a_failed_flush_is_retried_by_the_next_flusher(self):
+        self.vote(2)
+
+        def fail(votes):
+            raise RuntimeError("database went away")
+        add_votes = votes.add_votes
+        votes.add_votes = fail
+        try:
+            self.assertRaises(RuntimeError, flush_shared_votes, self.flusher())
+        finally:
+            votes.add_votes = add_votes
+        self.assertEqual(self.votes_in_database(), (0, 0))
+
+        self.assertEqual(flush_shared_votes(self.flusher()), 2)
+        self.assertEqual(self.votes_in_database(), (2, 2))
+
+    def test_votes_committed_by_a_flusher_that_then_died_arent_flushed_twice(self):
+        self.vote(2)
+        counters = self.flusher()
+
+        def die(counts):
+            raise SystemExit
+        counters.mark_flushed = die
+        self.assertRaises(SystemExit, flush_shared_votes, counters)
+        self.assertEqual(self.votes_in_database(), (2, 2))
+
+        self.vote()
+        self.assertEqual(flush_shared_votes(self.flusher()), 1)
+        self.assertEqual(self.votes_in_database(), (3, 3))
+
+    def test_checkpoints_of_a_lost_file_are_ignored(self):
+        self.vote(2)
+        flush_shared_votes(self.flusher())
+        sharedcounts.forget()
+        os.remove(self.path)
+
+        self.vote()
+        self.assertEqual(flush_shared_votes(self.flusher()), 1)
+        self.assertEqual(self.votes_in_database(), (3, 3))
+        self.assertEqual(SharedVoteCheckpoint.objects.get(choice=self.choice).counted, 1)
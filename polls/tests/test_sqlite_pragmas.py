@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+
+from django.db import connections
+from django.test import TestCase
+
+from mysite.sqlite_pragmas import PRODUCTION_PRAGMAS
+
+class SqlitePragmasTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        connections.databases['tuned'] = dict(
+            connections.databases['default'],
+            NAME=os.path.join(self.directory, 'tuned.sqlite'),
+            PRAGMAS=PRODUCTION_PRAGMAS,
+        )
+
+    def tearDown(self):
+        connections['tuned'].close()
+        del connections['tuned']
+        del connections.databases['tuned']
+        shutil.rmtree(self.directory)
+
+    def pragma(self, name):
+        cursor = connections['tuned'].cursor()
+        cursor.execute('PRAGMA %s' % name)
+        return cursor.fetchone()[0]
+
+    def test_new_connections_run_with_the_production_pragmas(self):
+        self.assertEquals(self.pragma('journal_mode'), 'wal')
+        # NORMAL
+        self.assertEquals(self.pragma('synchronous'), 1)
+        self.assertEquals(self.pragma('busy_timeout'), 5000)
+        self.assertEquals(self.pragma('mmap_size'), 256 * 1024 * 1024)
+        self.assertEquals(self.pragma('cache_size'), -64000)
+
+    def test_connections_without_pragmas_are_left_alone(self):
+        del connections.databases['tuned']['PRAGMAS']
+        self.assertEquals(self.pragma('journal_mode'), 'delete')
+        self.assertEquals(self.pragma('mmap_size'), 0)
@@ -0,0 +1,107 @@
+import asyncore
+import json
+import socket
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mysite.events import EventServer
+from polls.models import Poll, Choice
+from polls.streaming import ResultsFeed
+from polls.votes import compact_shards, record_sharded_vote, record_vote
+
+def parse_event(event):
+    lines = event.strip().split('\n')
+    return lines[0][len('event: '):], json.loads(lines[1][len('data: '):])
+
+class ResultsFeedTest(TestCase):
+
+    def setUp(self):
+        self.poll = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll.save()
+        self.choice1 = Choice(poll=self.poll, choice="42", votes=1)
+        self.choice1.save()
+        self.choice2 = Choice(poll=self.poll, choice="The Ultimate Answer", votes=2)
+        self.choice2.save()
+        self.feed = ResultsFeed()
+
+    def test_subscribing_returns_the_current_results(self):
+        name, data = parse_event(self.feed.subscribe(self.poll.id, 'subscriber'))
+
+        self.assertEquals(name, 'results')
+        self.assertEquals(data['total_votes'], 3)
+        self.assertEquals([c['votes'] for c in data['choices']], [1, 2])
+
+    def test_changes_are_coalesced_into_one_delta_per_poll(self):
+        self.feed.subscribe(self.poll.id, 'subscriber')
+        self.assertEquals(self.feed.changes(), [])
+
+        for _ in range(3):
+            record_vote(self.poll.id, self.choice2.id)
+
+        with self.assertNumQueries(2):
+            changes = self.feed.changes()
+        self.assertEquals(len(changes), 1)
+        poll_id, event = changes[0]
+        self.assertEquals(poll_id, self.poll.id)
+        self.assertEquals(parse_event(event), ('votes', {
+            'id': self.poll.id,
+            'total_votes': 6,
+            'choices': {str(self.choice2.id): 5},
+        }))
+        self.assertEquals(self.feed.changes(), [])
+
+    @override_settings(POLLS_VOTE_SHARDS=4)
+    def test_sharded_votes_are_streamed_and_never_go_back(self):
+        self.feed.subscribe(self.poll.id, 'subscriber')
+
+        record_sharded_vote(self.poll.id, self.choice2.id, 4)
+        changes = self.feed.changes()
+        self.assertEquals(len(changes), 1)
+        self.assertEquals(parse_event(changes[0][1])[1]['choices'], {str(self.choice2.id): 3})
+
+        compact_shards()
+        self.assertEquals(self.feed.changes(), [])
+
+    def test_unsubscribed_polls_are_not_checked(self):
+        self.feed.subscribe(self.poll.id, 'subscriber')
+        self.feed.unsubscribe(self.poll.id, 'subscriber')
+
+        with self.assertNumQueries(0):
+            self.assertEquals(self.feed.changes(), [])
+
+class EventServerTest(TestCase):
+
+    def setUp(self):
+        self.poll = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll.save()
+        self.choice = Choice(poll=self.poll, choice="42", votes=1)
+        self.choice.save()
+        self.server = EventServer('127.0.0.1', 0)
+        self.client = socket.create_connection(self.server.socket.getsockname())
+        self.client.settimeout(5)
+
+    def tearDown(self):
+        self.client.close()
+        asyncore.close_all(self.server.map)
+
+    def read(self):
+        asyncore.loop(timeout=0.1, map=self.server.map, count=5)
+        return self.client.recv(65536)
+
+    def test_streams_results_then_deltas(self):
+        self.client.sendall("GET /poll/%d/events/ HTTP/1.1\r\nHost: localhost\r\n\r\n" % self.poll.id)
+        response = self.read()
+        self.assertIn('text/event-stream', response)
+        self.assertEquals(parse_event(response.split('\r\n\r\n', 1)[1])[0], 'results')
+
+        record_vote(self.poll.id, self.choice.id)
+        self.server.publish()
+        name, data = parse_event(self.read())
+        self.assertEquals(name, 'votes')
+        self.assertEquals(data['choices'], {str(self.choice.id): 2})
+
+    def test_unknown_poll_404s(self):
+        self.client.sendall("GET /poll/%d/events/ HTTP/1.1\r\n\r\n" % (self.poll.id + 1))
+        self.assertIn('404 Not Found', self.read())
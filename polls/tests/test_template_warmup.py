@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.template import loader
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mysite.template_warmup import prewarm_templates, template_names
+
+class PrewarmTemplatesTest(TestCase):
+
+    def test_finds_the_apps_templates(self):
+        self.assertEqual(sorted(template_names(['polls'])), [
+            'admin/polls/poll/change_list.html', 'home.html', 'poll.html',
+        ])
+        self.assertEqual(list(template_names(['nonexistent'])), [])
+
+    def test_fills_the_cached_loader(self):
+        cached = (('django.template.loaders.cached.Loader', settings.TEMPLATE_LOADERS),)
+        with override_settings(TEMPLATE_LOADERS=cached):
+            self.assertEqual(prewarm_templates(['polls']), [
+                'admin/polls/poll/change_list.html', 'home.html', 'poll.html',
+            ])
+            cache = loader.template_source_loaders[0].template_cache
+            self.assertIn('home.html', cache)
+            self.assertIn('poll.html', cache)
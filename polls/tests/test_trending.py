@@ -0,0 +1,122 @@
+import time
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from polls import trending
+from polls.models import Poll, Choice, TrendingPoll
+from polls.trending import Leaderboard
+
+HOUR = 60 * 60
+
+class LeaderboardTest(TestCase):
+
+    def setUp(self):
+        self.now = 1000 * HOUR
+        self.leaderboard = Leaderboard(size=3, half_life=HOUR)
+
+    def test_ranks_polls_by_votes_halving_every_half_life(self):
+        self.leaderboard.add(1, votes=4, now=self.now - HOUR)
+        self.leaderboard.add(2, votes=3, now=self.now)
+        self.leaderboard.add(3, votes=1, now=self.now)
+
+        top = self.leaderboard.top(3, now=self.now)
+        self.assertEqual([poll_id for poll_id, _ in top], [2, 1, 3])
+        self.assertAlmostEqual(top[1][1], 2.0)
+        self.assertAlmostEqual(self.leaderboard.top(1, now=self.now + 2 * HOUR)[0][1], 0.75)
+
+    def test_a_new_poll_takes_the_lowest_place_and_its_score(self):
+        for poll_id, votes in [(1, 5), (2, 4), (3, 2)]:
+            self.leaderboard.add(poll_id, votes=votes, now=self.now)
+        self.leaderboard.add(4, now=self.now)
+
+        top = dict(self.leaderboard.top(3, now=self.now))
+        self.assertEqual(sorted(top), [1, 2, 4])
+        self.assertAlmostEqual(top[4], 3.0)
+
+    def test_scores_carry_over_into_the_next_era(self):
+        era = trending.ERA_HALF_LIVES * HOUR
+        self.leaderboard.add(1, votes=8, now=era - HOUR)
+        self.leaderboard.add(2, votes=3, now=era + HOUR)
+
+        self.assertEqual(
+            [(poll_id, round(score, 6)) for poll_id, score in self.leaderboard.top(2, now=era + HOUR)],
+            [(2, 3.0), (1, 2.0)])
+
+    def test_hot_polls_look_up_only_questions_they_dont_have(self):
+        polls = [Poll.objects.create(question="Poll %d" % i, pub_date=timezone.now()) for i in range(2)]
+        self.leaderboard.add(polls[0].id, votes=2)
+        self.leaderboard.add(polls[1].id)
+        self.leaderboard.add(12345)
+
+        with self.assertNumQueries(1):
+            hot = self.leaderboard.hot_polls(3)
+        self.assertEqual([poll.question for poll in hot], ["Poll 0", "Poll 1"])
+        with self.assertNumQueries(0):
+            self.leaderboard.hot_polls(3)
+
+    def test_saves_and_loads_scores(self):
+        polls = [Poll.objects.create(question="Poll %d" % i, pub_date=timezone.now()) for i in range(4)]
+        other = Leaderboard(size=3, half_life=HOUR)
+        for i, poll in enumerate(polls):
+            self.leaderboard.add(poll.id, votes=i + 1, now=self.now)
+            other.add(poll.id, votes=1, now=self.now)
+
+        self.assertEqual(self.leaderboard.save(now=self.now), 3)
+        self.assertEqual(other.save(now=self.now), 3)
+        self.assertEqual(TrendingPoll.objects.count(), 3)
+
+        top = other.top(3, now=self.now)
+        self.assertEqual([poll_id for poll_id, _ in top], [polls[3].id, polls[2].id, polls[1].id])
+        self.assertAlmostEqual(top[0][1], 5.0)
+
+        restarted = Leaderboard(size=3, half_life=HOUR)
+        restarted.load(now=self.now)
+        self.assertEqual(restarted.top(1, now=self.now)[0][0], polls[3].id)
+
+class LeaderboardSavingTest(TransactionTestCase):
+
+    def test_saves_in_the_background_and_when_stopped(self):
+        poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        leaderboard = Leaderboard(size=3, half_life=HOUR, save_interval=0.05)
+        leaderboard.add(poll.id)
+        for _ in range(100):
+            if TrendingPoll.objects.exists():
+                break
+            time.sleep(0.05)
+        self.assertTrue(TrendingPoll.objects.filter(poll=poll).exists())
+
+        leaderboard.add(poll.id)
+        leaderboard.stop()
+        self.assertEqual(leaderboard.save(), 0)
+
+@override_settings(POLLS_TRENDING_SIZE=10)
+class HotPollsTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        trending.forget_all()
+        self.addCleanup(trending.forget_all)
+
+    def test_home_page_shows_the_polls_being_voted_on(self):
+        polls = [Poll.objects.create(question="Poll %d" % i, pub_date=timezone.now()) for i in range(3)]
+        for poll, votes in zip(polls, [1, 3, 0]):
+            choice = Choice.objects.create(poll=poll, choice="Yes")
+            for _ in range(votes):
+                self.client.post('/poll/%d/' % poll.id, {'vote': choice.id})
+
+        response = self.client.get('/')
+        self.assertEqual([poll.question for poll in response.context['hot_polls']], ["Poll 1", "Poll 0"])
+        self.assertIn("Hot polls", response.content)
+
+        with self.assertNumQueries(0):
+            self.client.get('/')
+
+    @override_settings(POLLS_TRENDING_SIZE=None)
+    def test_can_be_turned_off(self):
+        poll = Poll.objects.create(question="6 times 7", pub_date=timezone.now())
+        choice = Choice.objects.create(poll=poll, choice="42")
+        self.client.post('/poll/%d/' % poll.id, {'vote': choice.id})
+        self.assertNotIn('hot_polls', self.client.get('/').context)
@@ -1,9 +1,15 @@
+import json
+from datetime import timedelta
+
+from django.core.cache import cache
 from django.test import TestCase
 from django.utils import timezone
 from django.core.urlresolvers import reverse
+from django.utils.http import http_date
 
 from polls.models import Poll, Choice
 from polls.forms import PollVoteForm
+from polls.views import POLLS_PER_PAGE
 
 class HomePageViewTest(TestCase):
 
@@ -33,6 +39,36 @@ class HomePageViewTest(TestCase):
         poll2_url = reverse('polls.views.poll', args=[poll2.id,])
         self.assertIn(poll2_url, response.content)
 
+    def test_root_url_pages_through_polls_in_publication_order(self):
+        now = timezone.now()
+        # Two polls share a pub_date to check the id tie-break
+        polls = [Poll(question="poll %d" % i, pub_date=now + timedelta(seconds=i // 2))
+                 for i in range(POLLS_PER_PAGE * 2 + 1)]
+        for poll in reversed(polls):
+            poll.save()
+        polls.sort(key=lambda p: (p.pub_date, p.id))
+
+        seen = []
+        response = self.client.get('/')
+        while True:
+            seen.extend(response.context['polls'])
+            next_page = response.context['next_page']
+            if next_page is None:
+                break
+            self.assertIn('?after=%s' % next_page, response.content)
+            response = self.client.get('/', {'after': next_page})
+
+        self.assertEquals(seen, polls)
+
+    def test_root_url_404s_for_a_garbled_cursor(self):
+        response = self.client.get('/', {'after': 'nonsense'})
+        self.assertEquals(response.status_code, 404)
+
+    def test_root_url_404s_for_an_out_of_range_cursor(self):
+        for cursor in ('99999999999999999999.1', '-99999999999999999999.1', '0.99999999999999999999'):
+            response = self.client.get('/', {'after': cursor})
+            self.assertEquals(response.status_code, 404)
+
 class SinglePollViewTest(TestCase):
 
     def test_page_shows_poll_title_and_no_votes_message(self):
@@ -117,3 +153,120 @@ class SinglePollViewTest(TestCase):
         response = self.client.get('/poll/%d/' % poll1.id)
         self.assertIn('1 vote', response.content)
         self.assertNotIn('1 votes', response.content)
+
+    def test_view_uses_one_query_however_many_choices(self):
+        for num_choices in [1, 2, 30]:
+            poll1 = Poll(question="6 times 7", pub_date=timezone.now())
+            poll1.save()
+            for i in range(num_choices):
+                Choice(poll=poll1, choice="answer %d" % i, votes=i).save()
+
+            with self.assertNumQueries(1):
+                response = self.client.get("/poll/%d/" % poll1.id)
+
+            self.assertIn("answer %d" % (num_choices - 1), response.content)
+
+class PollCachingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.poll = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll.save()
+        self.choice = Choice(poll=self.poll, choice="42", votes=1)
+        self.choice.save()
+        self.poll_url = "/poll/%d/" % self.poll.id
+
+    def test_repeat_visits_are_served_from_the_cache(self):
+        self.client.get(self.poll_url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.poll_url)
+        self.assertIn("100 %: 42", response.content)
+
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertIn(self.poll.question, response.content)
+
+    def test_voting_refreshes_the_results(self):
+        other = Choice(poll=self.poll, choice="The Ultimate Answer", votes=0)
+        other.save()
+        self.assertIn("100 %: 42", self.client.get(self.poll_url).content)
+
+        self.client.post(self.poll_url, data={'vote': str(other.id)})
+
+        response = self.client.get(self.poll_url)
+        self.assertIn("50 %: 42", response.content)
+        self.assertIn("2 votes", response.content)
+
+    def test_editing_polls_refreshes_the_pages(self):
+        self.client.get(self.poll_url)
+        self.client.get('/')
+
+        self.choice.choice = "forty-two"
+        self.choice.save()
+        self.poll.question = "What is 6 times 7?"
+        self.poll.save()
+
+        self.assertIn("forty-two", self.client.get(self.poll_url).content)
+        self.assertIn("What is 6 times 7?", self.client.get('/').content)
+
+class PollResultsApiTest(TestCase):
+
+    def setUp(self):
+        self.poll = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll.save()
+        self.choice1 = Choice(poll=self.poll, choice="42", votes=1)
+        self.choice1.save()
+        self.choice2 = Choice(poll=self.poll, choice="The Ultimate Answer", votes=3)
+        self.choice2.save()
+        self.results_url = "/poll/%d/results/" % self.poll.id
+
+    def test_returns_choices_votes_and_percentages_as_json(self):
+        response = self.client.get(self.results_url)
+
+        self.assertEquals(response['Content-Type'], 'application/json')
+        self.assertEquals(json.loads(response.content), {
+            'id': self.poll.id,
+            'question': "6 times 7",
+            'total_votes': 4,
+            'choices': [
+                {'id': self.choice1.id, 'choice': "42", 'votes': 1, 'percentage': 25.0},
+                {'id': self.choice2.id, 'choice': "The Ultimate Answer", 'votes': 3, 'percentage': 75.0},
+            ],
+        })
+
+    def test_unchanged_poll_is_not_modified(self):
+        response = self.client.get(self.results_url)
+        etag = response['ETag']
+
+        # Only the poll's version is looked up, never its choices
+        with self.assertNumQueries(1):
+            response = self.client.get(self.results_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+    def test_a_vote_in_the_same_second_is_not_hidden(self):
+        response = self.client.get(self.results_url)
+        # Only the ETag is given out, as it changes with every vote.
+        self.assertNotIn('Last-Modified', response)
+
+        self.client.post("/poll/%d/" % self.poll.id, data={'vote': str(self.choice1.id)})
+        response = self.client.get(self.results_url, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEquals(response.status_code, 200)
+
+    def test_votes_and_edits_change_the_etag(self):
+        etag = self.client.get(self.results_url)['ETag']
+
+        self.client.post("/poll/%d/" % self.poll.id, data={'vote': str(self.choice1.id)})
+        response = self.client.get(self.results_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content)['total_votes'], 5)
+
+        etag = response['ETag']
+        self.choice2.choice = "Forty-two"
+        self.choice2.save()
+        response = self.client.get(self.results_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+
+    def test_unknown_poll_404s(self):
+        response = self.client.get("/poll/%d/results/" % (self.poll.id + 1))
+        self.assertEquals(response.status_code, 404)
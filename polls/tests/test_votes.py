@@ -0,0 +1,249 @@
+import threading
+
+from django.db import connection
+import json
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from polls import votes
+from polls.models import Poll, Choice, VoteEvent, VoteShard
+from polls.rollups import MINUTE, truncate
+from polls.votes import VoteBuffer, add_votes, compact_shards, record_sharded_vote, record_vote
+
+class RecordVoteTest(TestCase):
+
+    def setUp(self):
+        self.poll = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll.save()
+        self.choice = Choice(poll=self.poll, choice="42", votes=3)
+        self.choice.save()
+
+    def test_increments_votes_and_returns_new_totals(self):
+        self.assertEquals(record_vote(self.poll.id, self.choice.id), (4, 4))
+        self.assertEquals(record_vote(self.poll.id, self.choice.id), (5, 5))
+        self.assertEquals(Choice.objects.get(pk=self.choice.id).votes, 5)
+        self.assertEquals(Poll.objects.get(pk=self.poll.id).total_votes(), 5)
+
+    def test_rejects_choice_from_another_poll(self):
+        other_poll = Poll(question="time", pub_date=timezone.now())
+        other_poll.save()
+
+        self.assertRaises(Choice.DoesNotExist, record_vote, other_poll.id, self.choice.id)
+        self.assertEquals(Choice.objects.get(pk=self.choice.id).votes, 3)
+        self.assertEquals(Poll.objects.get(pk=other_poll.id).total_votes(), 0)
+
+    def test_view_404s_for_choice_from_another_poll(self):
+        other_poll = Poll(question="time", pub_date=timezone.now())
+        other_poll.save()
+
+        response = self.client.post("/poll/%d/" % other_poll.id, data={'vote': str(self.choice.id)})
+        self.assertEquals(response.status_code, 404)
+
+class AddVotesTest(TestCase):
+
+    def test_applies_batched_votes_to_choices_and_polls(self):
+        polls = []
+        choices = []
+        for i in range(2):
+            poll = Poll(question="poll %d" % i, pub_date=timezone.now())
+            poll.save()
+            polls.append(poll)
+            for j in range(200):
+                choice = Choice(poll=poll, choice="choice %d" % j, votes=1)
+                choice.save()
+                choices.append(choice)
+
+        add_votes(dict(((c.poll_id, c.id), c.id % 5) for c in choices))
+
+        for choice in choices:
+            self.assertEquals(Choice.objects.get(pk=choice.id).votes, 1 + choice.id % 5)
+        for poll in polls:
+            self.assertEquals(
+                Poll.objects.get(pk=poll.id).total_votes(),
+                sum(1 + c.id % 5 for c in choices if c.poll_id == poll.id),
+            )
+
+class VoteBufferTest(TestCase):
+
+    def setUp(self):
+        self.poll = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll.save()
+        self.choice = Choice(poll=self.poll, choice="42", votes=3)
+        self.choice.save()
+        self.buffer = VoteBuffer(interval=3600)
+
+    def tearDown(self):
+        self.buffer.stop()
+
+    def test_votes_are_held_until_flushed(self):
+        for _ in range(5):
+            self.buffer.add(self.poll.id, self.choice.id)
+        self.assertEquals(Choice.objects.get(pk=self.choice.id).votes, 3)
+
+        self.assertEquals(self.buffer.flush(), 5)
+        self.assertEquals(Choice.objects.get(pk=self.choice.id).votes, 8)
+        self.assertEquals(Poll.objects.get(pk=self.poll.id).total_votes(), 8)
+        self.assertEquals(self.buffer.flush(), 0)
+
+    def test_stopping_flushes_remaining_votes(self):
+        self.buffer.add(self.poll.id, self.choice.id)
+        self.buffer.stop()
+        self.assertEquals(Choice.objects.get(pk=self.choice.id).votes, 4)
+
+        # Votes arriving after shutdown go straight to the database
+        self.buffer.add(self.poll.id, self.choice.id)
+        self.assertEquals(Choice.objects.get(pk=self.choice.id).votes, 5)
+
+    def test_rejects_choice_from_another_poll(self):
+        other_poll = Poll(question="time", pub_date=timezone.now())
+        other_poll.save()
+
+        self.assertRaises(Choice.DoesNotExist, self.buffer.add, other_poll.id, self.choice.id)
+        self.assertEquals(self.buffer.flush(), 0)
+
+    def test_votes_are_logged_in_the_minute_they_were_cast(self):
+        cast = truncate(timezone.now(), MINUTE)
+        self.buffer.add(self.poll.id, self.choice.id)
+        now = timezone.now
+        timezone.now = lambda: cast + timedelta(minutes=5)
+        try:
+            self.assertEquals(self.buffer.flush(), 1)
+        finally:
+            timezone.now = now
+
+        [(created, count)] = VoteEvent.objects.values_list('created', 'votes')
+        self.assertTrue(cast <= created <= cast + timedelta(minutes=1))
+        self.assertEquals(count, 1)
+
+    def test_votes_for_deleted_choices_are_dropped(self):
+        doomed = Choice(poll=self.poll, choice="41")
+        doomed.save()
+        votes._vote_buffer = self.buffer
+        try:
+            self.buffer.add(self.poll.id, self.choice.id)
+            self.buffer.add(self.poll.id, doomed.id)
+            doomed.delete()
+
+            self.assertEquals(self.buffer.flush(), 1)
+            self.assertEquals(Poll.objects.get(pk=self.poll.id).total_votes(), 4)
+            # It's no longer taken for a valid choice either.
+            self.assertRaises(Choice.DoesNotExist, self.buffer.add, self.poll.id, doomed.id)
+        finally:
+            votes._vote_buffer = None
+
+@override_settings(POLLS_VOTE_SHARDS=4)
+class ShardedVoteTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.poll = Poll(question="6 times 7", pub_date=timezone.now())
+        self.poll.save()
+        self.choice = Choice(poll=self.poll, choice="42", votes=3)
+        self.choice.save()
+        self.other = Choice(poll=self.poll, choice="The Ultimate Answer", votes=1)
+        self.other.save()
+
+    def test_votes_land_in_shards_until_compacted(self):
+        for _ in range(20):
+            record_sharded_vote(self.poll.id, self.choice.id, 4)
+
+        self.assertEquals(sum(VoteShard.objects.values_list('votes', flat=True)), 20)
+        self.assertTrue(VoteShard.objects.count() <= 4)
+        self.assertEquals(Choice.objects.get(pk=self.choice.id).votes, 3)
+
+        self.assertEquals(compact_shards(), 20)
+        self.assertEquals(Choice.objects.get(pk=self.choice.id).votes, 23)
+        self.assertEquals(Poll.objects.get(pk=self.poll.id).total_votes(), 24)
+        self.assertEquals(sum(VoteShard.objects.values_list('votes', flat=True)), 0)
+        self.assertEquals(compact_shards(), 0)
+
+    def test_rejects_choice_from_another_poll(self):
+        other_poll = Poll(question="time", pub_date=timezone.now())
+        other_poll.save()
+
+        self.assertRaises(Choice.DoesNotExist, record_sharded_vote, other_poll.id, self.choice.id, 4)
+        self.assertFalse(VoteShard.objects.exists())
+
+    def test_readers_see_sharded_votes_before_compaction(self):
+        self.client.post("/poll/%d/" % self.poll.id, data={'vote': str(self.choice.id)})
+        self.client.post("/poll/%d/" % self.poll.id, data={'vote': str(self.other.id)})
+
+        poll = Poll.objects.get_with_choices(self.poll.id)
+        self.assertEquals(poll.total_votes(), 6)
+        self.assertEquals([c.votes for c in poll.choice_set.all()], [4, 2])
+        self.assertEquals([c.percentage() for c in poll.choice_set.all()], [400 / 6.0, 200 / 6.0])
+        response = self.client.get("/poll/%d/" % self.poll.id)
+        self.assertIn("6 votes", response.content)
+
+    def test_results_etag_moves_with_sharded_votes_and_compaction(self):
+        url = "/poll/%d/results/" % self.poll.id
+        etags = [self.client.get(url)['ETag']]
+        record_sharded_vote(self.poll.id, self.choice.id, 4)
+        etags.append(self.client.get(url)['ETag'])
+        compact_shards()
+        response = self.client.get(url)
+        etags.append(response['ETag'])
+
+        self.assertEquals(len(set(etags)), 3)
+        self.assertEquals(json.loads(response.content)['total_votes'], 5)
+
+    def test_shard_sums_are_cached_until_a_vote_or_compaction(self):
+        record_sharded_vote(self.poll.id, self.choice.id, 4)
+        self.assertEquals(VoteShard.pending_votes([self.poll.id]), {self.poll.id: {self.choice.id: 1}})
+        url = "/poll/%d/results/" % self.poll.id
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+            Poll.objects.get_with_choices(self.poll.id)
+        self.assertFalse([q for q in queries.captured_queries if 'polls_voteshard' in q['sql']])
+
+        record_sharded_vote(self.poll.id, self.other.id, 4)
+        self.assertEquals(VoteShard.pending_votes([self.poll.id])[self.poll.id], {self.choice.id: 1, self.other.id: 1})
+        compact_shards()
+        self.assertEquals(VoteShard.pending_votes([self.poll.id]), {self.poll.id: {}})
+
+class ConcurrentVoteTest(TransactionTestCase):
+    voters = 20
+    votes_each = 100
+
+    def run_voters(self, vote):
+        poll = Poll(question="6 times 7", pub_date=timezone.now())
+        poll.save()
+        choice = Choice(poll=poll, choice="42")
+        choice.save()
+        errors = []
+
+        def voter():
+            try:
+                for _ in range(self.votes_each):
+                    vote(poll.id, choice.id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=voter) for _ in range(self.voters)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(errors, [])
+        return poll, choice
+
+    def test_no_votes_are_lost_under_concurrent_voting(self):
+        poll, choice = self.run_voters(record_vote)
+
+        self.assertEquals(Choice.objects.get(pk=choice.id).votes, self.voters * self.votes_each)
+        self.assertEquals(Poll.objects.get(pk=poll.id).total_votes(), self.voters * self.votes_each)
+
+    def test_no_votes_are_lost_under_concurrent_sharded_voting(self):
+        poll, choice = self.run_voters(lambda poll_id, choice_id: record_sharded_vote(poll_id, choice_id, 4))
+        compact_shards()
+
+        self.assertEquals(Choice.objects.get(pk=choice.id).votes, self.voters * self.votes_each)
+        self.assertEquals(Poll.objects.get(pk=poll.id).total_votes(), self.voters * self.votes_each)
@@ -0,0 +1,290 @@
+"""
+The hot polls leaderboard.
+
+Every vote adds to its poll's score, and scores decay with a half-life of
+POLLS_TRENDING_HALF_LIFE seconds, so a poll is hot while people are
+voting on it now rather than for how many votes it has ever had.
+
+Decaying every score as time passes would mean touching all of them.
+Instead a vote at time t is worth 2 ** (t / half-life): newer votes are
+worth exponentially more, which ranks polls exactly as decaying the old
+ones would. To keep the weights within a float, time is split into eras
+of ERA_HALF_LIVES half-lives, weights count from the start of the
+current era, and scores are scaled down once whenever a new one begins.
+
+Each process keeps the POLLS_TRENDING_SIZE highest scores in memory,
+updated as votes are cast, so reading the top of the board doesn't touch
+the database beyond looking up the questions of polls new to it. When a
+vote arrives for a poll that isn't on a full board, it replaces the
+lowest score and inherits it (the Space-Saving algorithm), so a poll
+that's getting votes can't be kept out by polls that were hot a while
+ago.
+
+With POLLS_TRENDING_SAVE_INTERVAL set, a background thread adds what the
+process has counted to the TrendingPoll table that often, and reloads the
+board from there. That's how processes see each other's votes, and how
+the board survives a restart.
+"""
+import atexit
+import heapq
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from polls.models import Poll, TrendingPoll
+
+logger = logging.getLogger(__name__)
+
+ERA_HALF_LIVES = 64
+
+HotPoll = namedtuple('HotPoll', ['id', 'question', 'score'])
+
+
+class Leaderboard(object):
+    """
+    The ``size`` polls with the highest decayed vote counts.
+    """
+
+    def __init__(self, size, half_life, save_interval=None):
+        self.size = size
+        self.half_life = float(half_life)
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._era = None
+        # poll id -> score, in the current era's units
+        self._scores = {}
+        # poll id -> score counted here and not yet saved
+        self._pending = {}
+        # poll id -> question, for the polls on the board
+        self._questions = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _era_length(self):
+        return ERA_HALF_LIVES * self.half_life
+
+    def _rebase(self, now):
+        # Called with the lock held.
+        era = int(now // self._era_length())
+        if self._era is not None and era != self._era:
+            factor = 2.0 ** (-ERA_HALF_LIVES * (era - self._era))
+            for scores in (self._scores, self._pending):
+                for poll_id in scores:
+                    scores[poll_id] *= factor
+        self._era = era
+
+    def _weight(self, now):
+        return 2.0 ** ((now - self._era * self._era_length()) / self.half_life)
+
+    def add(self, poll_id, votes=1, now=None):
+        """
+        Count ``votes`` votes for a poll, cast at ``now`` (defaults to the
+        current time).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._rebase(now)
+            increment = votes * self._weight(now)
+            self._pending[poll_id] = self._pending.get(poll_id, 0) + increment
+            if poll_id in self._scores or len(self._scores) < self.size:
+                self._scores[poll_id] = self._scores.get(poll_id, 0) + increment
+            else:
+                lowest = min(self._scores, key=self._scores.get)
+                self._scores[poll_id] = self._scores.pop(lowest) + increment
+                self._pending.pop(lowest, None)
+                self._questions.pop(lowest, None)
+            if self.save_interval and self._thread is None and not self._stopping.is_set():
+                self._start()
+
+    def top(self, n, now=None):
+        """
+        The ``n`` highest [(poll_id, score)], best first, scores being
+        votes decayed to ``now``.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._rebase(now)
+            decay = 1 / self._weight(now)
+            return [(poll_id, score * decay)
+                    for poll_id, score in heapq.nlargest(n, self._scores.items(), key=lambda item: item[1])]
+
+    def hot_polls(self, n, now=None):
+        """
+        The top ``n`` polls as HotPolls. Questions are remembered for as long
+        as a poll stays on the board, so this only queries the database for
+        polls that have just arrived on it.
+        """
+        top = self.top(n, now)
+        missing = [poll_id for poll_id, _ in top if poll_id not in self._questions]
+        if missing:
+            questions = dict(Poll.objects.filter(id__in=missing).values_list('id', 'question'))
+            with self._lock:
+                for poll_id in missing:
+                    if poll_id in questions:
+                        self._questions[poll_id] = questions[poll_id]
+                    else:
+                        # Deleted since.
+                        self._forget(poll_id)
+        return [HotPoll(poll_id, self._questions[poll_id], score)
+                for poll_id, score in top if poll_id in self._questions]
+
+    def question_changed(self, poll_id):
+        with self._lock:
+            self._questions.pop(poll_id, None)
+
+    def forget(self, poll_id):
+        with self._lock:
+            self._forget(poll_id)
+
+    def _forget(self, poll_id):
+        for mapping in (self._scores, self._pending, self._questions):
+            mapping.pop(poll_id, None)
+
+    def save(self, now=None):
+        """
+        Add the scores counted here since the last save to TrendingPoll,
+        trim the table to the board's size and reload the board from it.
+        Returns how many polls' scores were saved.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._rebase(now)
+            era = self._era
+            pending, self._pending = self._pending, {}
+        try:
+            with transaction.atomic():
+                TrendingPoll.objects.filter(era__lt=era - 1).delete()
+                TrendingPoll.objects.filter(era=era - 1).update(
+                    score=F('score') * 2.0 ** -ERA_HALF_LIVES, era=era)
+                for poll_id, score in pending.items():
+                    _add_score(poll_id, score, era)
+                cutoff = TrendingPoll.objects.order_by('-score').values_list('score', flat=True)[self.size - 1:self.size]
+                if cutoff:
+                    TrendingPoll.objects.filter(score__lt=cutoff[0]).delete()
+                saved = list(TrendingPoll.objects.values_list('poll', 'score', 'era', 'poll__question'))
+        except Exception:
+            with self._lock:
+                for poll_id, score in pending.items():
+                    self._pending[poll_id] = self._pending.get(poll_id, 0) + score
+            raise
+        self._load(saved, era)
+        return len(pending)
+
+    def load(self, now=None):
+        """
+        Replace the board with what's in TrendingPoll.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._rebase(now)
+            era = self._era
+        self._load(
+            TrendingPoll.objects.filter(era__gte=era - 1).values_list('poll', 'score', 'era', 'poll__question'), era)
+
+    def _load(self, rows, era):
+        rows = list(rows)
+        with self._lock:
+            if era != self._era:
+                # A new era began meanwhile; the next save will catch up.
+                return
+            scores = dict(
+                (poll_id, score * 2.0 ** (-ERA_HALF_LIVES * (era - row_era)))
+                for poll_id, score, row_era, _ in rows)
+            # Votes counted since the save are on top of what was saved.
+            for poll_id, score in self._pending.items():
+                scores[poll_id] = scores.get(poll_id, 0) + score
+            self._scores = dict(heapq.nlargest(self.size, scores.items(), key=lambda item: item[1]))
+            self._questions = dict((poll_id, question) for poll_id, _, _, question in rows if poll_id in self._scores)
+
+    def stop(self):
+        """
+        Stop the background thread and save what's left.
+        """
+        with self._lock:
+            self._stopping.set()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+            try:
+                self.save()
+            except Exception:
+                logger.exception("Failed to save the hot polls leaderboard")
+
+    def _start(self):
+        # Called with the lock held.
+        self._thread = threading.Thread(target=self._run, name='trending')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        try:
+            while not self._stopping.wait(self.save_interval):
+                try:
+                    self.save()
+                except Exception:
+                    logger.exception("Failed to save the hot polls leaderboard; will retry")
+        finally:
+            connection.close()
+
+
+def _add_score(poll_id, score, era):
+    if TrendingPoll.objects.filter(poll=poll_id).update(score=F('score') + score):
+        return
+    try:
+        with transaction.atomic():
+            TrendingPoll.objects.create(poll_id=poll_id, score=score, era=era)
+    except IntegrityError:
+        TrendingPoll.objects.filter(poll=poll_id).update(score=F('score') + score)
+
+
+_leaderboard = None
+_leaderboard_lock = threading.Lock()
+
+
+def get_leaderboard():
+    """
+    Return the process-wide Leaderboard, or None if it's turned off
+    (POLLS_TRENDING_SIZE is None). If it's saved, it starts off with
+    what's in TrendingPoll.
+    """
+    global _leaderboard
+    size = getattr(settings, 'POLLS_TRENDING_SIZE', None)
+    if not size:
+        return None
+    with _leaderboard_lock:
+        if _leaderboard is None:
+            save_interval = getattr(settings, 'POLLS_TRENDING_SAVE_INTERVAL', None)
+            leaderboard = Leaderboard(size, settings.POLLS_TRENDING_HALF_LIFE, save_interval)
+            if save_interval:
+                leaderboard.load()
+            _leaderboard = leaderboard
+    return _leaderboard
+
+
+def forget_all():
+    """
+    Drop the process-wide Leaderboard without saving it.
+    """
+    global _leaderboard
+    with _leaderboard_lock:
+        _leaderboard = None
+
+
+@receiver(post_save, sender=Poll)
+def poll_saved(sender, instance, **kwargs):
+    if _leaderboard is not None:
+        _leaderboard.question_changed(instance.id)
+
+
+@receiver(post_delete, sender=Poll)
+def poll_deleted(sender, instance, **kwargs):
+    if _leaderboard is not None:
+        _leaderboard.forget(instance.id)
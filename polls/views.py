@@ -1,21 +1,193 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import render
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseRedirect, Http404, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
 
-from polls.models import Poll, Choice
+from mysite.replicas import pinned_to_primary, use_primary
+from polls.models import Poll, Choice, VoteShard, add_shared_votes
+from polls.caching import CACHE_TIMEOUT, poll_key, poll_list_key
 from polls.forms import PollVoteForm
+from polls import dedup, export, fastvote, ingest, loading, search
+from polls.pagination import keyset_page
+from polls.sharedcounts import get_shared_counters
+from polls.trending import get_leaderboard
+
+POLLS_PER_PAGE = 20
+HOT_POLLS = 5
 
 def home(request):
-    context = {'polls': Poll.objects.all()}
+    query = request.GET.get('q', '').strip()
+    if query:
+        return render(request, 'home.html', {'polls': search.search(query), 'query': query})
+
+    after = request.GET.get('after')
+    key = poll_list_key(after)
+    # Clients that just wrote something skip the cache too, which may hold
+    # what a lagging replica said before the write.
+    context = None if pinned_to_primary() else cache.get(key)
+    if context is None:
+        # Whatever's cached is served to everyone for CACHE_TIMEOUT, so fill
+        # it from the primary rather than a replica that may be behind.
+        try:
+            with use_primary():
+                polls, next_page = keyset_page(Poll.objects.all(), after, POLLS_PER_PAGE)
+        except ValueError:
+            raise Http404
+        context = {'polls': polls, 'next_page': next_page}
+        cache.set(key, context, CACHE_TIMEOUT)
+    # Read from memory on every request; it moves with every vote.
+    leaderboard = get_leaderboard()
+    if leaderboard is not None and not after:
+        context = dict(context, hot_polls=leaderboard.hot_polls(HOT_POLLS))
     return render(request, 'home.html', context)
 
 def poll(request, poll_id):
     if request.method == "POST":
-        choice = Choice.objects.get(id=request.POST['vote'])
-        choice.votes += 1
-        choice.save()
+        try:
+            if not dedup.cast_vote_once(int(poll_id), int(request.POST['vote']), request):
+                return HttpResponse(dedup.ALREADY_VOTED, status=403)
+        except (KeyError, ValueError, Choice.DoesNotExist):
+            raise Http404
         return HttpResponseRedirect(reverse('polls.views.poll', args=[poll_id, ]))
 
-    poll = Poll.objects.get(pk=poll_id)
+    poll = None if pinned_to_primary() else cache.get(poll_key(poll_id))
+    if poll is None:
+        with use_primary():
+            poll = Poll.objects.get_with_choices(poll_id, shared_votes=False)
+        cache.set(poll_key(poll_id), poll, CACHE_TIMEOUT)
+    # Votes in shared memory are counted by every process, but a vote only
+    # clears the cache of the process that took it, so they're added on
+    # top of the cached poll and the rendered results aren't cached.
+    add_shared_votes(poll)
     form = PollVoteForm(poll=poll)
-    return render(request, 'poll.html', {'poll': poll, 'form': form})
+    return render(request, 'poll.html', {
+        'poll': poll,
+        'form': form,
+        'cache_timeout': 0 if get_shared_counters() is not None else CACHE_TIMEOUT,
+        'vote_token': fastvote.vote_token(poll.id, request),
+    })
+
+@csrf_exempt
+def vote(request, poll_id):
+    """
+    The lean vote endpoint, for when mysite.wsgi's FastVoteApplication
+    isn't in front to answer it. It does its own CSRF check.
+    """
+    return fastvote.vote(request, int(poll_id))
+
+def _results_etag(request, poll_id):
+    versions = Poll.objects.filter(pk=poll_id).values_list('version', flat=True)
+    if not versions:
+        return None
+    etag = '%s-%s' % (poll_id, versions[0])
+    if getattr(settings, 'POLLS_VOTE_SHARDS', None):
+        # Votes in shards don't touch the poll until they're compacted.
+        sharded = sum(VoteShard.pending_votes([int(poll_id)])[int(poll_id)].values())
+        if sharded:
+            etag += '-%s' % sharded
+    counters = get_shared_counters()
+    if counters is not None:
+        # Votes in shared memory don't touch the poll until they're flushed.
+        etag += '-%x-%s' % (counters.file_id & 0xffffffff, counters.poll_counted(int(poll_id)))
+    return etag
+
+@require_GET
+# No Last-Modified: HTTP dates only go to the second, so a client going
+# by one would miss a vote cast in the same second as its last fetch.
+@condition(etag_func=_results_etag)
+def poll_results(request, poll_id):
+    """
+    A poll's results as JSON. Clients that send back the ETag they were
+    given get a 304 from a single lookup of the poll's version until
+    someone votes or the poll is edited.
+    """
+    try:
+        poll = Poll.objects.get_with_choices(poll_id)
+    except Poll.DoesNotExist:
+        raise Http404
+    results = {
+        'id': poll.id,
+        'question': poll.question,
+        'total_votes': poll.total_votes(),
+        'choices': [{
+            'id': choice.id,
+            'choice': choice.choice,
+            'votes': choice.votes,
+            'percentage': choice.percentage(),
+        } for choice in poll.choice_set.all()],
+    }
+    return HttpResponse(json.dumps(results), content_type='application/json')
+
+def _check_import_token(request):
+    """
+    A 403 response unless the request carries
+    "Authorization: Token <POLLS_IMPORT_TOKEN>", or None if it does.
+    Raises Http404 while that setting is unset.
+    """
+    token = getattr(settings, 'POLLS_IMPORT_TOKEN', None)
+    if not token:
+        raise Http404
+    if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Token ' + token):
+        return HttpResponse(status=403)
+    return None
+
+@csrf_exempt
+@require_POST
+def import_votes(request):
+    """
+    Apply a batch of votes POSTed as JSONL, or as CSV with a text/csv
+    Content-Type. The body is streamed rather than read into memory.
+
+    Callers authenticate with "Authorization: Token <POLLS_IMPORT_TOKEN>";
+    the endpoint doesn't exist while that setting is unset.
+    """
+    forbidden = _check_import_token(request)
+    if forbidden:
+        return forbidden
+
+    format = 'csv' if request.META.get('CONTENT_TYPE', '').startswith('text/csv') else 'jsonl'
+    accepted, rejected, seconds = ingest.import_votes(ingest.read_votes(request, format))
+    rows = accepted + rejected
+    return HttpResponse(json.dumps({
+        'accepted': accepted,
+        'rejected': rejected,
+        'rows_per_second': rows / seconds if seconds else rows,
+    }), content_type='application/json')
+
+@csrf_exempt
+@require_POST
+def import_polls(request):
+    """
+    Create the polls POSTed as JSONL, one per line with its choices (see
+    polls.loading). The body is streamed rather than read into memory.
+    Authenticated like import_votes.
+    """
+    forbidden = _check_import_token(request)
+    if forbidden:
+        return forbidden
+
+    polls, choices, rejected, seconds = loading.create_polls(loading.read_polls(request))
+    rows = polls + choices
+    return HttpResponse(json.dumps({
+        'polls': polls,
+        'choices': choices,
+        'rejected': rejected,
+        'rows_per_second': rows / seconds if seconds else rows,
+    }), content_type='application/json')
+
+@staff_member_required
+def export_results(request, format):
+    """
+    Every poll's results as a CSV or JSONL download, streamed as it's read.
+    """
+    response = StreamingHttpResponse(
+        export.export_results(format), content_type=export.CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename="results.%s"' % format
+    return response
@@ -0,0 +1,739 @@
+import atexit
+import logging
+import random
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from polls.caching import invalidate_poll
+from polls.models import Poll, Choice, SharedVoteCheckpoint, Voter, VoteEvent, VoteShard
+from polls.rollups import MINUTE, truncate
+from polls.sharedcounts import get_shared_counters
+from polls.trending import get_leaderboard
+
+logger = logging.getLogger(__name__)
+
+VoteTotals = namedtuple('VoteTotals', ['choice_votes', 'poll_votes'])
+
+
+class AlreadyVoted(Exception):
+    """
+    The voter a vote was cast for has already voted on the poll.
+    """
+
+# add_votes() spends three query parameters per row; this keeps each
+# statement under SQLite's default limit of 999.
+BATCH_SIZE = 300
+
+
+def _can_return_rows():
+    # UPDATE ... RETURNING lets us hand back the new count without a
+    # second query. SQLite only grew it in 3.35.
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def _touch_poll():
+    """
+    SET clause fragment and its params marking a poll's results as
+    changed, which moves on the ETag of its JSON results.
+    """
+    qn = connection.ops.quote_name
+    return (
+        "%s = %s + 1, %s = %%s" % (qn('version'), qn('version'), qn('modified')),
+        [connection.ops.value_to_db_datetime(timezone.now())],
+    )
+
+
+def _increment(model, field, filters, also=('', [])):
+    """
+    Add one to ``field`` on the row of ``model`` matching ``filters`` and
+    return its new value, or None if no row matched. ``also`` is an extra
+    SET clause fragment and params to apply in the same statement.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = sorted(filters)
+    where = " AND ".join("%s = %%s" % qn(column) for column in columns)
+    params = [filters[column] for column in columns]
+    also_sql, also_params = also
+    sql = "UPDATE %s SET %s = %s + 1%s WHERE %s" % (
+        table, qn(field), qn(field), ", " + also_sql if also_sql else "", where,
+    )
+
+    cursor = connection.cursor()
+    if _can_return_rows():
+        cursor.execute(sql + " RETURNING " + qn(field), also_params + params)
+        rows = cursor.fetchall()
+        return rows[0][0] if rows else None
+
+    cursor.execute(sql, also_params + params)
+    if not cursor.rowcount:
+        return None
+    cursor.execute("SELECT %s FROM %s WHERE %s" % (qn(field), table, where), params)
+    return cursor.fetchone()[0]
+
+
+def record_vote(poll_id, choice_id, voter=None):
+    """
+    Add a single vote to a choice and return the new VoteTotals for the
+    choice and its poll.
+
+    Both counters are incremented inside the database in one
+    transaction, so concurrent voters can't overwrite each other's votes,
+    and the vote is logged with log_vote(). With ``voter``, a Voter is
+    inserted in the same transaction. Raises Choice.DoesNotExist if the
+    choice doesn't belong to the poll, and AlreadyVoted if the voter has
+    voted on it before.
+    """
+    with transaction.atomic():
+        if voter is not None:
+            _add_voter(poll_id, voter)
+        choice_votes = _increment(Choice, 'votes', {'id': choice_id, 'poll_id': poll_id})
+        if choice_votes is None:
+            raise Choice.DoesNotExist
+        poll_votes = _increment(Poll, 'vote_count', {'id': poll_id}, also=_touch_poll())
+        event_log = log_vote(poll_id, choice_id)
+    if event_log is not None:
+        event_log.add(poll_id, choice_id)
+    invalidate_poll(poll_id)
+    return VoteTotals(choice_votes, poll_votes)
+
+
+def log_vote(poll_id, choice_id):
+    """
+    Log a vote as a VoteEvent, from inside the transaction that counts it.
+
+    With POLLS_VOTE_EVENT_INTERVAL set, nothing is written here: the
+    process's EventLog is returned, for the caller to add the vote to once
+    the transaction has committed. Otherwise the event is inserted now and
+    None is returned.
+    """
+    event_log = get_event_log()
+    if event_log is None:
+        VoteEvent.objects.create(poll_id=poll_id, choice_id=choice_id, created=timezone.now())
+    return event_log
+
+
+def _add_voter(poll_id, voter):
+    # Left to the caller's transaction, which AlreadyVoted rolls back.
+    try:
+        Voter.objects.create(poll_id=poll_id, voter=voter)
+    except IntegrityError:
+        raise AlreadyVoted
+
+
+def _record_voters(voters):
+    """
+    Insert a Voter for each of ``voters``, a list of (poll_id, voter)
+    pairs, except those already in the database, which are returned.
+    They voted twice before either Voter was written. Called in a
+    transaction.
+    """
+    keys = sorted(voters)
+    existing = set()
+    for start in range(0, len(keys), BATCH_SIZE):
+        batch = keys[start:start + BATCH_SIZE]
+        existing.update(Voter.objects.filter(
+            poll__in=set(poll_id for poll_id, _ in batch),
+            voter__in=[voter for _, voter in batch],
+        ).values_list('poll', 'voter'))
+    Voter.objects.bulk_create([
+        Voter(poll_id=poll_id, voter=voter) for poll_id, voter in keys if (poll_id, voter) not in existing
+    ])
+    return [key for key in keys if key in existing]
+
+
+def record_sharded_vote(poll_id, choice_id, shards, voter=None):
+    """
+    Add a single vote to one of ``shards`` VoteShards for the choice,
+    picked at random, rather than to the choice and poll themselves, so
+    concurrent voters on the same choice mostly update different rows.
+    compact_shards() folds the shards back in.
+
+    ``voter`` and the exceptions raised are as for record_vote().
+    """
+    filters = {'choice_id': choice_id, 'poll_id': poll_id, 'shard': random.randrange(shards)}
+    with transaction.atomic():
+        if voter is not None:
+            _add_voter(poll_id, voter)
+        if _increment(VoteShard, 'votes', filters) is None:
+            # First vote on this shard.
+            if not Choice.objects.filter(id=choice_id, poll_id=poll_id).exists():
+                raise Choice.DoesNotExist
+            try:
+                with transaction.atomic():
+                    VoteShard.objects.create(votes=1, **filters)
+            except IntegrityError:
+                _increment(VoteShard, 'votes', filters)
+        event_log = log_vote(poll_id, choice_id)
+    if event_log is not None:
+        event_log.add(poll_id, choice_id)
+    invalidate_poll(poll_id)
+
+
+def compact_shards():
+    """
+    Move the votes waiting in VoteShards into Choice.votes and
+    Poll.vote_count, in one transaction, and return how many there were.
+
+    Each shard has what was read from it subtracted rather than being
+    reset, so votes that land on it meanwhile aren't lost.
+    """
+    with transaction.atomic():
+        shards = list(VoteShard.objects.filter(votes__gt=0).values_list('id', 'poll', 'choice', 'votes'))
+        if not shards:
+            return 0
+        choice_votes = {}
+        poll_votes = {}
+        for _, poll_id, choice_id, votes in shards:
+            choice_votes[choice_id] = choice_votes.get(choice_id, 0) + votes
+            poll_votes[poll_id] = poll_votes.get(poll_id, 0) + votes
+        _add_to_column(VoteShard, 'votes', dict((pk, -votes) for pk, _, _, votes in shards))
+        _add_to_column(Choice, 'votes', choice_votes)
+        _add_to_column(Poll, 'vote_count', poll_votes, also=_touch_poll())
+    for poll_id in poll_votes:
+        invalidate_poll(poll_id)
+    return sum(choice_votes.values())
+
+
+_shared_choices = {}
+
+
+def record_shared_vote(counters, poll_id, choice_id, voter=None):
+    """
+    Count a vote in the SharedCounters ``counters``, for
+    flush_shared_votes() to move to the database later, or with
+    record_vote() if its ids don't fit in them. ``voter``'s Voter is
+    written by the process's VoterLog if it has one, and straight away
+    otherwise.
+
+    Raises Choice.DoesNotExist if the choice doesn't belong to the poll,
+    and AlreadyVoted if the voter has voted on it before.
+    """
+    if not counters.fits(poll_id, choice_id):
+        record_vote(poll_id, choice_id, voter)
+        return
+    # Which poll each choice belongs to never changes, so it's only
+    # checked once per process.
+    if _shared_choices.get(choice_id) != poll_id:
+        if not Choice.objects.filter(id=choice_id, poll_id=poll_id).exists():
+            raise Choice.DoesNotExist
+        _shared_choices[choice_id] = poll_id
+    if voter is not None:
+        voter_log = get_voter_log()
+        if voter_log is not None:
+            voter_log.add(poll_id, choice_id, voter)
+        else:
+            with transaction.atomic():
+                _add_voter(poll_id, voter)
+    counters.add(poll_id, choice_id)
+    invalidate_poll(poll_id)
+
+
+def recover_shared_votes(counters):
+    """
+    Start flushing ``counters`` from the checkpoints in the database; see
+    SharedCounters.recover().
+    """
+    counters.recover(dict(SharedVoteCheckpoint.objects.filter(
+        file_id=counters.file_id).values_list('choice', 'counted')))
+
+
+def flush_shared_votes(counters):
+    """
+    Move the votes waiting in ``counters`` into the database with
+    add_votes(), checkpointing them in the same transaction, and return
+    how many there were. Only the one process that has called
+    counters.become_flusher() and recover_shared_votes() may call this.
+    """
+    waiting = counters.collect()
+    if not waiting:
+        return 0
+    choice_ids = sorted(waiting)
+    polls = {}
+    for start in range(0, len(choice_ids), BATCH_SIZE):
+        polls.update(Choice.objects.filter(
+            id__in=choice_ids[start:start + BATCH_SIZE]).values_list('id', 'poll'))
+    # Votes for choices deleted since are dropped.
+    votes = dict(
+        ((polls[choice_id], choice_id), counted - flushed)
+        for choice_id, (counted, flushed) in waiting.items() if choice_id in polls)
+
+    with transaction.atomic():
+        if votes:
+            add_votes(votes)
+        for start in range(0, len(choice_ids), BATCH_SIZE):
+            SharedVoteCheckpoint.objects.filter(choice__in=choice_ids[start:start + BATCH_SIZE]).delete()
+        SharedVoteCheckpoint.objects.bulk_create([
+            SharedVoteCheckpoint(choice_id=choice_id, file_id=counters.file_id, counted=waiting[choice_id][0])
+            for choice_id in choice_ids if choice_id in polls
+        ])
+    counters.mark_flushed(dict((choice_id, waiting[choice_id][0]) for choice_id in choice_ids))
+    # Again, now that the votes aren't counted twice any more.
+    for poll_id in set(polls.values()):
+        invalidate_poll(poll_id)
+    return sum(votes.values())
+
+
+def add_votes(votes, events=None):
+    """
+    Apply a batch of votes, given as a mapping of (poll_id, choice_id) to
+    the number of votes to add, in one transaction.
+
+    Each table gets one UPDATE per BATCH_SIZE rows rather than one per
+    vote, and the vote log one bulk INSERT. The votes are logged as cast
+    now, unless ``events`` says when they were, as a mapping of (poll_id,
+    choice_id, created) to votes that adds up to the same. The pairs are
+    trusted: callers must already have checked that each choice belongs
+    to its poll.
+    """
+    choice_votes = {}
+    poll_votes = {}
+    for (poll_id, choice_id), count in votes.items():
+        choice_votes[choice_id] = choice_votes.get(choice_id, 0) + count
+        poll_votes[poll_id] = poll_votes.get(poll_id, 0) + count
+
+    if events is None:
+        now = timezone.now()
+        events = dict(((poll_id, choice_id, now), count) for (poll_id, choice_id), count in votes.items())
+    with transaction.atomic():
+        _add_to_column(Choice, 'votes', choice_votes)
+        _add_to_column(Poll, 'vote_count', poll_votes, also=_touch_poll())
+        _log_events(events)
+    for poll_id in poll_votes:
+        invalidate_poll(poll_id)
+
+
+def _log_events(events):
+    VoteEvent.objects.bulk_create([
+        VoteEvent(poll_id=poll_id, choice_id=choice_id, votes=count, created=created)
+        for (poll_id, choice_id, created), count in events.items()
+    ])
+
+
+def _add_to_column(model, field, increments, also=('', [])):
+    qn = connection.ops.quote_name
+    also_sql, also_params = also
+    cursor = connection.cursor()
+    ids = sorted(increments)
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        sql = "UPDATE %s SET %s = %s + CASE %s %s END%s WHERE %s IN (%s)" % (
+            qn(model._meta.db_table), qn(field), qn(field), qn('id'),
+            " ".join(["WHEN %s THEN %s"] * len(batch)),
+            ", " + also_sql if also_sql else "",
+            qn('id'), ", ".join(["%s"] * len(batch)),
+        )
+        params = []
+        for pk in batch:
+            params.extend([pk, increments[pk]])
+        cursor.execute(sql, params + also_params + batch)
+
+
+def _existing_choices(votes):
+    # The (poll_id, choice_id) pairs of ``votes`` whose choices still exist.
+    choice_ids = sorted(set(choice_id for _, choice_id in votes))
+    existing = set()
+    for start in range(0, len(choice_ids), BATCH_SIZE):
+        existing.update(Choice.objects.filter(
+            id__in=choice_ids[start:start + BATCH_SIZE]).values_list('poll', 'id'))
+    return existing
+
+
+def _drop_deleted_choices(events):
+    # ``events`` maps (poll_id, choice_id, minute) to votes.
+    existing = _existing_choices(set(key[:2] for key in events))
+    dropped = [key for key in events if key[:2] not in existing]
+    if dropped:
+        logger.warning("Dropping %d buffered votes for deleted choices %s",
+                       sum(events[key] for key in dropped), sorted(set(key[1] for key in dropped)))
+    return dict((key, count) for key, count in events.items() if key[:2] in existing)
+
+
+class VoteBuffer(object):
+    """
+    Write-behind buffer for votes.
+
+    Votes are counted in memory and a background thread writes them out
+    with add_votes() every ``interval`` seconds, so a burst of voters
+    costs one write transaction per interval instead of one each. Anything
+    still buffered is flushed by stop(), which runs at interpreter exit.
+    Votes are lost only if the process dies without exiting normally.
+
+    Votes are counted per choice per minute, so the vote log has them as
+    cast when they were added rather than when they were flushed. The
+    Voters of deduplicated votes are buffered with them and written in the
+    same transaction.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (poll id, choice id, minute) -> votes
+        self._pending = {}
+        # (poll id, voter) -> (choice id, minute)
+        self._voters = {}
+        # choice id -> poll id for choices already checked against the db
+        self._known_choices = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add(self, poll_id, choice_id, voter=None):
+        """
+        Buffer one vote, by ``voter`` if given. Raises Choice.DoesNotExist
+        if the choice doesn't belong to the poll, and AlreadyVoted if the
+        voter already has a vote in the buffer.
+        """
+        if self._known_choices.get(choice_id) != poll_id:
+            if not Choice.objects.filter(id=choice_id, poll_id=poll_id).exists():
+                raise Choice.DoesNotExist
+            self._known_choices[choice_id] = poll_id
+
+        minute = truncate(timezone.now(), MINUTE)
+        with self._lock:
+            if self._stopping.is_set():
+                # Too late to buffer; nobody would flush it.
+                record_vote(poll_id, choice_id, voter)
+                return
+            if voter is not None:
+                if (poll_id, voter) in self._voters:
+                    raise AlreadyVoted
+                self._voters[poll_id, voter] = (choice_id, minute)
+            key = (poll_id, choice_id, minute)
+            self._pending[key] = self._pending.get(key, 0) + 1
+            if self._thread is None:
+                self._start()
+
+    def forget_choice(self, choice_id):
+        self._known_choices.pop(choice_id, None)
+
+    def flush(self):
+        """
+        Write every buffered vote to the database, returning how many there
+        were. Votes are put back in the buffer if the write fails. Votes
+        for choices deleted since they were buffered are dropped, and so
+        are votes by voters who turn out to have voted already.
+        """
+        with self._lock:
+            buffered, self._pending = self._pending, {}
+            voters, self._voters = self._voters, {}
+        if not buffered:
+            return 0
+        try:
+            events = _drop_deleted_choices(buffered)
+            voters = dict((key, vote) for key, vote in voters.items() if (key[0],) + vote in events)
+            with transaction.atomic():
+                for poll_id, voter in _record_voters(voters):
+                    events[(poll_id,) + voters[poll_id, voter]] -= 1
+                events = dict((key, count) for key, count in events.items() if count)
+                pending = {}
+                for (poll_id, choice_id, _), count in events.items():
+                    pending[poll_id, choice_id] = pending.get((poll_id, choice_id), 0) + count
+                add_votes(pending, events)
+        except Exception:
+            with self._lock:
+                for key, count in buffered.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+                self._voters.update(voters)
+            raise
+        return sum(pending.values())
+
+    def stop(self):
+        """
+        Stop the background thread and flush whatever is left.
+        """
+        with self._lock:
+            self._stopping.set()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='vote-buffer')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        try:
+            while not self._stopping.wait(self.interval):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Failed to flush buffered votes; will retry")
+        finally:
+            connection.close()
+
+
+class EventLog(object):
+    """
+    Write-behind buffer for the vote log.
+
+    Votes counted one at a time are added here rather than each inserting
+    a VoteEvent. They're counted per choice per minute, the finest
+    rollup, and a background thread writes what has built up every
+    ``interval`` seconds as one bulk INSERT. stop() writes the rest at
+    interpreter exit. If the process dies without exiting normally, the
+    votes are still counted, but the rollups miss up to ``interval``
+    seconds of them.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (poll id, choice id, minute) -> votes
+        self._pending = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add(self, poll_id, choice_id, votes=1, when=None):
+        key = (poll_id, choice_id, truncate(when or timezone.now(), MINUTE))
+        with self._lock:
+            if self._stopping.is_set():
+                # Too late to buffer; nobody would write it.
+                _log_events({key: votes})
+                return
+            self._pending[key] = self._pending.get(key, 0) + votes
+            if self._thread is None:
+                self._start()
+
+    def flush(self):
+        """
+        Write the buffered events, returning how many votes they held.
+        They're put back if the write fails.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            _log_events(pending)
+        except Exception:
+            with self._lock:
+                for key, votes in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + votes
+            raise
+        return sum(pending.values())
+
+    def stop(self):
+        """
+        Stop the background thread and write whatever is left.
+        """
+        with self._lock:
+            self._stopping.set()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='vote-events')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        try:
+            while not self._stopping.wait(self.interval):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Failed to write the vote log; will retry")
+        finally:
+            connection.close()
+
+
+class VoterLog(object):
+    """
+    Write-behind buffer for the Voters of votes counted in shared memory.
+
+    Writing each one as its vote is counted would put a database write
+    back on every vote. Instead a background thread writes what has built
+    up every ``interval`` seconds, in one transaction. A voter who got a
+    second vote in meanwhile, through another process or host, has it
+    taken back off. stop() writes the rest at interpreter exit; if the
+    process dies without exiting normally, its voters can vote again.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (poll id, voter) -> choice id
+        self._pending = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add(self, poll_id, choice_id, voter):
+        """
+        Buffer a voter's Voter. Raises AlreadyVoted if they already have
+        one in the buffer.
+        """
+        with self._lock:
+            if self._stopping.is_set():
+                # Too late to buffer; nobody would write it.
+                with transaction.atomic():
+                    _add_voter(poll_id, voter)
+                return
+            if (poll_id, voter) in self._pending:
+                raise AlreadyVoted
+            self._pending[poll_id, voter] = choice_id
+            if self._thread is None:
+                self._start()
+
+    def flush(self):
+        """
+        Write the buffered Voters, returning how many there were. They're
+        put back if the write fails.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            existing = _existing_choices(set((key[0], choice_id) for key, choice_id in pending.items()))
+            with transaction.atomic():
+                repeats = {}
+                for poll_id, voter in _record_voters(
+                        [key for key, choice_id in pending.items() if (key[0], choice_id) in existing]):
+                    key = (poll_id, pending[poll_id, voter])
+                    repeats[key] = repeats.get(key, 0) + 1
+                if repeats:
+                    add_votes(dict((key, -count) for key, count in repeats.items()))
+        except Exception:
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        return len(pending)
+
+    def stop(self):
+        """
+        Stop the background thread and write whatever is left.
+        """
+        with self._lock:
+            self._stopping.set()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='voters')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        try:
+            while not self._stopping.wait(self.interval):
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Failed to write voters; will retry")
+        finally:
+            connection.close()
+
+
+_vote_buffer = None
+_vote_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """
+    Return the process-wide VoteBuffer, or None if buffering is turned off
+    (POLLS_VOTE_BUFFER_INTERVAL is None).
+    """
+    global _vote_buffer
+    interval = getattr(settings, 'POLLS_VOTE_BUFFER_INTERVAL', None)
+    if interval is None:
+        return None
+    with _vote_buffer_lock:
+        if _vote_buffer is None:
+            _vote_buffer = VoteBuffer(interval)
+    return _vote_buffer
+
+
+_event_log = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log():
+    """
+    Return the process-wide EventLog, or None if votes are logged as
+    they're counted (POLLS_VOTE_EVENT_INTERVAL is None).
+    """
+    global _event_log
+    interval = getattr(settings, 'POLLS_VOTE_EVENT_INTERVAL', None)
+    if interval is None:
+        return None
+    with _event_log_lock:
+        if _event_log is None:
+            _event_log = EventLog(interval)
+    return _event_log
+
+
+_voter_log = None
+_voter_log_lock = threading.Lock()
+
+
+def get_voter_log():
+    """
+    Return the process-wide VoterLog, or None if the Voters of votes
+    counted in shared memory are written as they're cast
+    (POLLS_VOTER_WRITE_INTERVAL is None).
+    """
+    global _voter_log
+    interval = getattr(settings, 'POLLS_VOTER_WRITE_INTERVAL', None)
+    if interval is None:
+        return None
+    with _voter_log_lock:
+        if _voter_log is None:
+            _voter_log = VoterLog(interval)
+    return _voter_log
+
+
+def cast_vote(poll_id, choice_id, voter=None):
+    """
+    Record a vote the way the site is configured to: through the
+    write-behind buffer if there is one, in shared memory if
+    POLLS_SHARED_VOTES_FILE is set, otherwise straight to the database,
+    across POLLS_VOTE_SHARDS shards of each choice if that's set, or with
+    record_vote().
+
+    With ``voter`` (see polls.dedup), their Voter is written along with
+    the vote, and AlreadyVoted is raised if they've voted on the poll
+    before.
+    """
+    vote_buffer = get_vote_buffer()
+    counters = get_shared_counters()
+    shards = getattr(settings, 'POLLS_VOTE_SHARDS', None)
+    if vote_buffer is not None:
+        vote_buffer.add(poll_id, choice_id, voter)
+    elif counters is not None:
+        record_shared_vote(counters, poll_id, choice_id, voter)
+    elif shards:
+        record_sharded_vote(poll_id, choice_id, shards, voter)
+    else:
+        record_vote(poll_id, choice_id, voter)
+
+    leaderboard = get_leaderboard()
+    if leaderboard is not None:
+        leaderboard.add(poll_id)
+
+
+@receiver(post_delete, sender=Choice)
+def choice_deleted(sender, instance, **kwargs):
+    # Also sent for each choice of a deleted poll.
+    _shared_choices.pop(instance.id, None)
+    if _vote_buffer is not None:
+        _vote_buffer.forget_choice(instance.id)